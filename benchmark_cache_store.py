@@ -0,0 +1,134 @@
+"""
+Benchmark the folder cache backends (cache_store.py) on synthetic listings.
+
+For each size (default 10k and 100k folders) and backend, measures:
+    write  - put_listing for every folder (+ one lesson object per 10 folders)
+    load   - reopen the store and get_listing every folder (cold load)
+    scan   - drive_changes.compute_affected_folder_ids for 10 changes (parent index lookups;
+             the file store loads cache/parent_index.json once)
+    clear  - clear_listings + clear_lessons
+and the size on disk. Runs in a temporary directory; nothing under cache/ is touched.
+
+usage: python benchmark_cache_store.py [--sizes 10000 100000] [--items 8]
+"""
+import os
+import time
+import shutil
+import argparse
+import tempfile
+from datetime import datetime
+
+import cache_store
+import drive_changes
+
+
+def _synthetic_listing(folder_index, items_per_folder):
+    """One folder listing shaped like _store_folder_listing output."""
+    folder_id = f"folder{folder_index:07d}"
+    items = []
+    for i in range(items_per_folder):
+        items.append({
+            "id": f"{folder_id}-file{i}",
+            "name": f"{i} דף עבודה {folder_index}.pdf",
+            "mimeType": "application/pdf",
+            "modifiedTime": "2025-01-01T10:00:00.000Z",
+            "md5Checksum": "0123456789abcdef0123456789abcdef",
+            "version": "12",
+            "size": "123456",
+        })
+    return folder_id, {
+        "folder_id": folder_id,
+        "modified_time": "2025-01-01T10:00:00.000Z",
+        "cached_at": datetime.now().isoformat(),
+        "items": items,
+    }
+
+
+def _synthetic_lesson(folder_id, items):
+    return {
+        "modified_time": "2025-01-01T10:00:00.000Z",
+        "cached_at": datetime.now().isoformat(),
+        "lesson_obj": {
+            "name": folder_id,
+            "desc": "<p>תיאור השיעור</p>" * 5,
+            "content": [{"type": "file", "name": i["name"], "url": f"https://drive.google.com/file/d/{i['id']}/view",
+                         "file_extension": "pdf"} for i in items],
+            "lesson_json": {},
+        },
+    }
+
+
+def _disk_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def _open(backend, root):
+    return cache_store.open_cache_store(
+        backend,
+        os.path.join(root, 'folder_listings'),
+        os.path.join(root, 'lesson_objects'),
+        os.path.join(root, 'cache.sqlite3'),
+        os.path.join(root, 'parent_index.json'),
+    )
+
+
+def run(backend, size, items_per_folder):
+    """Return {phase: seconds, 'bytes': n} for one backend and size."""
+    root = tempfile.mkdtemp(prefix=f'cache-bench-{backend}-')
+    timings = {}
+    try:
+        listings = [_synthetic_listing(i, items_per_folder) for i in range(size)]
+
+        store = _open(backend, root)
+        start = time.perf_counter()
+        for index, (folder_id, data) in enumerate(listings):
+            store.put_listing(folder_id, data)
+            if index % 10 == 0:
+                store.put_lesson(folder_id, _synthetic_lesson(folder_id, data['items']))
+        timings['write'] = time.perf_counter() - start
+        store.close()
+        timings['bytes'] = _disk_size(root)
+
+        store = _open(backend, root)
+        start = time.perf_counter()
+        for folder_id, _ in listings:
+            store.get_listing(folder_id)
+        timings['load'] = time.perf_counter() - start
+
+        changes = [{'fileId': f"folder{i:07d}-file0", 'removed': False} for i in range(0, size, max(1, size // 10))]
+        start = time.perf_counter()
+        drive_changes.compute_affected_folder_ids(changes, store)
+        timings['scan'] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        store.clear_listings()
+        store.clear_lessons()
+        timings['clear'] = time.perf_counter() - start
+        store.close()
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark folder cache backends.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000], help='Numbers of folders to benchmark')
+    parser.add_argument('--items', type=int, default=8, help='Items per folder listing')
+    args = parser.parse_args()
+
+    print(f"{'folders':>8} {'backend':>8} {'write s':>9} {'load s':>9} {'scan s':>9} {'clear s':>9} {'disk MB':>9}")
+    for size in args.sizes:
+        for backend in cache_store.BACKENDS:
+            t = run(backend, size, args.items)
+            print(f"{size:>8} {backend:>8} {t['write']:>9.2f} {t['load']:>9.2f} {t['scan']:>9.2f} "
+                  f"{t['clear']:>9.2f} {t['bytes'] / 1e6:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+"""
+Benchmark generate_data crawl modes against a fake Drive (drive_fake.py).
+
+For each tree size (lessons, default 10 100 1000 10000) and option set, runs in a fresh
+temporary directory:
+    cold       - empty cache, no changes state (first run / fresh CI runner)
+    warm       - nothing changed since the previous run
+    changes-N  - N edits (README rewrites and file renames in random lessons) since the previous run
+and reports wall time, API calls (files.list/get/get_media, changes.*) and HTTP round trips
+(a batch request is one round trip). Nothing under cache/ or data/ is touched.
+
+Option sets: sequential, workers (8 threads), batch, bfs, snapshot, patch (--patch-changes),
+processes (4 class crawl processes, each with its own copy of the fake).
+
+    python benchmark_crawl.py [--sizes 10 100] [--options sequential batch] [--changes 1 10]
+                              [--latency 0.05] [--quota-errors 0.01] [--json results.json]
+
+Record a real crawl (cold then warm, sequential) into a cassette, and benchmark against it:
+    python benchmark_crawl.py --record cassette.json
+    python benchmark_crawl.py --replay cassette.json [--options sequential batch]
+Replays must use the class_info and option sets the cassette was recorded with to find every request.
+"""
+import io
+import os
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import contextlib
+
+from googleapiclient.errors import HttpError
+
+import drive_fake
+import drive_metrics
+import drive_to_class_json as dtj
+
+OPTION_SETS = {
+    'sequential': {},
+    'workers': {'workers': 8},
+    'batch': {'batch': True},
+    'bfs': {'bfs': True},
+    'snapshot': {'snapshot': True},
+    'patch': {'patch_changes': True},
+    'processes': {'processes': 4},
+}
+
+
+def _edit_lessons(service, count, rng):
+    """Make count edits in random lessons: rewrite a README or rename a PDF."""
+    readmes = [f for f in service.files_by_id.values() if f['name'] == 'README.md']
+    pdfs = [f for f in service.files_by_id.values() if f['name'].endswith('.pdf') and f['name'].startswith('דף')]
+    for i in range(count):
+        if i % 2 == 0 and readmes:
+            readme = rng.choice(readmes)
+            service.edit(readme['id'], content=f'# שיעור\n\nעריכה {i} {rng.random()}'.encode('utf-8'))
+        elif pdfs:
+            pdf = rng.choice(pdfs)
+            service.edit(pdf['id'], name=f'דף עבודה מעודכן {i}.pdf')
+
+
+def _crawl(service, classes, options, mode):
+    """One generate_data run; returns {mode, seconds, calls, round_trips, api_calls, retries[, error]}."""
+    service.reset_counters()
+    error = None
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            dtj.generate_data(use_cache=True, service=service, classes=classes, **options)
+    except HttpError as e:
+        error = f'HTTP {e.resp.status} {e.reason}'
+    result = {'mode': mode, 'seconds': time.perf_counter() - start, 'calls': dict(service.calls),
+              'round_trips': service.round_trips,
+              'api_calls': sum(n for kind, n in service.calls.items() if kind != 'batch')}
+    if error is None:
+        with open(drive_metrics.REPORT_PATH, 'r', encoding='utf-8') as f:
+            report = json.load(f)
+        # Counted by generate_data itself, so calls made in crawl worker processes are included
+        result['calls'] = {kind: stats['count'] for kind, stats in report['calls'].items()}
+        result['api_calls'] = report['total_calls']
+        result['round_trips'] = report['round_trips']
+        result['retries'] = report['scheduler']['retries']
+        if report['failed_classes']:
+            error = f"{len(report['failed_classes'])} classes kept their last JSON"
+    if error:
+        result['error'] = error
+    return result
+
+
+def _in_temp_dir(run):
+    """Run run() with the working directory (cache/, data/, changes_api/) in a fresh temp dir."""
+    cwd = os.getcwd()
+    root = tempfile.mkdtemp(prefix='crawl-bench-')
+    os.chdir(root)
+    try:
+        return run()
+    finally:
+        # The cache store keeps relative paths: close it before leaving the directory
+        if dtj.CACHE_STORE is not None:
+            dtj.CACHE_STORE.close()
+            dtj.CACHE_STORE = None
+        os.chdir(cwd)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def run(size, option_name, change_counts, latency=0.0, quota_error_rate=0.0, classes=2, seed=0, crawl_options=None):
+    """Return [{mode, seconds, calls, round_trips, api_calls}] for one tree size and option set."""
+    files, roots = drive_fake.synthetic_tree(lessons=size, classes=classes, seed=seed)
+    service = drive_fake.FakeDriveService(files, latency=latency, quota_error_rate=quota_error_rate, seed=seed)
+    class_entries = drive_fake.fake_class_info(roots)
+    options = dict(OPTION_SETS[option_name], **(crawl_options or {}))
+    rng = random.Random(seed)
+
+    def modes():
+        results = []
+        for mode in ['cold', 'warm'] + [f'changes-{n}' for n in change_counts]:
+            if mode.startswith('changes-'):
+                _edit_lessons(service, int(mode.split('-')[1]), rng)
+            results.append(_crawl(service, class_entries, options, mode))
+            if 'error' in results[-1]:
+                # The crawl aborted: later modes would not start from a complete cache
+                break
+        return results
+    return _in_temp_dir(modes)
+
+
+def record(path):
+    """Crawl the real Drive (class_info) cold then warm, recording every response into path."""
+    service = drive_fake.RecordingDriveService(dtj.get_drive_service(), path)
+
+    def crawl():
+        for _ in ('cold', 'warm'):
+            with contextlib.redirect_stdout(io.StringIO()):
+                dtj.generate_data(use_cache=True, service=service)
+    _in_temp_dir(crawl)
+    service.save()
+    print(f"Recorded {sum(len(v) for v in service.interactions.values())} responses to {path}")
+
+
+def replay(path, option_name, latency=0.0, quota_error_rate=0.0, crawl_options=None):
+    """Crawl class_info cold then warm against a cassette."""
+    service = drive_fake.ReplayDriveService(path, latency=latency, quota_error_rate=quota_error_rate)
+    options = dict(OPTION_SETS[option_name], **(crawl_options or {}))
+
+    def modes():
+        results = []
+        for mode in ('cold', 'warm'):
+            results.append(_crawl(service, dtj.class_info, options, mode))
+            if 'error' in results[-1]:
+                break
+        return results
+    return _in_temp_dir(modes)
+
+
+def _print_row(size, option_name, result):
+    calls = result['calls']
+    print(f"{size:>8} {option_name:>10} {result['mode']:>11} {result['seconds']:>9.2f} {result['api_calls']:>9} "
+          f"{result['round_trips']:>9} {calls.get('files.list', 0):>7} {calls.get('files.get', 0):>7} "
+          f"{calls.get('files.get_media', 0):>7} {result.get('retries', 0):>7}"
+          + (f"  failed: {result['error']}" if 'error' in result else ''))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark crawl modes against a fake Drive.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 1000, 10000], help='Lessons per tree')
+    parser.add_argument('--options', nargs='+', default=list(OPTION_SETS), choices=list(OPTION_SETS),
+                        help='Option sets to benchmark')
+    parser.add_argument('--changes', type=int, nargs='+', default=[10], help='Edit counts for changes-N runs')
+    parser.add_argument('--latency', type=float, default=0.0, help='Seconds per Drive round trip')
+    parser.add_argument('--quota-errors', type=float, default=0.0, help='Fraction of calls failing with 403')
+    parser.add_argument('--rate-limit', type=float, default=0, help='Scheduler calls per second (default: unlimited)')
+    parser.add_argument('--call-budget', type=int, help='Scheduler call budget per crawl')
+    parser.add_argument('--backoff-base', type=float, default=dtj.DRIVE_BACKOFF_BASE, help='First retry backoff in seconds')
+    parser.add_argument('--json', help='Also write the results to this JSON file')
+    parser.add_argument('--record', metavar='CASSETTE', help='Record a real crawl of class_info and exit')
+    parser.add_argument('--replay', metavar='CASSETTE', help='Benchmark against a recorded cassette')
+    args = parser.parse_args()
+
+    dtj.SCHEMA_PATH = os.path.abspath(dtj.SCHEMA_PATH)
+    dtj.DRIVE_BACKOFF_BASE = args.backoff_base
+    crawl_options = {'rate_limit': args.rate_limit, 'call_budget': args.call_budget}
+    if args.record:
+        record(args.record)
+        return
+
+    print(f"{'lessons':>8} {'options':>10} {'mode':>11} {'wall s':>9} {'api calls':>9} {'trips':>9} "
+          f"{'list':>7} {'get':>7} {'media':>7} {'retries':>7}")
+    report = []
+    for option_name in args.options:
+        if args.replay:
+            for result in replay(args.replay, option_name, args.latency, args.quota_errors, crawl_options):
+                _print_row('replay', option_name, result)
+                report.append(dict(result, size='replay', options=option_name))
+            continue
+        for size in args.sizes:
+            for result in run(size, option_name, args.changes, args.latency, args.quota_errors,
+                              crawl_options=crawl_options):
+                _print_row(size, option_name, result)
+                report.append(dict(result, size=size, options=option_name))
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,13 +3,22 @@ import shutil
 import json
 import subprocess
 import argparse
-from jinja2 import Environment, FileSystemLoader
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import jinja2
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache, ModuleLoader, meta
 import logging
 from datetime import datetime
 import pytz
+import icalendar
 from icalendar import Calendar, Event
 from logger import log_event
 from drive_to_class_json import SITE_CATEGORIES
+import cache_lock
+import cache_snapshot
+import site_manifest
+import template_profile
 
 # Paths & Constants
 BASE_URL = "https://erezmath.github.io"
@@ -20,6 +29,10 @@ DATA_DIR = 'data'
 #DIST_DIR = 'dist'
 DIST_DIR = 'docs'
 CALENDAR_DIR = os.path.join(DIST_DIR, 'calendar')
+# Compiled templates, reused while a template's source is unchanged (None: compile on every build)
+TEMPLATE_BYTECODE_DIR = os.path.join('cache', 'jinja_bytecode')
+# --precompile-templates: the templates compiled into Python modules, one directory per version of the sources
+PRECOMPILED_TEMPLATES_DIR = os.path.join('cache', 'jinja_modules')
 
 # Argument parsing for optional data regeneration
 # if --regen-data is passed, the data will be regenerated from the data directory,
@@ -27,23 +40,100 @@ CALENDAR_DIR = os.path.join(DIST_DIR, 'calendar')
 # otherwise, the data will be loaded from the data/ directory
 # --clear-cache clears folder listing and lesson caches before regen (e.g. python build_site.py --regen-data --clear-cache)
 # --no-cache disables all caching inside drive_to_class_json (full fetch, for testing/major changes)
-parser = argparse.ArgumentParser(description='Build the static site.')
-parser.add_argument('--regen-data', action='store_true', help='Regenerate class JSON data before building')
-parser.add_argument('--clear-cache', action='store_true', help='Clear folder/lesson cache before regenerating data (use with --regen-data)')
-parser.add_argument('--no-cache', action='store_true', help='Regenerate data without any caching (slow, but safest for major changes)')
-args = parser.parse_args()
-
-if args.clear_cache:
-    from drive_to_class_json import clear_folder_listing_cache
-    clear_folder_listing_cache()
-    log_event('Cleared folder listing and lesson caches')
-
-if args.regen_data:
-    from drive_to_class_json import generate_data
-    log_event('Regenerating data with drive_to_class_json.generate_data')
-    use_cache = not args.no_cache
-    generate_data(use_cache=use_cache)
-    log_event('Data regeneration complete')
+# --batch coalesces Drive folder listing/metadata requests into HTTP batch requests (up to 100 per round trip)
+# --bfs lists each class folder tree level by level, combining many folders into one Drive query
+# --snapshot lists the whole Drive once on a cold start (no cache/changes_state.json) instead of folder by folder
+# --cache-backend sqlite keeps the folder/lesson cache in one SQLite file (cache/cache.sqlite3) instead of one JSON file per folder
+# --patch-changes applies Drive changes to the cached folder listings in place instead of refetching the changed folders
+# --workers N crawls Google Drive with N concurrent threads (e.g. python build_site.py --regen-data --workers 8)
+# --rate-limit N caps Drive calls per second, --call-budget N caps Drive calls per run (current classes are crawled first)
+# --processes N crawls N classes at a time in worker processes (each with --workers threads)
+# --classes A B crawls these classes (url_name) even if Drive reports no changes in them; the others are crawled only when changed
+# --import-cache [PATH] restores cache/ from a snapshot archive (default cache_snapshot.tar.gz) before regenerating,
+#   --export-cache [PATH] saves cache/ to one afterwards (for CI runners that start without cache/, see cache_snapshot.py)
+# --migrate-cache upgrades every cache entry to the current format now (otherwise each is upgraded when first read)
+# --gc-cache removes cache entries no class in class_info reaches now (--regen-data does it once a day by itself)
+# the site is built incrementally: only pages and calendars whose inputs changed are rendered, only changed files
+#   are written, and files no longer produced are removed (see site_manifest.py); --full-build deletes docs/ and
+#   renders everything
+# --jobs N renders class pages and calendars in N worker processes (e.g. python build_site.py --jobs 4)
+# --precompile-templates loads the templates from Python modules compiled once per template change (see precompile_templates)
+# --template-timing logs the share of class page render time of each template block and macro
+#   (e.g. python build_site.py --full-build --template-timing to time every page)
+def parse_args():
+    parser = argparse.ArgumentParser(description='Build the static site.')
+    parser.add_argument('--regen-data', action='store_true', help='Regenerate class JSON data before building')
+    parser.add_argument('--clear-cache', action='store_true', help='Clear folder/lesson cache before regenerating data (use with --regen-data)')
+    parser.add_argument('--no-cache', action='store_true', help='Regenerate data without any caching (slow, but safest for major changes)')
+    parser.add_argument('--batch', action='store_true', help='Send Drive listing/metadata requests as HTTP batches when regenerating data')
+    parser.add_argument('--bfs', action='store_true', help='List class folder trees level by level with multi-parent Drive queries when regenerating data')
+    parser.add_argument('--snapshot', action='store_true', help='On a cold start, list the whole Drive once and serve folder listings from memory')
+    parser.add_argument('--workers', type=int, default=1, help='Number of concurrent Drive crawl threads when regenerating data (default: 1, sequential)')
+    parser.add_argument('--cache-backend', choices=['files', 'sqlite'], default='files', help="Cache storage: 'files' (one JSON file per folder, default) or 'sqlite' (single database file)")
+    parser.add_argument('--patch-changes', action='store_true', help='Apply Drive changes to cached listings in place instead of refetching changed folders')
+    parser.add_argument('--rate-limit', type=float, default=None, help='Maximum Drive calls per second (default: DRIVE_RATE_LIMIT, 0 = unlimited)')
+    parser.add_argument('--call-budget', type=int, default=None, help='Maximum Drive calls per run; classes that do not fit keep their last JSON')
+    parser.add_argument('--processes', type=int, default=1, help='Number of worker processes crawling classes in parallel when regenerating data (default: 1)')
+    parser.add_argument('--import-cache', nargs='?', const=cache_snapshot.SNAPSHOT_PATH, metavar='PATH', help='Restore cache/ from this snapshot archive first; a missing or damaged archive means a cold crawl')
+    parser.add_argument('--export-cache', nargs='?', const=cache_snapshot.SNAPSHOT_PATH, metavar='PATH', help='Save cache/ to this snapshot archive after regenerating data')
+    parser.add_argument('--migrate-cache', action='store_true', help='Upgrade every cache entry to the current cache format before regenerating (entries that cannot be upgraded are dropped)')
+    parser.add_argument('--gc-cache', action='store_true', help='Remove cache entries of folders no class reaches and compact changes_api/ (after regenerating, if requested)')
+    parser.add_argument('--classes', nargs='+', metavar='URL_NAME', help='Crawl these classes (class_info url_name) even when Drive reports no changes in them')
+    parser.add_argument('--full-build', action='store_true', help='Delete the site directory and render every page, instead of only the changed ones')
+    parser.add_argument('--jobs', type=int, default=1, help='Number of worker processes rendering class pages and calendars (default: 1, in this process)')
+    parser.add_argument('--precompile-templates', action='store_true', help='Compile the templates into Python modules (once per template change) and render from those')
+    parser.add_argument('--template-timing', action='store_true', help='Profile the class page renders and log the time spent in each template block and macro (renders in this process)')
+    return parser.parse_args()
+
+
+def regenerate_data(args):
+    """
+    --import-cache, --clear-cache, --migrate-cache, --regen-data, --gc-cache and --export-cache,
+    holding the cache lock (see cache_lock.py) throughout.
+    Returns the url_names of the class JSON files written, or None without --regen-data.
+    """
+    with cache_lock.cache_lock():
+        return _regenerate_data(args)
+
+
+def _regenerate_data(args):
+    if args.import_cache:
+        cache_snapshot.import_snapshot(args.import_cache)
+
+    if args.clear_cache:
+        from drive_to_class_json import clear_folder_listing_cache, set_cache_backend
+        set_cache_backend(args.cache_backend)
+        clear_folder_listing_cache()
+        log_event('Cleared folder listing and lesson caches')
+
+    if args.migrate_cache:
+        from drive_to_class_json import migrate_cache
+        migrate_cache(args.cache_backend)
+
+    if args.regen_data:
+        from drive_to_class_json import generate_data
+        log_event('Regenerating data with drive_to_class_json.generate_data')
+        use_cache = not args.no_cache
+        written = generate_data(use_cache=use_cache, workers=args.workers, batch=args.batch, bfs=args.bfs, snapshot=args.snapshot, cache_backend=args.cache_backend, patch_changes=args.patch_changes,
+                      rate_limit=args.rate_limit, call_budget=args.call_budget, processes=args.processes,
+                                force_classes=args.classes)
+        log_event('Data regeneration complete')
+    else:
+        written = None
+
+    if args.gc_cache:
+        from drive_to_class_json import collect_cache_garbage, set_cache_backend
+        set_cache_backend(args.cache_backend)
+        collect_cache_garbage(force=True)
+
+    if args.export_cache:
+        try:
+            cache_snapshot.export_snapshot(args.export_cache)
+        except (cache_snapshot.SnapshotError, OSError) as e:
+            log_event(f'Could not export cache snapshot: {e}')
+            print(f'Could not export cache snapshot: {e}')
+    return written
+
 
 # Ensure dist exists before any file operations
 if not os.path.exists(DIST_DIR):
@@ -52,19 +142,60 @@ if not os.path.exists(DIST_DIR):
 
 ########################################################
 # Jinja2 setup
-env = Environment(
-    loader=FileSystemLoader(TEMPLATES_DIR), 
-    autoescape=True,
-    trim_blocks=True,      # Added this
-    lstrip_blocks=True     # Added this
-)
 
 # Jinja2 custom filter for highlighting future due dates differently in the html.
 # currently disabled, not working as expected, and i preferred to implement it in javascript.
 def is_future_date(date_string):
     return datetime.strptime(date_string, "%d.%m.%y") > datetime.now()
 
-env.tests["future_date"] = is_future_date
+# Template sources (for hashing them), whichever loader renders them
+source_loader = FileSystemLoader(TEMPLATES_DIR)
+
+def create_env(precompiled_dir=None):
+    """
+    A Jinja2 environment for the templates (one per process: render workers build their own).
+    Templates are compiled once per change of their source (bytecode cache in TEMPLATE_BYTECODE_DIR),
+    or loaded from precompiled_dir (see precompile_templates).
+    """
+    if precompiled_dir:
+        loader, bytecode_cache = ModuleLoader(precompiled_dir), None
+    else:
+        loader, bytecode_cache = source_loader, None
+        if TEMPLATE_BYTECODE_DIR:
+            # The cache checks a template's source checksum before using its bytecode
+            os.makedirs(TEMPLATE_BYTECODE_DIR, exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(TEMPLATE_BYTECODE_DIR)
+    new_env = Environment(
+        loader=loader, 
+        bytecode_cache=bytecode_cache,
+        autoescape=True,
+        trim_blocks=True,      # Added this
+        lstrip_blocks=True     # Added this
+    )
+    new_env.tests["future_date"] = is_future_date
+    return new_env
+
+env = create_env()
+
+def precompile_templates():
+    """
+    Compile every template into a Python module under PRECOMPILED_TEMPLATES_DIR, in a directory named
+    after the template sources and the Jinja2 version (so a changed template gets a new one, and older
+    ones are removed). Returns the directory; an existing one is reused without compiling.
+    """
+    names = source_loader.list_templates()
+    digest = site_manifest.hash_inputs(jinja2.__version__, [[name, source_loader.get_source(env, name)[0]] for name in names])
+    target = os.path.join(PRECOMPILED_TEMPLATES_DIR, digest[:16])
+    if not os.path.isdir(target):
+        partial = target + '.tmp'
+        shutil.rmtree(partial, ignore_errors=True)
+        create_env().compile_templates(partial, zip=None, ignore_errors=False)
+        os.replace(partial, target)
+        log_event(f'Precompiled {len(names)} templates into {target}')
+    for other in os.listdir(PRECOMPILED_TEMPLATES_DIR):
+        if other != os.path.basename(target):
+            shutil.rmtree(os.path.join(PRECOMPILED_TEMPLATES_DIR, other), ignore_errors=True)
+    return target
 
 
 ########################################################
@@ -88,177 +219,335 @@ def minify_html(html_content):
     non_blank_lines = [line for line in lines if line.strip()]
     return '\n'.join(non_blank_lines)
 
-def load_class_jsons():
-    """Load all class JSON files from the data directory."""
-    class_files = [f for f in os.listdir(DATA_DIR) if f.endswith('.json')]
-    classes = []
-    for filename in class_files:
-        with open(os.path.join(DATA_DIR, filename), encoding='utf-8') as f:
-            class_data = json.load(f)
-            # Keep the id as is (unique numeric ID from JSON)
-            classes.append(class_data)
-    log_event(f'Loaded {len(classes)} class JSON files')
-    return classes
-
-def render_index(classes):
-    """Render the main index.html page from class summaries."""
-    template = env.get_template('index.html')
-    # For index, pass only summary info for each class
-    class_summaries = [
-        {
-            'id': c.get('id', ''),  # Use the hardcoded id from JSON
-            'url_name': c.get('url_name', ''),
-            'category': c.get('category', 'past'),
-            'name': c.get('name', ''),
-            'desc': c.get('desc', ''),
-            'banner_url': c.get('banner_url', ''),
-            'tags': c.get('tags', ''),
-            'num_topics': len(c.get('topics', [])),
-            'num_lessons': sum(len(t.get('lessons', [])) for t in c.get('topics', [])),
-            'drive_url': c.get('drive_url', '')
-        }
-        for c in classes
+def _html_bytes(html):
+    """The bytes a text-mode write of html produces (os.linesep newlines), for comparing with the file on disk."""
+    return html.replace('\n', os.linesep).encode('utf-8')
+
+def _url_name(c):
+    return c.get('url_name', '') or c.get('name', '').replace(' ', '_')
+
+def template_hash(name, manifest, _seen=None):
+    """Digest of a template's source and of every template it extends, includes or imports."""
+    seen = set() if _seen is None else _seen
+    seen.add(name)
+    source, _, _ = source_loader.get_source(env, name)
+    source_hash = site_manifest.hash_inputs(source)
+    # Parsing is most of the cost of a build without changes: keep the references by source hash
+    referenced = manifest.derived(f'template-references:{name}', source_hash, lambda: sorted(
+        filter(None, meta.find_referenced_templates(env.parse(source)))
+    ))
+    parts = [name, source_hash]
+    for other in referenced:
+        if other not in seen:
+            parts.append(template_hash(other, manifest, seen))
+    return site_manifest.hash_inputs(*parts)
+
+def build_settings(manifest):
+    """Everything besides data and templates that shapes the outputs: the build code, its settings and renderers."""
+    return {
+        'code': manifest.file_hash(__file__),
+        'base_url': BASE_URL,
+        'categories': SITE_CATEGORIES,
+        'jinja2': jinja2.__version__,
+        'icalendar': icalendar.__version__,
+        'linesep': os.linesep,
+    }
+
+def class_json_paths():
+    """The class JSON files in the data directory (in directory order, which is the navigation order)."""
+    return [os.path.join(DATA_DIR, f) for f in os.listdir(DATA_DIR) if f.endswith('.json')]
+
+def load_class_json(path):
+    """Load one class JSON file."""
+    with open(path, encoding='utf-8') as f:
+        # Keep the id as is (unique numeric ID from JSON)
+        return json.load(f)
+
+def class_summary(c):
+    """What the index and the navigation need of a class (all that is kept in memory of every class)."""
+    return {
+        'id': c.get('id', ''),  # Use the hardcoded id from JSON
+        'url_name': c.get('url_name', ''),
+        'category': c.get('category', 'past'),
+        'name': c.get('name', ''),
+        'desc': c.get('desc', ''),
+        'banner_url': c.get('banner_url', ''),
+        'tags': c.get('tags', ''),
+        'num_topics': len(c.get('topics', [])),
+        'num_lessons': sum(len(t.get('lessons', [])) for t in c.get('topics', [])),
+        'drive_url': c.get('drive_url', '')
+    }
+
+def load_class_summaries(paths, data_hashes, manifest):
+    """
+    The summary of each class JSON file (data_hashes: their hashes), one file loaded at a time.
+    Summaries are kept in the site manifest by file hash, so unchanged files are not read at all.
+    """
+    summaries = [
+        manifest.derived(f'class-summary:{os.path.basename(path)}', data_hash,
+                         lambda path=path: class_summary(load_class_json(path)))
+        for path, data_hash in zip(paths, data_hashes)
     ]
-    html = template.render(classes=class_summaries, categories=SITE_CATEGORIES)
+    log_event(f'Indexed {len(summaries)} class JSON files')
+    return summaries
+
+def render_index(summaries, manifest, settings):
+    """Render the main index.html page from class summaries (skipped when they and the templates are unchanged)."""
+    inputs = site_manifest.hash_inputs('index', template_hash('index.html', manifest), summaries, settings)
+    if manifest.up_to_date('index.html', inputs):
+        return
+    template = env.get_template('index.html')
+    html = template.render(classes=summaries, categories=SITE_CATEGORIES)
     html = minify_html(html)  # minify html strip for blank lines
-    with open(os.path.join(DIST_DIR, 'index.html'), 'w', encoding='utf-8') as f:
-        f.write(html)
+    manifest.write('index.html', _html_bytes(html), inputs)
     log_event('Rendered index.html')
 
-def render_class_pages(classes):
-    """Render an HTML page for each class."""
-    template = env.get_template('class.html')
-    for c in classes:
-        url_name = c.get('url_name', '') or c.get('name', '').replace(' ', '_')
-        html = template.render(class_info=c, classes=classes, categories=SITE_CATEGORIES)
-        html = minify_html(html)  # minify html strip for blank lines
-        filename = f'class-{url_name}.html'
-        with open(os.path.join(DIST_DIR, filename), 'w', encoding='utf-8') as f:
-            f.write(html)
-    log_event('Rendered all class pages')
-
-def generate_calendars(classes):
-    """Generate separate .ics calendar files for lessons and due dates under calendar/ directory."""
-    if not os.path.exists(CALENDAR_DIR):
-        os.makedirs(CALENDAR_DIR)
-
-    for c in classes:
-        url_name = c.get('url_name', '') or c.get('name', '').replace(' ', '_')
-        class_name = c.get('name', 'שיעורי מתמטיקה')
-        base_url = f"{BASE_URL}/class-{url_name}.html"
-
-        # 1. Calendar for Lesson Dates
-        lessons_cal = Calendar()
-        lessons_cal.add('prodid', f'-//ErezMath//Class {url_name} Lessons//HE')
-        lessons_cal.add('version', '2.0')
-        lessons_cal.add('calscale', 'GREGORIAN')
-        lessons_cal.add('x-wr-calname', f"{class_name} - שיעורים")
-
-        # 2. Calendar for Homework/Due Dates
-        due_cal = Calendar()
-        due_cal.add('prodid', f'-//ErezMath//Class {url_name} Due Dates//HE')
-        due_cal.add('version', '2.0')
-        due_cal.add('calscale', 'GREGORIAN')
-        due_cal.add('x-wr-calname', f"{class_name} - משימות וש.ב")
-
-        for topic in c.get('topics', []):
-            topic_name = topic.get('name', '')
-            for lesson in topic.get('lessons', []):
-                lesson_json = lesson.get('lesson_json')
-                if not lesson_json:
-                    continue
-
-                lesson_name = lesson.get('name', '')
-                lesson_id = lesson.get('id', '')
-                lesson_url = f"{base_url}#{lesson_id}" if lesson_id else base_url
-
-                # Populate Lessons Calendar
-                lesson_date_str = lesson_json.get('lesson_date')
-                lesson_date = parse_date_str(lesson_date_str)
-                if lesson_date:
-                    event = Event()
-                    event.add('summary', f"{topic_name} / {lesson_name}")
-                    event.add('dtstart', lesson_date)
-                    event.add('url', lesson_url)
-                    event.add('description', f"קישור לשיעור באתר:\n{lesson_url}")
-                    event.add('uid', f"lesson-{lesson_id}-{lesson_date_str}@erezmath")
-                    lessons_cal.add_component(event)
-
-                # Populate Due Dates Calendar
-                due_date_str = lesson_json.get('due_date')
-                due_date = parse_date_str(due_date_str)
-                if due_date:
-                    due_event = Event()
-                    due_event.add('summary', f"ש.ב {topic_name} / {lesson_name}")
-                    due_event.add('dtstart', due_date)
-                    due_event.add('url', lesson_url)
-                    due_event.add('description', f"קישור למשימה באתר:\n{lesson_url}")
-                    due_event.add('uid', f"due-{lesson_id}-{due_date_str}@erezmath")
-                    due_cal.add_component(due_event)
-
+class Navigation:
+    """
+    The dropdown menu of the class pages, rendered once from the class summaries. A page's menu only
+    differs in its own link, marked active: for_class swaps that one link (both versions rendered by
+    the nav_link macro of base.html) instead of rendering the menu again.
+    """
+
+    def __init__(self, render_env, summaries):
+        module = render_env.get_template('base.html').make_module({'categories': SITE_CATEGORIES})
+        self._nav_link = module.nav_link
+        self._render_menu = module.render_nav_menu
+        self.summaries = summaries
+        self.menu = self._render_menu(summaries)
+
+    def for_class(self, summary):
+        link = self._nav_link(summary, False)
+        if self.menu.count(link) != 1:
+            # Not in the menu (no such category) or the same link twice: render this page's menu in full
+            return self._render_menu(self.summaries, summary['id'])
+        return self.menu.replace(link, self._nav_link(summary, True))
+
+def render_class_page(template, c, summary, navigation, profile=None):
+    """The HTML page of class c, as the bytes written to the site. profile: a template_profile.TemplateProfile to time it in."""
+    with profile.measure() if profile else contextlib.nullcontext():
+        html = template.render(class_info=c, classes=navigation.summaries, nav_menu=navigation.for_class(summary),
+                               categories=SITE_CATEGORIES)
+    html = minify_html(html)  # minify html strip for blank lines
+    return _html_bytes(html)
+
+def class_calendars(c):
+    """The lessons and due dates .ics files of one class, as bytes."""
+    url_name = _url_name(c)
+    class_name = c.get('name', 'שיעורי מתמטיקה')
+    base_url = f"{BASE_URL}/class-{url_name}.html"
+
+    # 1. Calendar for Lesson Dates
+    lessons_cal = Calendar()
+    lessons_cal.add('prodid', f'-//ErezMath//Class {url_name} Lessons//HE')
+    lessons_cal.add('version', '2.0')
+    lessons_cal.add('calscale', 'GREGORIAN')
+    lessons_cal.add('x-wr-calname', f"{class_name} - שיעורים")
+
+    # 2. Calendar for Homework/Due Dates
+    due_cal = Calendar()
+    due_cal.add('prodid', f'-//ErezMath//Class {url_name} Due Dates//HE')
+    due_cal.add('version', '2.0')
+    due_cal.add('calscale', 'GREGORIAN')
+    due_cal.add('x-wr-calname', f"{class_name} - משימות וש.ב")
+
+    for topic in c.get('topics', []):
+        topic_name = topic.get('name', '')
+        for lesson in topic.get('lessons', []):
+            lesson_json = lesson.get('lesson_json')
+            if not lesson_json:
+                continue
+
+            lesson_name = lesson.get('name', '')
+            lesson_id = lesson.get('id', '')
+            lesson_url = f"{base_url}#{lesson_id}" if lesson_id else base_url
+
+            # Populate Lessons Calendar
+            lesson_date_str = lesson_json.get('lesson_date')
+            lesson_date = parse_date_str(lesson_date_str)
+            if lesson_date:
+                event = Event()
+                event.add('summary', f"{topic_name} / {lesson_name}")
+                event.add('dtstart', lesson_date)
+                event.add('url', lesson_url)
+                event.add('description', f"קישור לשיעור באתר:\n{lesson_url}")
+                event.add('uid', f"lesson-{lesson_id}-{lesson_date_str}@erezmath")
+                lessons_cal.add_component(event)
+
+            # Populate Due Dates Calendar
+            due_date_str = lesson_json.get('due_date')
+            due_date = parse_date_str(due_date_str)
+            if due_date:
+                due_event = Event()
+                due_event.add('summary', f"ש.ב {topic_name} / {lesson_name}")
+                due_event.add('dtstart', due_date)
+                due_event.add('url', lesson_url)
+                due_event.add('description', f"קישור למשימה באתר:\n{lesson_url}")
+                due_event.add('uid', f"due-{lesson_id}-{due_date_str}@erezmath")
+                due_cal.add_component(due_event)
+
+    return lessons_cal.to_ical(), due_cal.to_ical()
+
+def render_class(path, summary, template, navigation, page=True, calendars=True, profile=None):
+    """
+    Load one class JSON and render its page and/or calendars (the JSON is released when this returns).
+    Returns (page bytes or None, (lessons, due dates) .ics bytes or None).
+    """
+    c = load_class_json(path)
+    page_data = render_class_page(template, c, summary, navigation, profile) if page else None
+    calendar_data = class_calendars(c) if calendars else None
+    return page_data, calendar_data
+
+def render_classes(paths, data_hashes, summaries, manifest, settings, pool=None, profile=None):
+    """
+    Render the HTML page and the .ics calendars (under calendar/) of each class, one class JSON at a time.
+    data_hashes and summaries: of each class JSON file, in paths order.
+    A page is rendered again only when its class JSON, the navigation (every class's id, name,
+    url_name and category), the templates or the build settings changed; the calendars only when
+    the class JSON or the build settings changed. A class with neither is not loaded.
+    pool: render in these worker processes (see render_pool) instead of in this one.
+    profile: time the page renders in this template_profile.TemplateProfile (pool is then not used).
+    """
+    nav = [[s['id'], s['name'], s['url_name'], s['category']] for s in summaries]
+    template_digest = template_hash('class.html', manifest)
+    pending = []
+    for index, (data_hash, summary) in enumerate(zip(data_hashes, summaries)):
+        url_name = _url_name(summary)
+        page = f'class-{url_name}.html'
+        page_inputs = site_manifest.hash_inputs('class', template_digest, data_hash, nav, settings)
         # Write files to docs/calendar/
-        lessons_filename = f'class-{url_name}-lessons-calendar.ics'
-        with open(os.path.join(CALENDAR_DIR, lessons_filename), 'wb') as f:
-            f.write(lessons_cal.to_ical())
-
-        due_filename = f'class-{url_name}-due-calendar.ics'
-        with open(os.path.join(CALENDAR_DIR, due_filename), 'wb') as f:
-            f.write(due_cal.to_ical())
+        calendars = (f'calendar/class-{url_name}-lessons-calendar.ics', f'calendar/class-{url_name}-due-calendar.ics')
+        calendar_inputs = site_manifest.hash_inputs('calendars', data_hash, settings)
+        render_page = not manifest.up_to_date(page, page_inputs)
+        render_calendars = not all([manifest.up_to_date(name, calendar_inputs) for name in calendars])
+        if render_page or render_calendars:
+            pending.append((index, render_page, render_calendars, page, page_inputs, calendars, calendar_inputs))
+    if pool is not None and profile is None and len(pending) > 1:
+        results = pool.map(_render_class_in_worker, [task[:3] for task in pending])
+    else:
+        template = env.get_template('class.html') if pending else None
+        navigation = Navigation(env, summaries) if pending else None
+        results = (render_class(paths[index], summaries[index], template, navigation, render_page, render_calendars, profile)
+                   for index, render_page, render_calendars, *_ in pending)
+    # Written here, in class order, whichever process rendered them
+    for (_, _, _, page, page_inputs, calendars, calendar_inputs), (page_data, calendar_data) in zip(pending, results):
+        if page_data is not None:
+            manifest.write(page, page_data, page_inputs)
+        if calendar_data is not None:
+            for name, data in zip(calendars, calendar_data):
+                manifest.write(name, data, calendar_inputs)
+    log_event(f'Rendered {sum(task[1] for task in pending)} class pages and {sum(task[2] for task in pending)} '
+              f'calendar pairs of {len(summaries)} classes')
 
-    log_event('Generated all calendar files in calendar/ directory')
 
-def copy_static():
+########################################################
+# Render worker processes (--jobs)
+_RENDER_WORKER = {}
+
+def _init_render_worker(paths, summaries, precompiled_dir):
+    """Set up a render worker process: its own Jinja2 environment and navigation, and the classes it renders by index."""
+    worker_env = create_env(precompiled_dir)
+    _RENDER_WORKER['paths'] = paths
+    _RENDER_WORKER['summaries'] = summaries
+    _RENDER_WORKER['template'] = worker_env.get_template('class.html')
+    _RENDER_WORKER['navigation'] = Navigation(worker_env, summaries)
+
+def _render_class_in_worker(task):
+    index, page, calendars = task
+    return render_class(_RENDER_WORKER['paths'][index], _RENDER_WORKER['summaries'][index],
+                        _RENDER_WORKER['template'], _RENDER_WORKER['navigation'], page, calendars)
+
+@contextlib.contextmanager
+def render_pool(paths, summaries, jobs, precompiled_dir=None):
+    """
+    A pool of jobs render worker processes for the classes in paths, or None when jobs <= 1.
+    precompiled_dir: the workers load the templates from there (see precompile_templates).
+    Workers start only when at least two classes need rendering; each gets the class summaries
+    once and loads the class JSON files it is given (tasks are class indexes). Outputs are returned
+    to this process and are the same bytes as when rendered here.
+    """
+    if jobs <= 1 or len(paths) < 2:
+        yield None
+        return
+    # spawn, as for crawl worker processes (see drive_to_class_json.generate_data): the default on Windows
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=min(jobs, len(paths)), mp_context=context,
+                             initializer=_init_render_worker, initargs=(paths, summaries, precompiled_dir)) as pool:
+        yield pool
+
+
+def copy_static(manifest):
     """Copy static assets to the output directory."""
-    static_dist = os.path.join(DIST_DIR, 'static')
-    if os.path.exists(static_dist):
-        shutil.rmtree(static_dist)
     if os.path.exists(STATIC_DIR):
-        shutil.copytree(STATIC_DIR, static_dist)
+        manifest.copy_tree(STATIC_DIR, 'static')
     else:
         print('Warning: static/ directory does not exist. No static assets copied.')
     log_event('Copied static assets')
 
-def copy_images():
+def copy_images(manifest):
     """Copy images to the output directory."""
-    images_dist = os.path.join(DIST_DIR, 'images')
-    if os.path.exists(images_dist):
-        shutil.rmtree(images_dist)
     if os.path.exists('images'):
-        shutil.copytree('images', images_dist)
+        manifest.copy_tree('images', 'images')
     else:
         print('Warning: images/ directory does not exist. No images copied.')
     log_event('Copied images')
 
-def copy_quizes():
+def copy_quizes(manifest):
     """Copy quizes to the output directory."""
-    quizes_dist = os.path.join(DIST_DIR, 'quizes')
-    if os.path.exists(quizes_dist):
-        shutil.rmtree(quizes_dist)
     if os.path.exists('quizes'):
-        shutil.copytree('quizes', quizes_dist)
+        manifest.copy_tree('quizes', 'quizes')
     else:
         print('Warning: quizes/ directory does not exist. No quizes copied.')
     log_event('Copied quizes')
 
 
-def main():
-    """Main build process: cleans output, loads data, renders pages, generates calendars, copies assets."""
+def main(full=False, jobs=1, precompile=False, template_timing=False):
+    """
+    Main build process: loads data, renders the pages and calendars whose inputs changed, copies assets
+    and removes stale outputs (see site_manifest.py). full: delete the output directory and render everything.
+    jobs: number of worker processes rendering class pages and calendars.
+    precompile: render from templates precompiled into Python modules (see precompile_templates).
+    template_timing: log the time spent in each block and macro of the class page renders (see template_profile.py).
+    Holds the cache lock (the manifest and the compiled templates live in cache/).
+    """
+    with cache_lock.cache_lock():
+        _main(full, jobs, precompile, template_timing)
+
+
+def _main(full, jobs, precompile, template_timing):
+    global env
     log_event('Main build process started')
     print('Main build process started!')
-    # Clean dist directory before building
-    if os.path.exists(DIST_DIR):
+    if full and os.path.exists(DIST_DIR):
+        # Clean dist directory before building
         shutil.rmtree(DIST_DIR)
-        
-    os.makedirs(DIST_DIR)
-    classes = load_class_jsons()
-    render_index(classes)
-    render_class_pages(classes)
-    generate_calendars(classes)
-    copy_static()
-    copy_images()
-    copy_quizes()
+    os.makedirs(DIST_DIR, exist_ok=True)
+    manifest = site_manifest.SiteManifest(DIST_DIR, full=full)
+    precompiled_dir = precompile_templates() if precompile else None
+    env = create_env(precompiled_dir)
+    profile = template_profile.TemplateProfile() if template_timing else None
+    settings = build_settings(manifest)
+    paths = class_json_paths()
+    data_hashes = [manifest.file_hash(path) for path in paths]
+    # Only the summaries of all classes are in memory at once: each class JSON is loaded when it is rendered
+    summaries = load_class_summaries(paths, data_hashes, manifest)
+    render_index(summaries, manifest, settings)
+    with render_pool(paths, summaries, jobs, precompiled_dir) as pool:
+        render_classes(paths, data_hashes, summaries, manifest, settings, pool, profile)
+    if profile is not None:
+        profile.log_report(env, ['class.html', 'base.html'], source_loader)
+    copy_static(manifest)
+    copy_images(manifest)
+    copy_quizes(manifest)
+    manifest.remove_stale()
+    manifest.save()
+    log_event(manifest.summary_line())
+    print(manifest.summary_line())
     log_event('Site built successfully!')
     print('site built successfully!')
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    # Not at import: --processes worker processes import this module again
+    args = parse_args()
+    regenerate_data(args)
+    main(full=args.full_build, jobs=args.jobs, precompile=args.precompile_templates, template_timing=args.template_timing)
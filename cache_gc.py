@@ -0,0 +1,109 @@
+"""
+Mark-and-sweep garbage collection and size cap for the crawl cache (see cache_store.py).
+
+Folders that were removed, moved out of every class, or belong to a class dropped from class_info
+keep their listing, lesson object and node entries forever, and blobs of replaced files stay under
+their old content key. collect() removes them:
+    mark  - walk the cached listings from the class roots: every folder reached, and the blob keys
+            of the files in them (blob_keys(item), see drive_to_class_json._blob_keys), are live;
+    sweep - delete every listing, lesson object and node of a folder not reached and every blob
+            not referenced (deleting a listing also drops it from the parent index);
+    cap   - while the remaining entries take more than max_bytes, evict whole blobs, nodes and
+            lesson objects in EVICTION_ORDER (cheapest to rebuild first), least recently written first.
+An evicted or swept entry is only a cache miss: the next crawl that needs it fetches it again.
+Listings of reachable folders are never evicted: a class without Drive changes is not crawled
+(drive_to_class_json._generate_data), and the child -> parent index the changes are mapped to
+folders with (drive_changes.compute_affected_folder_ids) is built from the listings, so a missing
+listing would hide later edits below it.
+
+drive_to_class_json.collect_cache_garbage() runs it at the end of generate_data (at most every
+CACHE_GC_INTERVAL_HOURS) together with drive_changes.compact_changes().
+"""
+import time
+from logger import log_event
+
+FOLDER_MIME_TYPE = 'application/vnd.google-apps.folder'
+# Blobs are downloaded again by md5, nodes and lesson objects rebuilt from listings
+EVICTION_ORDER = ('blob', 'node', 'lesson')
+# Swept when unreachable, never evicted (see above)
+KINDS = EVICTION_ORDER + ('listing',)
+_DELETE_METHODS = {'listing': 'delete_listing', 'lesson': 'delete_lesson', 'node': 'delete_nodes', 'blob': 'delete_blob'}
+
+
+def mark(store, root_ids, blob_keys):
+    """Return (folder ids, blob keys) reachable from root_ids through the cached listings."""
+    folders = set()
+    blobs = set()
+    stack = list(root_ids)
+    while stack:
+        folder_id = stack.pop()
+        if folder_id in folders:
+            continue
+        folders.add(folder_id)
+        listing = store.get_listing(folder_id)
+        if not listing:
+            continue
+        for item in listing.get('items') or []:
+            if item.get('mimeType') == FOLDER_MIME_TYPE:
+                stack.append(item.get('id'))
+            else:
+                blobs.update(blob_keys(item))
+    return folders, blobs
+
+
+def _delete(store, kind, key):
+    getattr(store, _DELETE_METHODS[kind])(key)
+
+
+def collect(store, root_ids, blob_keys, max_bytes=None):
+    """
+    Sweep the entries not reachable from root_ids, then evict down to max_bytes (None = no cap).
+    Returns {'reachable_folders', 'swept': {kind: n}, 'evicted': {kind: n}, 'bytes_before', 'bytes_after', 'seconds'}.
+    """
+    start = time.perf_counter()
+    folders, blobs = mark(store, root_ids, blob_keys)
+    swept = dict.fromkeys(KINDS, 0)
+    evicted = dict.fromkeys(EVICTION_ORDER, 0)
+    evictable = []
+    bytes_before = 0
+    total = 0
+    for kind, key, size, written in store.entry_sizes():
+        bytes_before += size
+        live = key in blobs if kind == 'blob' else key in folders
+        if not live:
+            _delete(store, kind, key)
+            swept[kind] += 1
+            continue
+        total += size
+        if kind in EVICTION_ORDER:
+            evictable.append((EVICTION_ORDER.index(kind), written, key, kind, size))
+    if max_bytes is not None and total > max_bytes:
+        for _, _, key, kind, size in sorted(evictable):
+            if total <= max_bytes:
+                break
+            _delete(store, kind, key)
+            evicted[kind] += 1
+            total -= size
+    store.flush()
+    if any(swept.values()) or any(evicted.values()):
+        store.compact()
+    stats = {
+        'reachable_folders': len(folders),
+        'swept': swept,
+        'evicted': evicted,
+        'bytes_before': bytes_before,
+        'bytes_after': total,
+        'seconds': round(time.perf_counter() - start, 3),
+    }
+    log_event(summary(stats))
+    return stats
+
+
+def summary(stats):
+    """One line for build.log."""
+    line = (f"Cache GC: {stats['reachable_folders']} folders reachable, swept "
+            + ', '.join(f"{n} {kind}" for kind, n in stats['swept'].items())
+            + f"; {stats['bytes_before']} -> {stats['bytes_after']} bytes in {stats['seconds']}s")
+    if any(stats['evicted'].values()):
+        line += ' (over the size cap, evicted ' + ', '.join(f"{n} {kind}" for kind, n in stats['evicted'].items()) + ')'
+    return line
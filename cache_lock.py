@@ -0,0 +1,87 @@
+"""
+Cross-process lock serializing builds that share cache/ and cache/changes_state.json.
+
+Two builds on one machine (say rebuild_and_deploy_to_github.bat started while another build runs)
+would read the same changes token, crawl the same changes and overwrite each other's listings and
+state. generate_data and build_site.py hold cache_lock() for the whole run instead, so the second
+build waits and then starts from the first one's cache and token. The lock is an OS file lock
+(fcntl.flock / msvcrt.locking) on LOCK_PATH, released by the OS if the holder dies, so a crashed
+build never leaves a stale lock. It is re-entrant within a process; crawl worker processes of a
+build do not take it (the build holds it for them).
+"""
+import os
+import time
+import threading
+import contextlib
+from logger import log_event
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# Next to cache/ rather than in it: cache_snapshot.import_snapshot renames cache/ while the lock is held
+LOCK_PATH = 'cache.lock'
+# Seconds to wait for another build before giving up
+LOCK_TIMEOUT = 2 * 3600
+LOCK_POLL_SECONDS = 1.0
+
+
+class CacheLockTimeout(Exception):
+    """Another build held the cache lock for longer than the timeout."""
+
+
+_state = {'depth': 0, 'fd': None}
+_state_lock = threading.RLock()
+
+
+def _try_lock(fd):
+    try:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def _unlock(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+@contextlib.contextmanager
+def cache_lock(path=LOCK_PATH, timeout=LOCK_TIMEOUT):
+    """Hold the cache lock inside the block, waiting up to timeout seconds for another build to release it."""
+    with _state_lock:
+        if _state['depth'] == 0:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            start = time.monotonic()
+            waiting = False
+            while not _try_lock(fd):
+                if not waiting:
+                    log_event(f"Waiting for another build to release {path}")
+                    print(f"Waiting for another build to release {path}")
+                    waiting = True
+                if time.monotonic() - start > timeout:
+                    os.close(fd)
+                    raise CacheLockTimeout(f"{path} still held by another build after {timeout}s")
+                time.sleep(LOCK_POLL_SECONDS)
+            if waiting:
+                log_event(f"Acquired {path} after {time.monotonic() - start:.1f}s")
+            _state['fd'] = fd
+        _state['depth'] += 1
+    try:
+        yield
+    finally:
+        with _state_lock:
+            _state['depth'] -= 1
+            if _state['depth'] == 0:
+                fd, _state['fd'] = _state['fd'], None
+                _unlock(fd)
+                os.close(fd)
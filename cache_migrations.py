@@ -0,0 +1,167 @@
+"""
+Format versions of cache entries and the registry of migrations between them.
+
+Every entry cache_store writes carries the current format of its kind (FORMATS):
+    listing, lesson, node, blob - the cache_store entries ("format" key, or column for SQLite rows)
+    changes_state               - cache/changes_state.json (drive_to_class_json)
+Entries written before formats existed have none and count as format 0.
+
+To change the shape of a kind of entry, bump its FORMATS number and register the step from the
+previous format:
+
+    @migration('listing', 1)
+    def _listing_1_to_2(data):
+        ...
+        return data      # now in format 2, or None when it cannot be upgraded without Drive
+
+upgrade() runs the steps from an entry's format to the current one. The stores call it on every
+read (lazily) and from migrate_entries() (in bulk, build_site.py --migrate-cache); an upgraded entry
+is written back, and an entry that cannot be upgraded (or comes from a newer format) is deleted on
+its own and fetched again on the next crawl, so a format bump never throws the whole cache away.
+"""
+import threading
+
+FORMATS = {
+    'listing': 1,
+    'lesson': 1,
+    'node': 1,
+    'blob': 1,
+    'changes_state': 1,
+}
+
+_MIGRATIONS = {}  # (kind, from_format) -> step function
+
+# Entries upgraded / invalidated since the last reset_stats(), per kind
+STATS = {'upgraded': {}, 'invalidated': {}}
+_STATS_LOCK = threading.Lock()
+
+
+def migration(kind, from_format):
+    """Register the decorated function as the step upgrading kind entries from from_format to from_format + 1."""
+    def register(step):
+        _MIGRATIONS[(kind, from_format)] = step
+        return step
+    return register
+
+
+def entry_format(data):
+    return data.get('format', 0) if isinstance(data, dict) else 0
+
+
+def stamp(kind, data):
+    """Copy of data marked with the current format of kind (for writing)."""
+    return dict(data, format=FORMATS[kind])
+
+
+def _count(outcome, kind):
+    with _STATS_LOCK:
+        STATS[outcome][kind] = STATS[outcome].get(kind, 0) + 1
+
+
+def count_invalidated(kind):
+    """Count an entry dropped without going through upgrade() (e.g. an unreadable file)."""
+    _count('invalidated', kind)
+
+
+def upgrade(kind, data):
+    """
+    Return data in the current format of kind: data itself when it already is, an upgraded copy
+    (marked with the format) when every step applies, or None when the entry must be invalidated.
+    """
+    current = FORMATS[kind]
+    version = entry_format(data)
+    if version == current:
+        return data
+    if version > current:
+        # Written by a newer version of this code
+        _count('invalidated', kind)
+        return None
+    data = dict(data)
+    while version < current:
+        step = _MIGRATIONS.get((kind, version))
+        data = step(data) if step is not None else None
+        if data is None:
+            _count('invalidated', kind)
+            return None
+        version += 1
+    _count('upgraded', kind)
+    return stamp(kind, data)
+
+
+def reset_stats():
+    with _STATS_LOCK:
+        STATS['upgraded'].clear()
+        STATS['invalidated'].clear()
+
+
+def stats():
+    """Copy of STATS."""
+    with _STATS_LOCK:
+        return {outcome: dict(counts) for outcome, counts in STATS.items()}
+
+
+def merge_stats(counts):
+    """Add the stats() of a crawl worker process to this process's."""
+    with _STATS_LOCK:
+        for outcome, kinds in counts.items():
+            for kind, count in kinds.items():
+                STATS[outcome][kind] = STATS[outcome].get(kind, 0) + count
+
+
+def summary():
+    """One line for build.log, or None when no entry needed migrating."""
+    counts = stats()
+    if not counts['upgraded'] and not counts['invalidated']:
+        return None
+    parts = [f"{kind} {counts['upgraded'].get(kind, 0)} upgraded, {counts['invalidated'].get(kind, 0)} invalidated"
+             for kind in FORMATS if kind in counts['upgraded'] or kind in counts['invalidated']]
+    return 'Cache format migrations: ' + '; '.join(parts)
+
+
+# --- Format 0 (entries written before formats existed) -> 1 ---------------------------------------
+
+@migration('listing', 0)
+def _listing_0_to_1(data):
+    # Listings from before per-item metadata (modifiedTime/md5Checksum/...) and shortcutId cannot
+    # validate child folders or resolve shortcut removals: a non-shortcut item without modifiedTime
+    # (a shortcut listed before shortcutId was kept looks like one) means a refetch
+    items = data.get('items')
+    if not isinstance(items, list):
+        return None
+    for item in items:
+        if not isinstance(item, dict) or not item.get('id') or 'mimeType' not in item:
+            return None
+        if 'shortcutId' not in item and 'modifiedTime' not in item:
+            return None
+    return data
+
+
+@migration('lesson', 0)
+def _lesson_0_to_1(data):
+    lesson_obj = data.get('lesson_obj')
+    if not isinstance(lesson_obj, dict) or 'content' not in lesson_obj or 'name' not in lesson_obj:
+        return None
+    # Lessons cached before the node cache have no Merkle hash; their topic is rebuilt once
+    data['lesson_obj'] = dict(lesson_obj, node_hash=lesson_obj.get('node_hash'))
+    return data
+
+
+@migration('node', 0)
+def _node_0_to_1(data):
+    if not all(key in data for key in ('hash', 'listing_hash', 'output')):
+        return None
+    return data
+
+
+@migration('blob', 0)
+def _blob_0_to_1(data):
+    if 'result' not in data:
+        return None
+    return data
+
+
+@migration('changes_state', 0)
+def _changes_state_0_to_1(data):
+    if not isinstance(data.get('startPageToken'), str):
+        return None
+    return data
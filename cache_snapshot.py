@@ -0,0 +1,205 @@
+"""
+Export and import the whole crawl cache (cache/) as one archive, for CI runners that start empty.
+
+The archive is a .tar.gz holding every file under cache/ (folder listings, lesson objects, nodes,
+blobs, parent index, changes state, SQLite database) under cache/, followed by manifest.json:
+    {"format", "created_at", "file_count", "total_bytes", "files": {relative path: {"size", "sha256"}}}
+The SQLite database is copied with the SQLite backup API, so an open store (or a pending WAL) is
+archived consistently. Temporary files of interrupted writes (*.tmp) and SQLite -wal/-shm files are left out.
+
+import_snapshot() extracts into a staging directory next to cache/ and only swaps it in when the
+format, every file's size and checksum and the file list all match the manifest. On any mismatch the
+existing cache (or none, on a fresh runner) is left as it was, so the run falls back to a cold crawl.
+
+    python cache_snapshot.py export cache_snapshot.tar.gz
+    python cache_snapshot.py import cache_snapshot.tar.gz
+    python cache_snapshot.py verify cache_snapshot.tar.gz
+"""
+import os
+import io
+import json
+import time
+import shutil
+import sqlite3
+import tarfile
+import hashlib
+import tempfile
+from datetime import datetime
+import cache_lock
+from logger import log_event
+
+SNAPSHOT_FORMAT = 1
+CACHE_DIR = 'cache'
+SNAPSHOT_PATH = 'cache_snapshot.tar.gz'
+MANIFEST_NAME = 'manifest.json'
+ARCHIVE_PREFIX = 'cache/'
+SQLITE_SUFFIXES = ('.sqlite3', '.sqlite', '.db')
+SKIPPED_SUFFIXES = ('.tmp', '-wal', '-shm', '-journal')
+
+
+class SnapshotError(Exception):
+    """The snapshot archive is missing, of another format, or does not match its manifest."""
+
+
+def _sha256_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _cache_files(cache_dir):
+    """(relative path with / separators, absolute path) of every file to archive, sorted."""
+    files = []
+    for root, _, names in os.walk(cache_dir):
+        for name in names:
+            if name.endswith(SKIPPED_SUFFIXES):
+                continue
+            path = os.path.join(root, name)
+            files.append((os.path.relpath(path, cache_dir).replace(os.sep, '/'), path))
+    return sorted(files)
+
+
+def export_snapshot(path=SNAPSHOT_PATH, cache_dir=CACHE_DIR):
+    """Write cache_dir to the archive path (replaced atomically). Returns the manifest."""
+    if not os.path.isdir(cache_dir):
+        raise SnapshotError(f"No cache directory {cache_dir} to export")
+    start = time.perf_counter()
+    files = {}
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with tempfile.TemporaryDirectory() as tmp_dir, tarfile.open(tmp_path, 'w:gz') as tar:
+        for rel_path, file_path in _cache_files(cache_dir):
+            if rel_path.endswith(SQLITE_SUFFIXES):
+                # A consistent copy even while the store is open or the WAL is not checkpointed
+                copy_path = os.path.join(tmp_dir, 'backup.sqlite3')
+                source = sqlite3.connect(file_path)
+                target = sqlite3.connect(copy_path)
+                try:
+                    source.backup(target)
+                finally:
+                    target.close()
+                    source.close()
+                file_path = copy_path
+            files[rel_path] = {'size': os.path.getsize(file_path), 'sha256': _sha256_file(file_path)}
+            tar.add(file_path, arcname=ARCHIVE_PREFIX + rel_path, recursive=False)
+        manifest = {
+            'format': SNAPSHOT_FORMAT,
+            'created_at': datetime.now().isoformat(),
+            'file_count': len(files),
+            'total_bytes': sum(entry['size'] for entry in files.values()),
+            'files': files,
+        }
+        data = json.dumps(manifest, ensure_ascii=False, indent=2).encode('utf-8')
+        info = tarfile.TarInfo(MANIFEST_NAME)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        tar.addfile(info, io.BytesIO(data))
+    os.replace(tmp_path, path)
+    log_event(f"Exported {len(files)} cache files ({manifest['total_bytes']} bytes) to {path} "
+              f"({os.path.getsize(path)} bytes) in {time.perf_counter() - start:.2f}s")
+    return manifest
+
+
+def _extract_verified(path, target_dir):
+    """Extract the archive's cache files into target_dir, checking them against the manifest. Returns the manifest."""
+    found = {}
+    manifest = None
+    try:
+        with tarfile.open(path, 'r:gz') as tar:
+            for member in tar:
+                if member.name == MANIFEST_NAME:
+                    manifest = json.loads(tar.extractfile(member).read().decode('utf-8'))
+                    continue
+                rel_path = member.name[len(ARCHIVE_PREFIX):] if member.name.startswith(ARCHIVE_PREFIX) else None
+                parts = rel_path.split('/') if rel_path else []
+                if not member.isfile() or not parts or any(part in ('', '.', '..') for part in parts) or ':' in rel_path:
+                    raise SnapshotError(f"Unexpected archive member {member.name!r}")
+                file_path = os.path.join(target_dir, *parts)
+                os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                digest = hashlib.sha256()
+                size = 0
+                source = tar.extractfile(member)
+                with open(file_path, 'wb') as f:
+                    for chunk in iter(lambda: source.read(1 << 20), b''):
+                        digest.update(chunk)
+                        size += len(chunk)
+                        f.write(chunk)
+                found[rel_path] = {'size': size, 'sha256': digest.hexdigest()}
+    except (tarfile.TarError, OSError, EOFError, ValueError) as e:
+        raise SnapshotError(f"Cannot read {path}: {e}")
+    if manifest is None:
+        raise SnapshotError(f"{path} has no {MANIFEST_NAME}")
+    if manifest.get('format') != SNAPSHOT_FORMAT:
+        raise SnapshotError(f"{path} has snapshot format {manifest.get('format')!r}, expected {SNAPSHOT_FORMAT}")
+    expected = manifest.get('files', {})
+    if found != expected:
+        mismatched = sorted(name for name in set(found) | set(expected) if found.get(name) != expected.get(name))
+        raise SnapshotError(f"{path} does not match its manifest: {len(mismatched)} files differ "
+                            f"(e.g. {', '.join(mismatched[:3])})")
+    return manifest
+
+
+def verify_snapshot(path=SNAPSHOT_PATH):
+    """Check the archive against its manifest without touching the cache. Returns the manifest or raises SnapshotError."""
+    if not os.path.exists(path):
+        raise SnapshotError(f"No snapshot {path}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        return _extract_verified(path, tmp_dir)
+
+
+def import_snapshot(path=SNAPSHOT_PATH, cache_dir=CACHE_DIR):
+    """
+    Replace cache_dir with the archive's contents if it passes every check.
+    Returns True when imported; False (logged, cache_dir untouched) when the archive is
+    missing or fails a check. Call before the cache store is opened.
+    """
+    if not os.path.exists(path):
+        log_event(f"No cache snapshot {path}; starting with the existing cache (a cold crawl if there is none)")
+        return False
+    start = time.perf_counter()
+    staging_dir = cache_dir.rstrip('/\\') + '.import'
+    shutil.rmtree(staging_dir, ignore_errors=True)
+    try:
+        manifest = _extract_verified(path, staging_dir)
+    except SnapshotError as e:
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        msg = f"Cache snapshot rejected ({e}); keeping the existing cache (a cold crawl if there is none)"
+        log_event(msg)
+        print(msg)
+        return False
+    old_dir = cache_dir.rstrip('/\\') + '.old'
+    shutil.rmtree(old_dir, ignore_errors=True)
+    if os.path.exists(cache_dir):
+        os.rename(cache_dir, old_dir)
+    os.rename(staging_dir, cache_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    msg = (f"Imported cache snapshot {path} from {manifest.get('created_at')}: {manifest['file_count']} files "
+           f"in {time.perf_counter() - start:.2f}s")
+    log_event(msg)
+    print(msg)
+    return True
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='Export, import or verify a cache snapshot archive.')
+    parser.add_argument('action', choices=['export', 'import', 'verify'])
+    parser.add_argument('path', nargs='?', default=SNAPSHOT_PATH)
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    args = parser.parse_args()
+    if args.action == 'export':
+        with cache_lock.cache_lock():
+            manifest = export_snapshot(args.path, args.cache_dir)
+        print(f"Exported {manifest['file_count']} files to {args.path}")
+    elif args.action == 'import':
+        with cache_lock.cache_lock():
+            imported = import_snapshot(args.path, args.cache_dir)
+        raise SystemExit(0 if imported else 1)
+    else:
+        try:
+            manifest = verify_snapshot(args.path)
+        except SnapshotError as e:
+            print(f"FAILED: {e}")
+            raise SystemExit(1)
+        print(f"OK: {manifest['file_count']} files, created {manifest['created_at']}")
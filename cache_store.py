@@ -0,0 +1,850 @@
+"""
+Cache storage backends for Drive folder listings and lesson objects.
+
+FileCacheStore is the original layout: one pretty-printed JSON file per folder in
+cache/folder_listings/ and cache/lesson_objects/. Every file is written to a temporary name and
+renamed into place, and carries a CRC-32 "checksum" of its entry: a file that is not valid JSON or
+does not match its checksum is deleted on read and counts as a miss.
+SqliteCacheStore keeps the same entries in a single SQLite database (standard library),
+with tables for folders, their listed items (which double as the child -> parent links)
+and lesson objects, indexed by folder id and item id and written in one transaction per entry
+(SQLite's journal makes the writes crash-safe, zlib's Adler-32 checks every packed entry).
+
+Both stores take and return the same dicts:
+    listing: {"folder_id", "modified_time", "cached_at", "items": [...]}
+    lesson:  {"modified_time", "cached_at", "lesson_obj": {...}}
+    node:    {"hash", "listing_hash", "cached_at", "output": ...}, keyed by (folder_id, variant)
+             (crawl output of one class/topic/content folder, see drive_to_class_json node cache)
+    blob:    {"raw", "result", "cached_at"}, keyed by a content key
+             (downloaded README/lesson.json/assignments text and its rendered result)
+
+Every entry is written with the current format of its kind (cache_migrations.FORMATS) and
+upgraded on read: a get_* of an older entry writes the upgraded entry back, or deletes the entry
+and returns None when it cannot be upgraded. migrate_entries() does the same for every entry at once.
+take_dropped_listings() returns the folders whose listing was deleted that way (or unreadable):
+the Changes API says nothing about them, so drive_to_class_json fetches them again.
+
+Both also answer child -> parent and shortcut -> target lookups (parents_of, shortcut_target)
+for drive_changes.compute_affected_folder_ids, kept up to date on every listing write:
+the SQLite store queries its items table, the file store keeps a ParentIndex persisted
+in cache/parent_index.json.
+"""
+import os
+import re
+import json
+import zlib
+import time
+import sqlite3
+import threading
+import cache_migrations
+from logger import log_event
+
+BACKENDS = ('files', 'sqlite')
+
+
+def _safe_id(folder_id):
+    """Folder IDs are alphanumeric with - and _; sanitize for filesystem."""
+    return re.sub(r'[^\w\-]', '_', folder_id)
+
+
+def _current(kind, data, put, delete):
+    """data in the current format of kind: upgraded ones are written back with put(), the rest removed with delete()."""
+    if data is None:
+        return None
+    current = cache_migrations.upgrade(kind, data)
+    if current is None:
+        delete()
+    elif current is not data:
+        put(current)
+    return current
+
+
+def _compact(obj):
+    """Compact JSON text (no indentation, UTF-8 kept as is)."""
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+
+
+def _checksum(data):
+    """CRC-32 (hex) of an entry's compact JSON."""
+    return format(zlib.crc32(_compact(data).encode('utf-8')), '08x')
+
+
+class CorruptEntry(ValueError):
+    """A cache file whose entry does not match its checksum."""
+
+
+def write_text_atomic(path, text):
+    """Write text to a temporary file next to path and rename it over path, so readers never see a partial file."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    _replace(tmp_path, path)
+
+
+def write_bytes_atomic(path, data):
+    """write_text_atomic for bytes (written as is)."""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    _replace(tmp_path, path)
+
+
+def _replace(tmp_path, path):
+    for attempt in range(5):
+        try:
+            os.replace(tmp_path, path)
+            return
+        except PermissionError:
+            # Windows refuses to replace a file another process has open; it is closed right after reading
+            if attempt == 4:
+                os.remove(tmp_path)
+                raise
+            time.sleep(0.05 * (attempt + 1))
+
+
+class ParentIndex:
+    """
+    child -> parent folders and shortcut -> target maps over a set of folder listings.
+    Only the per-folder child lists are persisted; the reverse maps are rebuilt in memory on load.
+    A child can have several parents (shortcut targets and files shared into several folders).
+    """
+
+    FORMAT = 1
+
+    def __init__(self):
+        self.children = {}          # folder_id -> [[item_id, shortcut_id or None], ...]
+        self.parents = {}           # item or shortcut id -> set of folder_ids listing it
+        self.shortcut_targets = {}  # shortcut id -> target id
+
+    @staticmethod
+    def entries_for(items):
+        """The [item_id, shortcut_id] pairs the index keeps for a listing's items."""
+        return [[item.get('id'), item.get('shortcutId')] for item in items if item.get('id')]
+
+    def set_listing(self, folder_id, items):
+        """Replace folder_id's children with those in items (listing dicts)."""
+        self.set_entries(folder_id, self.entries_for(items))
+
+    def set_entries(self, folder_id, entries):
+        self.remove_listing(folder_id)
+        self.children[folder_id] = entries
+        self._link(folder_id, entries)
+
+    def remove_listing(self, folder_id):
+        for item_id, shortcut_id in self.children.pop(folder_id, []):
+            self._unlink(item_id, folder_id)
+            if shortcut_id:
+                if not self._unlink(shortcut_id, folder_id):
+                    self.shortcut_targets.pop(shortcut_id, None)
+
+    def _link(self, folder_id, entries):
+        for item_id, shortcut_id in entries:
+            self.parents.setdefault(item_id, set()).add(folder_id)
+            if shortcut_id:
+                self.parents.setdefault(shortcut_id, set()).add(folder_id)
+                self.shortcut_targets[shortcut_id] = item_id
+
+    def _unlink(self, child_id, folder_id):
+        """Drop one child -> parent link; returns True if the child still has other parents."""
+        parents = self.parents.get(child_id)
+        if parents is None:
+            return False
+        parents.discard(folder_id)
+        if not parents:
+            del self.parents[child_id]
+            return False
+        return True
+
+    def to_json(self):
+        return {'format': self.FORMAT, 'children': self.children}
+
+    @classmethod
+    def from_json(cls, data):
+        index = cls()
+        if data.get('format') != cls.FORMAT:
+            raise ValueError(f"Unsupported parent index format {data.get('format')!r}")
+        for folder_id, entries in data.get('children', {}).items():
+            index.children[folder_id] = entries
+            index._link(folder_id, entries)
+        return index
+
+
+class FileCacheStore:
+    """
+    One JSON file per folder listing and per lesson object.
+    The parent index is loaded on first lookup (or rebuilt by scanning the listing files
+    when missing or left dirty by an interrupted run) and written back by flush().
+
+    Several crawl processes can share the directories: every file is written to a temporary
+    name and renamed into place, so readers never see a partial file. Only the main process
+    owns the parent index; a crawl worker process calls defer_index_updates() and hands its
+    listing writes back with take_index_journal() for the main process to apply_index_journal().
+    """
+
+    def __init__(self, listings_dir, lessons_dir, index_path=None, nodes_dir=None, blobs_dir=None):
+        self.listings_dir = listings_dir
+        self.lessons_dir = lessons_dir
+        self.index_path = index_path
+        self.nodes_dir = nodes_dir
+        self.blobs_dir = blobs_dir
+        self._write_lock = threading.Lock()
+        self._index = None
+        self._index_dirty = False
+        self._index_journal = None
+        self._dropped_listings = set()
+
+    def listing_path(self, folder_id):
+        """Return cache file path for a folder (safe for any folder_id including nested subfolders)."""
+        return os.path.join(self.listings_dir, f"{_safe_id(folder_id)}.json")
+
+    def lesson_path(self, folder_id):
+        """Return cache file path for a lesson object (keyed by lesson folder_id)."""
+        return os.path.join(self.lessons_dir, f"{_safe_id(folder_id)}.json")
+
+    def node_path(self, folder_id):
+        """Return cache file path holding every node variant of a folder."""
+        return os.path.join(self.nodes_dir, f"{_safe_id(folder_id)}.json")
+
+    def blob_path(self, key):
+        return os.path.join(self.blobs_dir, f"{_safe_id(key)}.json")
+
+    def _read(self, path):
+        """Read one cache file; raises ValueError when it is not JSON or does not match its checksum."""
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        # Files written before checksums have none
+        if isinstance(data, dict) and 'checksum' in data:
+            checksum = data.pop('checksum')
+            if _checksum(data) != checksum:
+                raise CorruptEntry(f"{path} does not match its checksum")
+        return data
+
+    def _read_entry(self, kind, path, delete):
+        """_read, but a corrupt file is deleted with delete() and read as None."""
+        try:
+            return self._read(path)
+        except ValueError as e:
+            log_event(f"Corrupt {kind} cache file, deleting it: {e}")
+            cache_migrations.count_invalidated(kind)
+            delete()
+            return None
+
+    def _write(self, path, data):
+        """Write one cache file (call with _write_lock held: crawl worker threads can write the same shared shortcut target)."""
+        self._write_text(path, json.dumps({'checksum': _checksum(data), **data}, ensure_ascii=False, indent=2))
+
+    def _write_text(self, path, text):
+        write_text_atomic(path, text)
+
+    def _remove(self, path):
+        if os.path.exists(path):
+            os.remove(path)
+            return True
+        return False
+
+    def _dirty_marker_path(self):
+        return self.index_path + '.dirty'
+
+    def _parent_index(self):
+        """Return the ParentIndex, loading or rebuilding it on first use (call with _write_lock held)."""
+        if self._index is not None:
+            return self._index
+        if self.index_path and os.path.exists(self.index_path) and not os.path.exists(self._dirty_marker_path()):
+            try:
+                self._index = ParentIndex.from_json(self._read(self.index_path))
+                return self._index
+            except Exception as e:
+                log_event(f"Parent index read error ({str(e)}), rebuilding from cached listings")
+        self._index = ParentIndex()
+        for data in self.iter_listings():
+            if data and data.get('folder_id'):
+                self._index.set_listing(data['folder_id'], data.get('items') or [])
+        if self.index_path:
+            log_event(f"Rebuilt parent index from {len(self._index.children)} cached listings")
+            self._mark_index_dirty()
+        return self._index
+
+    def _mark_index_dirty(self):
+        """Leave a marker on disk until flush(), so a crashed run's stale index is rebuilt."""
+        if self.index_path and not self._index_dirty:
+            os.makedirs(os.path.dirname(self.index_path) or '.', exist_ok=True)
+            with open(self._dirty_marker_path(), 'w', encoding='utf-8') as f:
+                f.write('parent index not flushed\n')
+        self._index_dirty = True
+
+    def _update_index(self, folder_id, items):
+        """Apply one listing write (items) or removal (None) to the index (call with _write_lock held)."""
+        entries = None if items is None else ParentIndex.entries_for(items)
+        if self._index_journal is not None:
+            self._index_journal.append((folder_id, entries))
+        else:
+            self._apply_index_entry(folder_id, entries)
+        self._mark_index_dirty()
+
+    def _apply_index_entry(self, folder_id, entries):
+        index = self._parent_index()
+        if entries is None:
+            index.remove_listing(folder_id)
+        else:
+            index.set_entries(folder_id, entries)
+
+    def load_index(self):
+        """Load (or rebuild) the parent index now, before crawl worker processes start writing listings."""
+        with self._write_lock:
+            self._parent_index()
+
+    def defer_index_updates(self):
+        """Journal listing writes instead of updating the parent index (crawl worker processes)."""
+        with self._write_lock:
+            self._index_journal = []
+
+    def take_index_journal(self):
+        """Return and clear the (folder_id, entries or None) updates journaled since the last call."""
+        with self._write_lock:
+            journal, self._index_journal = self._index_journal or [], []
+        return journal
+
+    def apply_index_journal(self, journal):
+        """Apply the index updates a crawl worker process journaled (see take_index_journal)."""
+        with self._write_lock:
+            for folder_id, entries in journal:
+                self._apply_index_entry(folder_id, entries)
+            if journal:
+                self._mark_index_dirty()
+
+    def has_listing(self, folder_id):
+        return os.path.exists(self.listing_path(folder_id))
+
+    def get_listing(self, folder_id):
+        data = self._read_entry('listing', self.listing_path(folder_id), lambda: self._drop_listing(folder_id))
+        return _current('listing', data,
+                        lambda data: self.put_listing(folder_id, data), lambda: self._drop_listing(folder_id))
+
+    def put_listing(self, folder_id, data):
+        with self._write_lock:
+            self._write(self.listing_path(folder_id), cache_migrations.stamp('listing', data))
+            self._update_index(folder_id, data.get('items') or [])
+
+    def delete_listing(self, folder_id):
+        with self._write_lock:
+            removed = self._remove(self.listing_path(folder_id))
+            self._update_index(folder_id, None)
+        return removed
+
+    def _drop_listing(self, folder_id):
+        """delete_listing for a listing that could not be read or upgraded (see take_dropped_listings)."""
+        with self._write_lock:
+            self._dropped_listings.add(folder_id)
+        self.delete_listing(folder_id)
+
+    def take_dropped_listings(self):
+        """Return and clear the folder ids whose listing was dropped since the last call."""
+        with self._write_lock:
+            dropped, self._dropped_listings = self._dropped_listings, set()
+        return dropped
+
+    def parents_of(self, child_id):
+        """Folder ids whose cached listing contains child_id (as item id or shortcut id)."""
+        with self._write_lock:
+            return set(self._parent_index().parents.get(child_id, ()))
+
+    def shortcut_target(self, shortcut_id):
+        """Target id of a cached shortcut, or None."""
+        with self._write_lock:
+            return self._parent_index().shortcut_targets.get(shortcut_id)
+
+    def flush(self):
+        """Write the parent index if it changed this run."""
+        with self._write_lock:
+            if not self._index_dirty or not self.index_path:
+                return
+            if self._index_journal is not None:
+                # The main process writes the index from the journal
+                return
+            index = self._parent_index()
+            self._write_text(self.index_path, json.dumps(index.to_json(), ensure_ascii=False, separators=(',', ':')))
+            if os.path.exists(self._dirty_marker_path()):
+                os.remove(self._dirty_marker_path())
+            self._index_dirty = False
+
+    def iter_listings(self):
+        """Yield every readable cached listing (unreadable files are skipped)."""
+        if not os.path.isdir(self.listings_dir):
+            return
+        for name in os.listdir(self.listings_dir):
+            if not name.endswith('.json'):
+                continue
+            try:
+                yield self._read(os.path.join(self.listings_dir, name))
+            except Exception:
+                continue
+
+    def get_lesson(self, folder_id):
+        data = self._read_entry('lesson', self.lesson_path(folder_id), lambda: self.delete_lesson(folder_id))
+        return _current('lesson', data,
+                        lambda data: self.put_lesson(folder_id, data), lambda: self.delete_lesson(folder_id))
+
+    def put_lesson(self, folder_id, data):
+        with self._write_lock:
+            self._write(self.lesson_path(folder_id), cache_migrations.stamp('lesson', data))
+
+    def delete_lesson(self, folder_id):
+        return self._remove(self.lesson_path(folder_id))
+
+    def get_node(self, folder_id, variant):
+        variants = self._read_entry('node', self.node_path(folder_id), lambda: self.delete_nodes(folder_id))
+        return _current('node', variants.get(variant) if variants else None,
+                        lambda data: self.put_node(folder_id, variant, data),
+                        lambda: self._put_node_variant(folder_id, variant, None))
+
+    def put_node(self, folder_id, variant, data):
+        self._put_node_variant(folder_id, variant, cache_migrations.stamp('node', data))
+
+    def _put_node_variant(self, folder_id, variant, data):
+        """Replace (or with None, remove) one variant in a folder's node file."""
+        with self._write_lock:
+            path = self.node_path(folder_id)
+            try:
+                variants = self._read(path) or {}
+            except Exception:
+                variants = {}
+            if data is None:
+                variants.pop(variant, None)
+            else:
+                variants[variant] = data
+            if variants:
+                self._write(path, variants)
+            else:
+                self._remove(path)
+
+    def delete_nodes(self, folder_id):
+        with self._write_lock:
+            return self._remove(self.node_path(folder_id))
+
+    def clear_nodes(self):
+        if self.nodes_dir and os.path.isdir(self.nodes_dir):
+            for name in os.listdir(self.nodes_dir):
+                if name.endswith('.json'):
+                    os.remove(os.path.join(self.nodes_dir, name))
+
+    def get_blob(self, key):
+        data = self._read_entry('blob', self.blob_path(key), lambda: self.delete_blob(key))
+        return _current('blob', data,
+                        lambda data: self.put_blob(key, data), lambda: self.delete_blob(key))
+
+    def put_blob(self, key, data):
+        with self._write_lock:
+            self._write(self.blob_path(key), cache_migrations.stamp('blob', data))
+
+    def delete_blob(self, key):
+        with self._write_lock:
+            return self._remove(self.blob_path(key))
+
+    def clear_blobs(self):
+        if self.blobs_dir and os.path.isdir(self.blobs_dir):
+            for name in os.listdir(self.blobs_dir):
+                if name.endswith('.json'):
+                    os.remove(os.path.join(self.blobs_dir, name))
+
+    def clear_listings(self):
+        if os.path.isdir(self.listings_dir):
+            for name in os.listdir(self.listings_dir):
+                if name.endswith('.json'):
+                    os.remove(os.path.join(self.listings_dir, name))
+        with self._write_lock:
+            self._index = ParentIndex()
+            self._index_dirty = False
+            if self.index_path:
+                for path in (self.index_path, self._dirty_marker_path()):
+                    if os.path.exists(path):
+                        os.remove(path)
+
+    def clear_lessons(self):
+        if os.path.isdir(self.lessons_dir):
+            for name in os.listdir(self.lessons_dir):
+                if name.endswith('.json'):
+                    os.remove(os.path.join(self.lessons_dir, name))
+
+    def entry_sizes(self):
+        """Yield (kind, key, bytes, last written) for every entry; a folder's node variants are one entry."""
+        for kind, directory in (('listing', self.listings_dir), ('lesson', self.lessons_dir),
+                                ('node', self.nodes_dir), ('blob', self.blobs_dir)):
+            if not directory or not os.path.isdir(directory):
+                continue
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.name.endswith('.json'):
+                        stat = entry.stat()
+                        yield kind, entry.name[:-len('.json')], stat.st_size, stat.st_mtime
+
+    def compact(self):
+        """Nothing to reclaim: deleted entries are deleted files."""
+
+    def migrate_entries(self):
+        """
+        Upgrade every entry not in the current format, deleting those that cannot be upgraded
+        (unreadable files included). Returns the number of entries checked.
+        """
+        checked = 0
+        kinds = (('listing', self.listings_dir, self.get_listing, self._drop_listing),
+                 ('lesson', self.lessons_dir, self.get_lesson, self.delete_lesson),
+                 ('node', self.nodes_dir, None, self.delete_nodes),
+                 ('blob', self.blobs_dir, self.get_blob, self.delete_blob))
+        for kind, directory, get, delete in kinds:
+            if not directory or not os.path.isdir(directory):
+                continue
+            for name in sorted(os.listdir(directory)):
+                if not name.endswith('.json'):
+                    continue
+                # File names are the (already safe) Drive ids and keys
+                key = name[:-len('.json')]
+                try:
+                    if get is not None:
+                        get(key)
+                        checked += 1
+                        continue
+                    variants = self._read(os.path.join(directory, name)) or {}
+                    for variant in variants:
+                        self.get_node(key, variant)
+                    checked += len(variants)
+                except Exception as e:
+                    log_event(f"Unreadable {kind} cache entry {name} ({e}), deleting it")
+                    cache_migrations.count_invalidated(kind)
+                    delete(key)
+                    checked += 1
+        return checked
+
+    def close(self):
+        self.flush()
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS folders (
+    folder_id TEXT PRIMARY KEY,
+    modified_time TEXT,
+    cached_at TEXT,
+    items BLOB NOT NULL,
+    format INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS items (
+    folder_id TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    item_id TEXT,
+    shortcut_id TEXT,
+    name TEXT,
+    mime_type TEXT,
+    PRIMARY KEY (folder_id, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_items_item_id ON items (item_id);
+CREATE INDEX IF NOT EXISTS idx_items_shortcut_id ON items (shortcut_id) WHERE shortcut_id IS NOT NULL;
+CREATE TABLE IF NOT EXISTS lesson_objects (
+    folder_id TEXT PRIMARY KEY,
+    modified_time TEXT,
+    cached_at TEXT,
+    data BLOB NOT NULL,
+    format INTEGER NOT NULL DEFAULT 0,
+    manifest BLOB
+);
+CREATE TABLE IF NOT EXISTS nodes (
+    folder_id TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (folder_id, variant)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS blobs (
+    key TEXT PRIMARY KEY,
+    data BLOB NOT NULL
+);
+"""
+# PRAGMA user_version of a database with SQLITE_SCHEMA; older databases are brought up to it on open
+SQLITE_SCHEMA_VERSION = 2
+# Columns added since the first schema: (table, column, definition)
+SQLITE_ADDED_COLUMNS = [
+    ('folders', 'format', 'INTEGER NOT NULL DEFAULT 0'),
+    ('lesson_objects', 'format', 'INTEGER NOT NULL DEFAULT 0'),
+    ('lesson_objects', 'manifest', 'BLOB'),
+]
+
+
+def _pack(obj):
+    """zlib-compressed compact JSON."""
+    return zlib.compress(_compact(obj).encode('utf-8'))
+
+
+def _unpack(blob):
+    return json.loads(zlib.decompress(blob).decode('utf-8'))
+
+
+class SqliteCacheStore:
+    """
+    All cache entries in one SQLite file.
+    A folder's listing is stored as one zlib-compressed compact JSON blob (read back in a
+    single row lookup); the items table repeats each child's id/shortcutId/name/mimeType
+    as indexed columns, so child -> parent links can be queried without decoding listings.
+    One connection is shared by all crawl threads behind a lock.
+    Listing and lesson rows keep their entry format in a column (rows from before it have 0);
+    nodes and blobs keep it inside the packed dict.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(SQLITE_SCHEMA)
+        self._migrate_schema()
+        self._conn.commit()
+        self._dropped_listings = set()
+
+    def _migrate_schema(self):
+        """Add the columns a database created by an older SQLITE_SCHEMA lacks (CREATE TABLE IF NOT EXISTS keeps it as is)."""
+        if self._conn.execute('PRAGMA user_version').fetchone()[0] >= SQLITE_SCHEMA_VERSION:
+            return
+        for table, column, definition in SQLITE_ADDED_COLUMNS:
+            columns = {row[1] for row in self._conn.execute(f'PRAGMA table_info({table})')}
+            if column not in columns:
+                self._conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+                log_event(f"Cache database {self.path}: added column {table}.{column}")
+        self._conn.execute(f'PRAGMA user_version = {SQLITE_SCHEMA_VERSION}')
+
+    def has_listing(self, folder_id):
+        with self._lock:
+            row = self._conn.execute('SELECT 1 FROM folders WHERE folder_id = ?', (folder_id,)).fetchone()
+        return row is not None
+
+    def get_listing(self, folder_id):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT modified_time, cached_at, items, format FROM folders WHERE folder_id = ?', (folder_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        data = {'folder_id': folder_id, 'modified_time': row[0], 'cached_at': row[1], 'items': _unpack(row[2]),
+                'format': row[3]}
+        return _current('listing', data, lambda data: self.put_listing(folder_id, data),
+                        lambda: self._drop_listing(folder_id))
+
+    def put_listing(self, folder_id, data):
+        items = data.get('items') or []
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM items WHERE folder_id = ?', (folder_id,))
+            self._conn.execute(
+                'INSERT OR REPLACE INTO folders (folder_id, modified_time, cached_at, items, format) VALUES (?, ?, ?, ?, ?)',
+                (folder_id, data.get('modified_time'), data.get('cached_at'), _pack(items),
+                 cache_migrations.FORMATS['listing'])
+            )
+            self._conn.executemany(
+                'INSERT INTO items (folder_id, position, item_id, shortcut_id, name, mime_type) VALUES (?, ?, ?, ?, ?, ?)',
+                [(folder_id, position, item.get('id'), item.get('shortcutId'), item.get('name'), item.get('mimeType'))
+                 for position, item in enumerate(items)]
+            )
+
+    def delete_listing(self, folder_id):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM items WHERE folder_id = ?', (folder_id,))
+            deleted = self._conn.execute('DELETE FROM folders WHERE folder_id = ?', (folder_id,)).rowcount
+        return deleted > 0
+
+    def _drop_listing(self, folder_id):
+        """delete_listing for a listing that could not be upgraded (see take_dropped_listings)."""
+        with self._lock:
+            self._dropped_listings.add(folder_id)
+        self.delete_listing(folder_id)
+
+    def take_dropped_listings(self):
+        """Return and clear the folder ids whose listing was dropped since the last call."""
+        with self._lock:
+            dropped, self._dropped_listings = self._dropped_listings, set()
+        return dropped
+
+    def parents_of(self, child_id):
+        """Folder ids whose cached listing contains child_id (as item id or shortcut id)."""
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT folder_id FROM items WHERE item_id = ? UNION SELECT folder_id FROM items WHERE shortcut_id = ?',
+                (child_id, child_id)
+            ).fetchall()
+        return {folder_id for (folder_id,) in rows}
+
+    def shortcut_target(self, shortcut_id):
+        """Target id of a cached shortcut, or None."""
+        with self._lock:
+            row = self._conn.execute('SELECT item_id FROM items WHERE shortcut_id = ? LIMIT 1', (shortcut_id,)).fetchone()
+        return row[0] if row else None
+
+    def flush(self):
+        pass
+
+    # The items table is the index and SQLite serializes writers from several processes itself
+    def load_index(self):
+        pass
+
+    def defer_index_updates(self):
+        pass
+
+    def take_index_journal(self):
+        return []
+
+    def apply_index_journal(self, journal):
+        pass
+
+    def iter_listings(self):
+        """Yield every cached listing."""
+        with self._lock:
+            rows = self._conn.execute('SELECT folder_id, modified_time, cached_at, items FROM folders').fetchall()
+        for folder_id, modified_time, cached_at, items in rows:
+            yield {'folder_id': folder_id, 'modified_time': modified_time, 'cached_at': cached_at,
+                   'items': _unpack(items)}
+
+    def get_lesson(self, folder_id):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT modified_time, cached_at, data, format, manifest FROM lesson_objects WHERE folder_id = ?', (folder_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        data = {
+            'modified_time': row[0],
+            'cached_at': row[1],
+            'lesson_obj': _unpack(row[2]),
+            'format': row[3],
+        }
+        if row[4] is not None:
+            data['manifest'] = _unpack(row[4])
+        return _current('lesson', data, lambda data: self.put_lesson(folder_id, data),
+                        lambda: self.delete_lesson(folder_id))
+
+    def put_lesson(self, folder_id, data):
+        blob = _pack(data.get('lesson_obj'))
+        manifest = _pack(data['manifest']) if data.get('manifest') is not None else None
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO lesson_objects (folder_id, modified_time, cached_at, data, format, manifest) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (folder_id, data.get('modified_time'), data.get('cached_at'), blob, cache_migrations.FORMATS['lesson'],
+                 manifest)
+            )
+
+    def delete_lesson(self, folder_id):
+        with self._lock, self._conn:
+            deleted = self._conn.execute('DELETE FROM lesson_objects WHERE folder_id = ?', (folder_id,)).rowcount
+        return deleted > 0
+
+    def get_node(self, folder_id, variant):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT data FROM nodes WHERE folder_id = ? AND variant = ?', (folder_id, variant)
+            ).fetchone()
+        return _current('node', _unpack(row[0]) if row else None, lambda data: self.put_node(folder_id, variant, data),
+                        lambda: self._delete_node_variant(folder_id, variant))
+
+    def put_node(self, folder_id, variant, data):
+        blob = _pack(cache_migrations.stamp('node', data))
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO nodes (folder_id, variant, data) VALUES (?, ?, ?)', (folder_id, variant, blob)
+            )
+
+    def delete_nodes(self, folder_id):
+        with self._lock, self._conn:
+            deleted = self._conn.execute('DELETE FROM nodes WHERE folder_id = ?', (folder_id,)).rowcount
+        return deleted > 0
+
+    def _delete_node_variant(self, folder_id, variant):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM nodes WHERE folder_id = ? AND variant = ?', (folder_id, variant))
+
+    def clear_nodes(self):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM nodes')
+
+    def get_blob(self, key):
+        with self._lock:
+            row = self._conn.execute('SELECT data FROM blobs WHERE key = ?', (key,)).fetchone()
+        return _current('blob', _unpack(row[0]) if row else None, lambda data: self.put_blob(key, data),
+                        lambda: self.delete_blob(key))
+
+    def put_blob(self, key, data):
+        blob = _pack(cache_migrations.stamp('blob', data))
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO blobs (key, data) VALUES (?, ?)', (key, blob))
+
+    def delete_blob(self, key):
+        with self._lock, self._conn:
+            deleted = self._conn.execute('DELETE FROM blobs WHERE key = ?', (key,)).rowcount
+        return deleted > 0
+
+    def clear_blobs(self):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM blobs')
+
+    def clear_listings(self):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM items')
+            self._conn.execute('DELETE FROM folders')
+
+    def clear_lessons(self):
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM lesson_objects')
+
+    def entry_sizes(self):
+        """Yield (kind, key, compressed bytes, cached_at or '') for every entry; a folder's node variants are one entry."""
+        with self._lock:
+            rows = [('listing',) + row for row in self._conn.execute(
+                "SELECT folder_id, length(items), coalesce(cached_at, '') FROM folders")]
+            rows += [('lesson',) + row for row in self._conn.execute(
+                "SELECT folder_id, length(data) + coalesce(length(manifest), 0), coalesce(cached_at, '') FROM lesson_objects")]
+            rows += [('node',) + row for row in self._conn.execute(
+                "SELECT folder_id, sum(length(data)), '' FROM nodes GROUP BY folder_id")]
+            rows += [('blob',) + row for row in self._conn.execute("SELECT key, length(data), '' FROM blobs")]
+        return iter(rows)
+
+    def compact(self):
+        """Give the pages of deleted entries back to the file system."""
+        with self._lock:
+            self._conn.execute('VACUUM')
+
+    def migrate_entries(self):
+        """
+        Upgrade every entry not in the current format, deleting those that cannot be upgraded
+        (undecodable rows included). Returns the number of entries checked.
+        """
+        with self._lock:
+            listings = self._conn.execute('SELECT folder_id FROM folders WHERE format != ?',
+                                          (cache_migrations.FORMATS['listing'],)).fetchall()
+            lessons = self._conn.execute('SELECT folder_id FROM lesson_objects WHERE format != ?',
+                                         (cache_migrations.FORMATS['lesson'],)).fetchall()
+            # Node and blob formats are inside the packed data: every row is read
+            nodes = self._conn.execute('SELECT folder_id, variant FROM nodes').fetchall()
+            blobs = self._conn.execute('SELECT key FROM blobs').fetchall()
+        entries = ([('listing', row, self.get_listing, self._drop_listing) for row in listings]
+                   + [('lesson', row, self.get_lesson, self.delete_lesson) for row in lessons]
+                   + [('node', row, self.get_node, self._delete_node_variant) for row in nodes]
+                   + [('blob', row, self.get_blob, self.delete_blob) for row in blobs])
+        for kind, key, get, delete in entries:
+            try:
+                get(*key)
+            except Exception as e:
+                log_event(f"Unreadable {kind} cache entry {key} ({e}), deleting it")
+                cache_migrations.count_invalidated(kind)
+                delete(*key)
+        return len(entries)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def open_cache_store(backend, listings_dir, lessons_dir, sqlite_path, index_path=None, nodes_dir=None, blobs_dir=None):
+    """Create the cache store for backend ('files' or 'sqlite')."""
+    if backend == 'files':
+        return FileCacheStore(listings_dir, lessons_dir, index_path, nodes_dir, blobs_dir)
+    if backend == 'sqlite':
+        return SqliteCacheStore(sqlite_path)
+    raise ValueError(f"Unknown cache backend {backend!r}, expected one of {BACKENDS}")
@@ -1,21 +1,35 @@
 """
 Drive Changes API: fetch changes since last build, persist to timestamped files,
 and compute which folder IDs need cache invalidation.
-Files are kept for tracking and debugging (never deleted by this module).
+Files are kept for tracking and debugging: compact_changes() folds all but the newest
+CHANGES_KEEP_FILES into a rolling gzip journal (read back with iter_journal()).
 """
 import os
+import gzip
 import json
 from datetime import datetime
+import cache_store
 
 CHANGES_API_DIR = 'changes_api'
 # Timestamp format: dd-mm-yyyy_hh-mm-ss (day, month, year, hour, minute, second)
 CHANGES_FILENAME_PREFIX = 'changes-'
+CHANGES_FILENAME_FORMAT = '%d-%m-%Y_%H-%M-%S'
+# Newest persisted changes files left as they are by compact_changes()
+CHANGES_KEEP_FILES = 30
+# Older files: one JSON line each in CHANGES_JOURNAL_NAME; once it reaches CHANGES_JOURNAL_MAX_BYTES it is
+# renamed to CHANGES_JOURNAL_PREVIOUS_NAME (replacing the one before) and a new journal is started
+CHANGES_JOURNAL_NAME = 'changes_journal.jsonl.gz'
+CHANGES_JOURNAL_PREVIOUS_NAME = 'changes_journal.1.jsonl.gz'
+CHANGES_JOURNAL_MAX_BYTES = 8 * 1024 * 1024
+# File fields requested with each change: the listing fields (see drive_to_class_json.LISTING_FILE_FIELDS)
+# plus parents/trashed, so patch mode can apply the change to cached listings without a refetch
+CHANGE_FILE_FIELDS = "id, name, mimeType, parents, trashed, modifiedTime, md5Checksum, version, size, shortcutDetails"
 
 
 def _timestamp_str():
     """Return current timestamp in format dd-mm-yyyy_hh-mm-ss."""
     now = datetime.now()
-    return now.strftime('%d-%m-%Y_%H-%M-%S')
+    return now.strftime(CHANGES_FILENAME_FORMAT)
 
 
 def fetch_changes(service, page_token):
@@ -27,7 +41,7 @@ def fetch_changes(service, page_token):
     changes_list = []
     new_start_page_token = None
     token = page_token
-    fields = "nextPageToken, newStartPageToken, changes(fileId, removed, file(id, name, mimeType, parents, trashed))"
+    fields = f"nextPageToken, newStartPageToken, changes(fileId, removed, file({CHANGE_FILE_FIELDS}))"
     while token is not None:
         response = service.changes().list(
             pageToken=token,
@@ -76,91 +90,131 @@ def load_changes(filepath):
         return json.load(f)
 
 
-def compute_affected_folder_ids(changes_list, folder_listings_cache_dir):
+def _persisted_changes_files(changes_dir):
+    """(saved at, file name) of every persisted changes file in changes_dir, oldest first."""
+    files = []
+    for name in os.listdir(changes_dir):
+        if not (name.startswith(CHANGES_FILENAME_PREFIX) and name.endswith('.json')):
+            continue
+        try:
+            saved_at = datetime.strptime(name[len(CHANGES_FILENAME_PREFIX):-len('.json')], CHANGES_FILENAME_FORMAT)
+        except ValueError:
+            continue
+        files.append((saved_at, name))
+    return sorted(files)
+
+
+def compact_changes(changes_dir=CHANGES_API_DIR, keep_files=CHANGES_KEEP_FILES, journal_max_bytes=CHANGES_JOURNAL_MAX_BYTES):
+    """
+    Append every persisted changes file but the newest keep_files to the journal (one compact JSON
+    line per file, {"file", "timestamp", "saved_at", "newStartPageToken", "change_count", "changes"})
+    and delete it. Returns the number of files moved into the journal.
+    """
+    if not os.path.isdir(changes_dir):
+        return 0
+    files = _persisted_changes_files(changes_dir)
+    old_files = files[:max(0, len(files) - keep_files)]
+    if not old_files:
+        return 0
+    journal_path = os.path.join(changes_dir, CHANGES_JOURNAL_NAME)
+    if os.path.exists(journal_path) and os.path.getsize(journal_path) >= journal_max_bytes:
+        os.replace(journal_path, os.path.join(changes_dir, CHANGES_JOURNAL_PREVIOUS_NAME))
+    # Each append is a gzip member of its own; gzip readers read the members as one stream
+    with gzip.open(journal_path, 'at', encoding='utf-8') as journal:
+        for _, name in old_files:
+            data = load_changes(os.path.join(changes_dir, name))
+            journal.write(json.dumps(dict(data, file=name), ensure_ascii=False, separators=(',', ':')) + '\n')
+    for _, name in old_files:
+        os.remove(os.path.join(changes_dir, name))
+    return len(old_files)
+
+
+def iter_journal(changes_dir=CHANGES_API_DIR):
+    """Yield the changes data of every journaled file, oldest first (the previous journal before the current one)."""
+    for journal_name in (CHANGES_JOURNAL_PREVIOUS_NAME, CHANGES_JOURNAL_NAME):
+        path = os.path.join(changes_dir, journal_name)
+        if not os.path.exists(path):
+            continue
+        with gzip.open(path, 'rt', encoding='utf-8') as journal:
+            for line in journal:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def _as_cache_store(folder_listings_cache):
+    """Accept a cache store (see cache_store.py) or a folder_listings directory path."""
+    if isinstance(folder_listings_cache, str):
+        # Directory of per-folder listing files (the original layout); index built in memory
+        return cache_store.FileCacheStore(folder_listings_cache, None)
+    return folder_listings_cache
+
+
+def compute_affected_folder_ids(changes_list, folder_listings_cache):
     """
     Compute which folder IDs need their cache invalidated because their
     folder listing cache is stale (they contain a changed or removed item).
     Bubbles up invalidations to ancestor folders (so Lesson caches correctly drop).
+    folder_listings_cache is a cache store (see cache_store.py) or a folder_listings directory path.
+
+    Uses the store's child -> parent index (parents_of / shortcut_target), so the cost is
+    O(changes x depth) lookups with no scan of the cached listings. A child listed in several
+    folders (shared file, shortcut target) invalidates all of them and all their ancestors.
     """
+    store = _as_cache_store(folder_listings_cache)
     affected = set()
-    
-    # Step 1: Gather directly affected folders from API changes
+
+    # Step 1: the changed files themselves, their current parents, and every folder
+    # whose cached listing contains them (deletions, renames and moves out)
     for change in changes_list:
         file_id = change.get('fileId')
         if not file_id:
             continue
-            
-        # IMPORTANT FIX: Mark the changed file/folder itself as affected!
-        # If a Lesson folder is renamed, its own ID needs to be in the affected list
-        # so the lesson cache builder knows to reject the stale cache and rebuild it.
         affected.add(file_id)
-            
         file_obj = change.get('file')
         if file_obj and file_obj.get('parents'):
             affected.update(file_obj['parents'])
-            
-    # Step 2: Thoroughly scan local cache to find historic parents 
-    # (Crucial for deletions, renames, and shortcut resolution)
-    child_to_parent = {}
-    shortcut_to_target = {}
-    
-    if os.path.isdir(folder_listings_cache_dir):
-        for name in os.listdir(folder_listings_cache_dir):
-            if not name.endswith('.json'):
-                continue
-            cache_path = os.path.join(folder_listings_cache_dir, name)
-            try:
-                with open(cache_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                
-                # Fallback to empty list if items is None in the JSON
-                items = data.get('items') or []
-                parent_id = data.get('folder_id')
-                
-                if not parent_id:
-                    continue
-                    
-                # Build tree map for Step 3 and shortcut resolution
-                for item in items:
-                    i_id = item.get('id')
-                    s_id = item.get('shortcutId')
-                    
-                    if i_id:
-                        child_to_parent[i_id] = parent_id
-                    if s_id:
-                        child_to_parent[s_id] = parent_id
-                        shortcut_to_target[s_id] = i_id
-                        
-                # Check if any changed file was historically in this folder
-                for change in changes_list:
-                    c_id = change.get('fileId')
-                    if c_id and any(i.get('id') == c_id or i.get('shortcutId') == c_id for i in items):
-                        affected.add(parent_id)
-            except Exception:
-                continue
-
-    # Step 2.5: Translate shortcut invalidations to their targets!
-    # drive_to_class_json relies on Target IDs. If the Drive API flags a 
-    # Shortcut ID as renamed, we must also flag its Target ID as changed.
-    targets_to_add = set()
-    for f_id in affected:
-        if f_id in shortcut_to_target:
-            targets_to_add.add(shortcut_to_target[f_id])
-    affected.update(targets_to_add)
-
-    # Step 3: Bubble up invalidations safely
-    ancestors = set()
-    for f_id in affected:
-        curr = f_id
-        # Hard limit depth to 50 to prevent infinite loops or premature breaks
-        for _ in range(50):
-            if curr not in child_to_parent:
-                break
-            p_id = child_to_parent[curr]
-            if p_id in ancestors or p_id in affected:
-                break
-            ancestors.add(p_id)
-            curr = p_id
-            
-    affected.update(ancestors)
-    return affected
\ No newline at end of file
+        affected.update(store.parents_of(file_id))
+
+    # Step 2: listings cache shortcuts under their target's id, so a changed shortcut flags its target too
+    for f_id in list(affected):
+        target_id = store.shortcut_target(f_id)
+        if target_id:
+            affected.add(target_id)
+
+    # Step 3: bubble up to every ancestor through all parents
+    return with_ancestors(affected, store)
+
+
+def with_ancestors(folder_ids, folder_listings_cache):
+    """folder_ids and every folder above them in the cached listings (through all parents)."""
+    store = _as_cache_store(folder_listings_cache)
+    found = set(folder_ids)
+    frontier = list(found)
+    while frontier:
+        next_frontier = []
+        for f_id in frontier:
+            for p_id in store.parents_of(f_id):
+                if p_id not in found:
+                    found.add(p_id)
+                    next_frontier.append(p_id)
+        frontier = next_frontier
+    return found
+
+
+def folder_ids_under(folder_ids, root_ids, folder_listings_cache):
+    """
+    The folder_ids that are one of root_ids or below one of them in the cached listings
+    (walked up through all parents with the store's child -> parent index).
+    """
+    store = _as_cache_store(folder_listings_cache)
+    roots = set(root_ids)
+    under = set()
+    for f_id in folder_ids:
+        seen = {f_id}
+        frontier = [f_id]
+        while frontier and roots.isdisjoint(frontier):
+            frontier = [p_id for c_id in frontier for p_id in store.parents_of(c_id) if p_id not in seen]
+            seen.update(frontier)
+        if frontier:
+            under.add(f_id)
+    return under
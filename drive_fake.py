@@ -0,0 +1,601 @@
+"""
+Local stand-ins for the subset of the Drive v3 client used by drive_to_class_json and
+drive_changes: files().list/get/get_media, changes().list/getStartPageToken and
+new_batch_http_request. Used by benchmark_crawl.py to measure crawls without the real Drive.
+
+FakeDriveService    in-memory Drive backed by a fixture tree (see synthetic_tree, load_fixture),
+                    with mutations that feed the Changes API (edit, add, trash, remove).
+RecordingDriveService
+                    wraps a real service and records every request/response into a cassette.
+ReplayDriveService  serves a recorded cassette back.
+
+Fake and replay services can add per-round-trip latency and inject quota errors
+(HTTP 403 userRateLimitExceeded, as googleapiclient.errors.HttpError), and count calls by type.
+Both are safe to share between crawl threads (generate_data(service=..., workers=N)).
+"""
+import re
+import json
+import time
+import base64
+import random
+import hashlib
+import threading
+from datetime import datetime, timedelta
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+FOLDER_MIME = 'application/vnd.google-apps.folder'
+SHORTCUT_MIME = 'application/vnd.google-apps.shortcut'
+# Drive allows up to 100 calls in one batch request
+BATCH_LIMIT = 100
+CASSETTE_FORMAT = 1
+
+
+def quota_error(status=403, reason='userRateLimitExceeded'):
+    """An HttpError shaped like the one the Drive API returns when over quota."""
+    resp = httplib2.Response({'status': status})
+    resp.reason = reason
+    content = json.dumps({'error': {
+        'code': status,
+        'message': 'User rate limit exceeded.' if status == 403 else reason,
+        'errors': [{'domain': 'usageLimits', 'reason': reason}],
+    }}).encode('utf-8')
+    return HttpError(resp, content, uri='https://www.googleapis.com/drive/v3')
+
+
+def _parse_fields(fields):
+    """Parse a partial-response fields string ("a, b(c, d(e))") into {'a': None, 'b': {...}}."""
+    tree = {}
+    stack = [tree]
+    name = ''
+    for ch in (fields or '') + ',':
+        if ch == '(':
+            child = {}
+            stack[-1][name.strip()] = child
+            stack.append(child)
+            name = ''
+        elif ch in ',)':
+            if name.strip():
+                stack[-1][name.strip()] = None
+            name = ''
+            if ch == ')':
+                stack.pop()
+        else:
+            name += ch
+    return tree
+
+
+def _project(value, tree):
+    """Keep only the fields in tree (from _parse_fields); lists are projected item by item."""
+    if tree is None:
+        return value
+    if isinstance(value, list):
+        return [_project(v, tree) for v in value]
+    if not isinstance(value, dict):
+        return value
+    return {k: _project(v, tree[k]) for k, v in value.items() if k in tree}
+
+
+class _Request:
+    """Lazily executed request, like googleapiclient's HttpRequest."""
+
+    def __init__(self, service, kind, fn):
+        self.service = service
+        self.kind = kind
+        self.fn = fn
+
+    def execute(self, num_retries=0):
+        self.service._round_trip()
+        return self.service._call(self)
+
+
+class _Batch:
+    """new_batch_http_request(): one round trip; each request may fail on its own."""
+
+    def __init__(self, service, callback):
+        self.service = service
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        if len(self.requests) >= BATCH_LIMIT:
+            raise ValueError(f"Batch requests are limited to {BATCH_LIMIT} calls")
+        request_id = request_id if request_id is not None else str(len(self.requests) + 1)
+        self.requests.append((request, callback, request_id))
+
+    def execute(self):
+        self.service._round_trip(batch=True)
+        for request, callback, request_id in self.requests:
+            try:
+                response, exception = self.service._call(request), None
+            except HttpError as e:
+                response, exception = None, e
+            (callback or self.callback)(request_id, response, exception)
+
+
+class _CountingService:
+    """Latency, injected quota errors and call counters shared by the fake and replay services."""
+
+    def __init__(self, latency=0.0, quota_error_rate=0.0, seed=0):
+        self.latency = latency
+        self.quota_error_rate = quota_error_rate
+        self._random = random.Random(seed)
+        self._fail_next = 0
+        self._lock = threading.RLock()
+        self.calls = {}
+        self.round_trips = 0
+        self.errors = 0
+
+    def __getstate__(self):
+        # Picklable for generate_data(processes=N): each crawl process gets a copy, counting its own calls
+        state = dict(self.__dict__)
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    def fail_next(self, count=1):
+        """Make the next count calls fail with a quota error."""
+        with self._lock:
+            self._fail_next += count
+
+    def reset_counters(self):
+        with self._lock:
+            self.calls = {}
+            self.round_trips = 0
+            self.errors = 0
+
+    def total_calls(self):
+        return sum(count for kind, count in self.calls.items() if kind != 'batch')
+
+    def _round_trip(self, batch=False):
+        with self._lock:
+            self.round_trips += 1
+            if batch:
+                self.calls['batch'] = self.calls.get('batch', 0) + 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _call(self, request):
+        with self._lock:
+            self.calls[request.kind] = self.calls.get(request.kind, 0) + 1
+            fail = self._fail_next > 0 or (self.quota_error_rate and self._random.random() < self.quota_error_rate)
+            if self._fail_next > 0:
+                self._fail_next -= 1
+            if fail:
+                self.errors += 1
+        if fail:
+            raise quota_error()
+        return request.fn()
+
+    def new_batch_http_request(self, callback=None):
+        return _Batch(self, callback)
+
+
+class _FakeFiles:
+    def __init__(self, service):
+        self.service = service
+
+    def list(self, q='', fields=None, pageSize=100, pageToken=None, **kwargs):
+        service = self.service
+
+        def run():
+            with service._lock:
+                files = service._query(q)
+                start = int(pageToken or 0)
+                page = files[start:start + min(pageSize, 1000)]
+                response = {'files': [service.resource(f) for f in page]}
+                if start + len(page) < len(files):
+                    response['nextPageToken'] = str(start + len(page))
+            return _project(response, _parse_fields(fields) if fields else None)
+        return _Request(service, 'files.list', run)
+
+    def get(self, fileId, fields=None, **kwargs):
+        service = self.service
+
+        def run():
+            with service._lock:
+                record = service.files_by_id.get(fileId)
+                if record is None:
+                    raise quota_error(404, 'notFound')
+                resource = service.resource(record)
+            return _project(resource, _parse_fields(fields) if fields else None)
+        return _Request(service, 'files.get', run)
+
+    def get_media(self, fileId, **kwargs):
+        service = self.service
+
+        def run():
+            with service._lock:
+                record = service.files_by_id.get(fileId)
+                if record is None:
+                    raise quota_error(404, 'notFound')
+                return record.get('content', b'')
+        return _Request(service, 'files.get_media', run)
+
+
+class _FakeChanges:
+    def __init__(self, service):
+        self.service = service
+
+    def getStartPageToken(self, **kwargs):
+        service = self.service
+        return _Request(service, 'changes.getStartPageToken', lambda: {'startPageToken': str(len(service.change_log))})
+
+    def list(self, pageToken, pageSize=100, fields=None, **kwargs):
+        service = self.service
+
+        def run():
+            with service._lock:
+                start = int(pageToken)
+                chunk = service.change_log[start:start + pageSize]
+                response = {'changes': json.loads(json.dumps(chunk))}
+                if start + pageSize < len(service.change_log):
+                    response['nextPageToken'] = str(start + pageSize)
+                else:
+                    response['newStartPageToken'] = str(len(service.change_log))
+            return _project(response, _parse_fields(fields) if fields else None)
+        return _Request(service, 'changes.list', run)
+
+
+class FakeDriveService(_CountingService):
+    """
+    In-memory Drive. files: file records with id, name, mimeType, parents and optionally
+    modifiedTime, md5Checksum, version, size, shortcutDetails, trashed and content (bytes).
+    """
+
+    QUERY_PARENT = re.compile(r"'([^']+)' in parents")
+
+    def __init__(self, files, latency=0.0, quota_error_rate=0.0, seed=0):
+        super().__init__(latency, quota_error_rate, seed)
+        self.files_by_id = {}
+        # parent id -> ids of its children, so a folder listing does not scan the whole Drive
+        self.children = {}
+        self.change_log = []
+        self._clock = datetime(2025, 1, 1)
+        for record in files:
+            record = dict(record)
+            record.setdefault('modifiedTime', self._now())
+            record.setdefault('version', '1')
+            self._store(record)
+
+    def files(self):
+        return _FakeFiles(self)
+
+    def changes(self):
+        return _FakeChanges(self)
+
+    def resource(self, record):
+        """The API view of a file record (everything but its content)."""
+        resource = {k: v for k, v in record.items() if k not in ('content', 'trashed')}
+        resource['trashed'] = bool(record.get('trashed'))
+        return json.loads(json.dumps(resource))
+
+    def _now(self):
+        return self._clock.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+    def _tick(self):
+        self._clock += timedelta(seconds=1)
+        return self._now()
+
+    def _query(self, q):
+        """Files matching the crawler's queries: "[('a' in parents or ...) and] trashed = false"."""
+        parents = self.QUERY_PARENT.findall(q or '')
+        if parents:
+            ids = set().union(*(self.children.get(p, ()) for p in parents))
+            files = [self.files_by_id[i] for i in ids]
+        else:
+            files = list(self.files_by_id.values())
+        if 'trashed = false' in (q or ''):
+            files = [f for f in files if not f.get('trashed')]
+        return sorted(files, key=lambda f: f['id'])
+
+    def _store(self, record):
+        old = self.files_by_id.get(record['id'])
+        for parent in (old or {}).get('parents', []):
+            self.children.get(parent, set()).discard(record['id'])
+        self.files_by_id[record['id']] = record
+        for parent in record.get('parents', []):
+            self.children.setdefault(parent, set()).add(record['id'])
+
+    def _log_change(self, file_id, removed=False):
+        change = {'kind': 'drive#change', 'changeType': 'file', 'fileId': file_id, 'removed': removed, 'time': self._now()}
+        if not removed:
+            change['file'] = self.resource(self.files_by_id[file_id])
+        self.change_log.append(change)
+
+    # --- mutations (each one is reported by the Changes API) ---
+
+    def edit(self, file_id, content=None, **fields):
+        """Rename/move/update a file; content (bytes) replaces its data and md5Checksum."""
+        with self._lock:
+            record = dict(self.files_by_id[file_id])
+            record.update(fields)
+            if content is not None:
+                record['content'] = content
+                record['md5Checksum'] = _md5(content)
+                record['size'] = str(len(content))
+            record['modifiedTime'] = self._tick()
+            record['version'] = str(int(record.get('version', '1')) + 1)
+            self._store(record)
+            self._log_change(file_id)
+
+    def add(self, record):
+        with self._lock:
+            record = dict(record)
+            if 'content' in record:
+                record.setdefault('md5Checksum', _md5(record['content']))
+                record.setdefault('size', str(len(record['content'])))
+            record.setdefault('modifiedTime', self._tick())
+            record.setdefault('version', '1')
+            self._store(record)
+            self._log_change(record['id'])
+
+    def trash(self, file_id):
+        self.edit(file_id, trashed=True)
+
+    def remove(self, file_id):
+        """Permanent delete: the change only carries fileId and removed=True."""
+        with self._lock:
+            record = self.files_by_id.pop(file_id)
+            for parent in record.get('parents', []):
+                self.children.get(parent, set()).discard(file_id)
+            self._tick()
+            self._log_change(file_id, removed=True)
+
+
+def _md5(content):
+    return hashlib.md5(content).hexdigest()
+
+
+# --- fixtures ---
+
+def synthetic_tree(lessons=100, classes=2, lessons_per_topic=10, subfolders=1, shortcuts=True, seed=0):
+    """
+    Build a fixture Drive: classes root folders (with assignments.md), topics of
+    lessons_per_topic lessons, each lesson with README.md, lesson.json, a PDF, a Word copy of
+    it, a video and a chain of subfolders; the first lesson of each topic has a shortcut to a
+    shared folder. lessons is the total over all classes.
+    Returns (files, class_root_ids).
+    """
+    rng = random.Random(seed)
+    files = []
+    counter = [0]
+
+    def add(name, mime, parent, content=None, **extra):
+        counter[0] += 1
+        record = {'id': f"{'d' if mime == FOLDER_MIME else 'f'}{counter[0]:06d}", 'name': name, 'mimeType': mime,
+                  'parents': [parent] if parent else []}
+        if content is not None:
+            record['content'] = content
+            record['md5Checksum'] = _md5(content)
+            record['size'] = str(len(content))
+        elif mime not in (FOLDER_MIME, SHORTCUT_MIME):
+            record['md5Checksum'] = _md5(record['id'].encode())
+            record['size'] = str(rng.randint(10_000, 5_000_000))
+        record.update(extra)
+        files.append(record)
+        return record['id']
+
+    shared = add('shared', FOLDER_MIME, None)
+    add('shared worksheet.pdf', 'application/pdf', shared)
+    roots = []
+    per_class = max(1, lessons // classes)
+    for class_index in range(classes):
+        root = add(f'class {class_index + 1}', FOLDER_MIME, None)
+        roots.append(root)
+        add('assignments.md', 'text/markdown', root, content='# שיעורי בית\n\nתרגיל 1\n\n---\n\nתרגיל 2\n'.encode('utf-8'))
+        topics = max(1, (per_class + lessons_per_topic - 1) // lessons_per_topic)
+        lesson_count = 0
+        for topic_index in range(1, topics + 1):
+            topic = add(f'{topic_index}. נושא {topic_index}', FOLDER_MIME, root)
+            for lesson_index in range(1, lessons_per_topic + 1):
+                if lesson_count == per_class:
+                    break
+                lesson_count += 1
+                lesson = add(f'{lesson_index} שיעור {lesson_index}', FOLDER_MIME, topic)
+                add('README.md', 'text/markdown', lesson, content=f'# שיעור {lesson_index}\n\nתיאור {lesson}.'.encode('utf-8'))
+                lesson_meta = {'lesson_date': f'{rng.randint(1, 28):02d}-01-2025', 'due_date': f'{rng.randint(1, 28):02d}-02-25',
+                               'external_links': [{'url': f'https://example.com/{lesson}', 'title': 'קישור'}]}
+                add('lesson.json', 'application/json', lesson, content=json.dumps(lesson_meta).encode('utf-8'))
+                add(f'דף עבודה {lesson_index}.pdf', 'application/pdf', lesson)
+                add(f'דף עבודה {lesson_index}.docx', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document', lesson)
+                add('הקלטה.mp4', 'video/mp4', lesson)
+                parent = lesson
+                for sub_index in range(subfolders):
+                    parent = add(f'פתרונות {sub_index + 1}', FOLDER_MIME, parent)
+                    add(f'פתרון {sub_index + 1}.pdf', 'application/pdf', parent)
+                if shortcuts and lesson_index == 1:
+                    add('shared.lnk', SHORTCUT_MIME, lesson, shortcutDetails={'targetId': shared, 'targetMimeType': FOLDER_MIME})
+    return files, roots
+
+
+def fake_class_info(roots, current=1):
+    """class_info entries (see drive_to_class_json.class_info) for fixture class roots."""
+    return [{
+        'id': index + 1,
+        'name': f'class {index + 1}',
+        'url_name': f'class-{index + 1}',
+        'google_drive_url': f'https://drive.google.com/drive/folders/{root}',
+        'banner_url': '',
+        'category': 'current' if index < current else 'past',
+        'regenerate': True,
+    } for index, root in enumerate(roots)]
+
+
+def save_fixture(path, files, roots):
+    """Write a fixture tree to JSON (content as UTF-8 text)."""
+    records = []
+    for record in files:
+        record = dict(record)
+        if 'content' in record:
+            record['content'] = record['content'].decode('utf-8')
+        records.append(record)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'roots': roots, 'files': records}, f, ensure_ascii=False, indent=2)
+
+
+def load_fixture(path):
+    """Read a fixture written by save_fixture. Returns (files, class_root_ids)."""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    files = []
+    for record in data['files']:
+        if 'content' in record:
+            record['content'] = record['content'].encode('utf-8')
+        files.append(record)
+    return files, data['roots']
+
+
+# --- cassettes ---
+
+def _interaction_key(kind, kwargs):
+    return kind + ' ' + json.dumps(kwargs, sort_keys=True, ensure_ascii=False)
+
+
+def _encode_response(response):
+    if isinstance(response, bytes):
+        return {'media': base64.b64encode(response).decode('ascii')}
+    return {'json': response}
+
+
+def _decode_response(entry):
+    if 'error' in entry:
+        raise quota_error(entry['error']['status'], entry['error'].get('reason', ''))
+    if 'media' in entry:
+        return base64.b64decode(entry['media'])
+    return entry['json']
+
+
+class _RecordingRequest:
+    def __init__(self, recorder, kind, kwargs, request):
+        self.recorder = recorder
+        self.key = _interaction_key(kind, kwargs)
+        self.request = request
+
+    def execute(self, num_retries=0):
+        try:
+            response = self.request.execute(num_retries=num_retries)
+        except HttpError as e:
+            self.recorder._record(self.key, None, e)
+            raise
+        self.recorder._record(self.key, response, None)
+        return response
+
+
+class _RecordingResource:
+    def __init__(self, recorder, name, resource):
+        self.recorder = recorder
+        self.name = name
+        self.resource = resource
+
+    def __getattr__(self, method):
+        def build_request(**kwargs):
+            request = getattr(self.resource, method)(**kwargs)
+            return _RecordingRequest(self.recorder, f'{self.name}.{method}', kwargs, request)
+        return build_request
+
+
+class _RecordingBatch:
+    def __init__(self, recorder, callback):
+        self.recorder = recorder
+        self.batch = recorder.service.new_batch_http_request(callback=callback)
+        self.callback = callback
+
+    def add(self, request, callback=None, request_id=None):
+        user_callback = callback or self.callback
+
+        def record(rid, response, exception):
+            self.recorder._record(request.key, response, exception)
+            user_callback(rid, response, exception)
+        self.batch.add(request.request, callback=record, request_id=request_id)
+
+    def execute(self):
+        self.batch.execute()
+
+
+class RecordingDriveService:
+    """
+    Wraps a real Drive service and records each request's response (or HTTP error) into a
+    cassette; call save() at the end. Record with a sequential crawl (workers=1): the real
+    client is not thread-safe.
+    """
+
+    def __init__(self, service, path):
+        self.service = service
+        self.path = path
+        self.interactions = {}
+        self._lock = threading.Lock()
+
+    def files(self):
+        return _RecordingResource(self, 'files', self.service.files())
+
+    def changes(self):
+        return _RecordingResource(self, 'changes', self.service.changes())
+
+    def new_batch_http_request(self, callback=None):
+        return _RecordingBatch(self, callback)
+
+    def _record(self, key, response, exception):
+        if exception is not None:
+            status = getattr(getattr(exception, 'resp', None), 'status', 500)
+            entry = {'error': {'status': int(status), 'reason': getattr(exception, 'reason', '') or ''}}
+        else:
+            entry = _encode_response(response)
+        with self._lock:
+            self.interactions.setdefault(key, []).append(entry)
+
+    def save(self):
+        with open(self.path, 'w', encoding='utf-8') as f:
+            json.dump({'format': CASSETTE_FORMAT, 'recorded_at': datetime.now().isoformat(),
+                       'interactions': self.interactions}, f, ensure_ascii=False)
+
+
+class _ReplayResource:
+    def __init__(self, service, name):
+        self.service = service
+        self.name = name
+
+    def __getattr__(self, method):
+        kind = f'{self.name}.{method}'
+
+        def build_request(**kwargs):
+            key = _interaction_key(kind, kwargs)
+            return _Request(self.service, kind, lambda: self.service._replay(key))
+        return build_request
+
+
+class ReplayDriveService(_CountingService):
+    """
+    Serves a cassette recorded by RecordingDriveService. Requests are matched by method and
+    arguments; repeated identical requests get the recorded responses in order (the last one
+    is repeated once they run out). An unrecorded request raises KeyError.
+    """
+
+    def __init__(self, path, latency=0.0, quota_error_rate=0.0, seed=0):
+        super().__init__(latency, quota_error_rate, seed)
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('format') != CASSETTE_FORMAT:
+            raise ValueError(f"Unsupported cassette format {data.get('format')!r}")
+        self.interactions = data['interactions']
+        self._positions = {}
+
+    def files(self):
+        return _ReplayResource(self, 'files')
+
+    def changes(self):
+        return _ReplayResource(self, 'changes')
+
+    def _replay(self, key):
+        with self._lock:
+            entries = self.interactions.get(key)
+            if not entries:
+                raise KeyError(f"Request not in cassette: {key}")
+            position = self._positions.get(key, 0)
+            self._positions[key] = position + 1
+            entry = entries[min(position, len(entries) - 1)]
+        return _decode_response(entry)
@@ -0,0 +1,357 @@
+"""
+Drive API instrumentation for generate_data.
+
+InstrumentedDriveService wraps a Drive service (real, ThreadLocalDriveService or drive_fake) and
+records every call by type (files.list, files.get, files.get_media, changes.list, ...), class and
+tree level: latency, errors, retries (a request executed again) and response bytes.
+The class and level come from scope(), set by the crawl around each stage:
+    run      - Changes API, snapshot and start token calls outside any class
+    class    - class root listing, assignments.md
+    topic    - topic folder listings
+    lesson   - lesson folder listings, README.md, lesson.json
+    content  - folders inside a lesson
+The crawl also reports cache outcomes with count_cache() (folder listings, lesson objects).
+
+write_report() saves all of it to build_report.json next to build.log, with a comparison
+against the report of the previous run.
+"""
+import os
+import json
+import time
+import threading
+import contextlib
+import contextvars
+from datetime import datetime
+
+from logger import log_event, LOG_FILE
+import cache_store
+
+REPORT_FORMAT = 1
+REPORT_PATH = os.path.join(os.path.dirname(LOG_FILE), 'build_report.json')
+LEVELS = ('run', 'class', 'topic', 'lesson', 'content')
+# Cache outcomes that count as hits in hit_ratio
+HIT_OUTCOMES = ('cache', 'hits', 'spliced', 'memo', 'revalidated')
+
+# (class url_name, level) of the crawl stage issuing Drive calls
+_SCOPE = contextvars.ContextVar('drive_metrics_scope', default=('', 'run'))
+
+
+@contextlib.contextmanager
+def scope(class_name=None, level=None):
+    """Attribute Drive calls made inside the block to class_name/level (None keeps the current one)."""
+    current_class, current_level = _SCOPE.get()
+    token = _SCOPE.set((current_class if class_name is None else class_name, level or current_level))
+    try:
+        yield
+    finally:
+        _SCOPE.reset(token)
+
+
+def submit(executor, fn, *args):
+    """executor.submit that runs fn in the caller's scope (pool threads do not inherit context variables)."""
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def _response_bytes(response):
+    """Size of a response body: media as downloaded, JSON re-serialized (uncompressed)."""
+    if isinstance(response, (bytes, bytearray)):
+        return len(response)
+    if response is None:
+        return 0
+    return len(json.dumps(response, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+
+class CrawlMetrics:
+    """Counters for one generate_data run. Safe to update from crawl worker threads."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = datetime.now()
+        self.kinds = {}
+        # (class, level, kind) -> calls
+        self.breakdown = {}
+        self.round_trips = 0
+        self.batches = 0
+        self.cache = {
+            'folder_listings': {'cache': 0, 'prefetched': 0, 'snapshot': 0, 'fetched': 0},
+            'lesson_objects': {'hits': 0, 'misses': 0},
+        }
+
+    def record_call(self, kind, call_scope, seconds, size=0, error=False, retry=False):
+        class_name, level = call_scope
+        with self._lock:
+            stats = self.kinds.setdefault(kind, {'count': 0, 'errors': 0, 'retries': 0, 'bytes': 0, 'latencies': []})
+            stats['count'] += 1
+            stats['errors'] += bool(error)
+            stats['retries'] += bool(retry)
+            stats['bytes'] += size
+            stats['latencies'].append(seconds)
+            key = (class_name, level, kind)
+            self.breakdown[key] = self.breakdown.get(key, 0) + 1
+
+    def record_round_trip(self, batch=False):
+        with self._lock:
+            self.round_trips += 1
+            self.batches += batch
+
+    def record_retry(self, kind):
+        """Count a retry of a kind of call made by a retry loop outside the wrapped request."""
+        with self._lock:
+            stats = self.kinds.setdefault(kind, {'count': 0, 'errors': 0, 'retries': 0, 'bytes': 0, 'latencies': []})
+            stats['retries'] += 1
+
+    def count_cache(self, cache_name, outcome):
+        with self._lock:
+            counters = self.cache.setdefault(cache_name, {})
+            counters[outcome] = counters.get(outcome, 0) + 1
+
+    def set_cache(self, cache_name, counters):
+        """Report counters kept elsewhere (e.g. NODE_CACHE_STATS) as one of the caches."""
+        with self._lock:
+            self.cache[cache_name] = dict(counters)
+
+    def state(self):
+        """Raw counters to send back from a crawl worker process (see merge)."""
+        with self._lock:
+            return {
+                'kinds': {kind: dict(stats, latencies=list(stats['latencies'])) for kind, stats in self.kinds.items()},
+                'breakdown': dict(self.breakdown),
+                'round_trips': self.round_trips,
+                'batches': self.batches,
+                'cache': {name: dict(counters) for name, counters in self.cache.items()},
+            }
+
+    def merge(self, state):
+        """Add the counters of a crawl worker process (its state()) to this run."""
+        with self._lock:
+            for kind, other in state['kinds'].items():
+                stats = self.kinds.setdefault(kind, {'count': 0, 'errors': 0, 'retries': 0, 'bytes': 0, 'latencies': []})
+                for name in ('count', 'errors', 'retries', 'bytes'):
+                    stats[name] += other[name]
+                stats['latencies'].extend(other['latencies'])
+            for key, count in state['breakdown'].items():
+                self.breakdown[key] = self.breakdown.get(key, 0) + count
+            self.round_trips += state['round_trips']
+            self.batches += state['batches']
+            for name, other in state['cache'].items():
+                counters = self.cache.setdefault(name, {})
+                for outcome, count in other.items():
+                    counters[outcome] = counters.get(outcome, 0) + count
+
+    def report(self):
+        """The run's counters as a JSON-serializable dict."""
+        with self._lock:
+            calls = {}
+            for kind, stats in sorted(self.kinds.items()):
+                latencies = sorted(stats['latencies'])
+                calls[kind] = {
+                    'count': stats['count'],
+                    'errors': stats['errors'],
+                    'retries': stats['retries'],
+                    'bytes': stats['bytes'],
+                    'total_seconds': round(sum(latencies), 3),
+                    'latency_ms': {name: round(_percentile(latencies, fraction) * 1000, 1)
+                                   for name, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('max', 1.0))},
+                }
+            by_class = {}
+            by_level = {}
+            ordered = sorted(self.breakdown.items(), key=lambda entry: (entry[0][0], LEVELS.index(entry[0][1]), entry[0][2]))
+            for (class_name, level, kind), count in ordered:
+                class_levels = by_class.setdefault(class_name or '(run)', {})
+                class_levels.setdefault(level, {})[kind] = count
+                by_level.setdefault(level, {})
+                by_level[level][kind] = by_level[level].get(kind, 0) + count
+            cache = {}
+            for cache_name, counters in self.cache.items():
+                total = sum(counters.values())
+                hits = sum(counters.get(outcome, 0) for outcome in HIT_OUTCOMES)
+                cache[cache_name] = dict(counters, hit_ratio=round(hits / total, 3) if total else None)
+            return {
+                'total_calls': sum(stats['count'] for stats in self.kinds.values()),
+                'round_trips': self.round_trips,
+                'batches': self.batches,
+                'calls': calls,
+                'calls_by_level': {level: by_level[level] for level in LEVELS if level in by_level},
+                'calls_by_class': by_class,
+                'cache': cache,
+            }
+
+
+METRICS = CrawlMetrics()
+
+
+def reset():
+    """Start counting a new run."""
+    global METRICS
+    METRICS = CrawlMetrics()
+    return METRICS
+
+
+def count_cache(cache_name, outcome):
+    METRICS.count_cache(cache_name, outcome)
+
+
+def record_retry(kind):
+    METRICS.record_retry(kind)
+
+
+class _InstrumentedRequest:
+    def __init__(self, kind, request):
+        self.kind = kind
+        self.request = request
+        self.scope = _SCOPE.get()
+        self.attempts = 0
+
+    def execute(self, *args, **kwargs):
+        self.attempts += 1
+        METRICS.record_round_trip()
+        start = time.perf_counter()
+        try:
+            response = self.request.execute(*args, **kwargs)
+        except Exception:
+            METRICS.record_call(self.kind, self.scope, time.perf_counter() - start, error=True, retry=self.attempts > 1)
+            raise
+        METRICS.record_call(self.kind, self.scope, time.perf_counter() - start, _response_bytes(response),
+                            retry=self.attempts > 1)
+        return response
+
+
+class _InstrumentedResource:
+    def __init__(self, name, resource):
+        self.name = name
+        self.resource = resource
+
+    def __getattr__(self, method):
+        def build_request(*args, **kwargs):
+            return _InstrumentedRequest(f'{self.name}.{method}', getattr(self.resource, method)(*args, **kwargs))
+        return build_request
+
+
+class _InstrumentedBatch:
+    """Batch request whose sub-requests are recorded with the batch's round-trip time."""
+
+    def __init__(self, batch, callback):
+        self.batch = batch
+        self.callback = callback
+        self.started = None
+
+    def add(self, request, callback=None, request_id=None):
+        user_callback = callback or self.callback
+
+        def record(rid, response, exception):
+            METRICS.record_call(request.kind, request.scope, time.perf_counter() - self.started,
+                                _response_bytes(response), error=exception is not None)
+            if user_callback is not None:
+                user_callback(rid, response, exception)
+        self.batch.add(request.request, callback=record, request_id=request_id)
+
+    def execute(self, *args, **kwargs):
+        METRICS.record_round_trip(batch=True)
+        self.started = time.perf_counter()
+        return self.batch.execute(*args, **kwargs)
+
+
+class InstrumentedDriveService:
+    """Drive service proxy recording every call into METRICS."""
+
+    def __init__(self, service):
+        self.service = service
+
+    def files(self):
+        return _InstrumentedResource('files', self.service.files())
+
+    def changes(self):
+        return _InstrumentedResource('changes', self.service.changes())
+
+    def new_batch_http_request(self, callback=None):
+        return _InstrumentedBatch(self.service.new_batch_http_request(callback=callback), callback)
+
+
+def _delta(previous, current):
+    change = None
+    if isinstance(previous, (int, float)) and isinstance(current, (int, float)) and previous:
+        change = round((current - previous) / previous * 100, 1)
+    return {'previous': previous, 'current': current, 'change_pct': change}
+
+
+def compare(previous, current):
+    """Differences between two reports: wall time, totals, per call type and cache hit ratios."""
+    kinds = sorted(set(previous.get('calls', {})) | set(current.get('calls', {})))
+    calls = {}
+    for kind in kinds:
+        before = previous.get('calls', {}).get(kind, {})
+        after = current.get('calls', {}).get(kind, {})
+        calls[kind] = {
+            'count': _delta(before.get('count', 0), after.get('count', 0)),
+            'total_seconds': _delta(before.get('total_seconds', 0.0), after.get('total_seconds', 0.0)),
+            'p90_ms': _delta(before.get('latency_ms', {}).get('p90'), after.get('latency_ms', {}).get('p90')),
+        }
+    caches = sorted(set(previous.get('cache', {})) | set(current.get('cache', {})))
+    return {
+        'previous_finished_at': previous.get('finished_at'),
+        'wall_seconds': _delta(previous.get('wall_seconds'), current.get('wall_seconds')),
+        'total_calls': _delta(previous.get('total_calls'), current.get('total_calls')),
+        'round_trips': _delta(previous.get('round_trips'), current.get('round_trips')),
+        'calls': calls,
+        'cache_hit_ratio': {name: _delta(previous.get('cache', {}).get(name, {}).get('hit_ratio'),
+                                         current.get('cache', {}).get(name, {}).get('hit_ratio'))
+                            for name in caches},
+    }
+
+
+def write_report(wall_seconds, options, extra=None, path=None):
+    """
+    Write METRICS to build_report.json (or path), comparing with the report already there.
+    options: the generate_data arguments of the run; extra: more sections (e.g. node/blob stats).
+    Returns the report.
+    """
+    path = path or REPORT_PATH
+    report = {
+        'format': REPORT_FORMAT,
+        'started_at': METRICS.started_at.isoformat(),
+        'finished_at': datetime.now().isoformat(),
+        'wall_seconds': round(wall_seconds, 3),
+        'options': options,
+    }
+    report.update(METRICS.report())
+    report.update(extra or {})
+
+    previous = None
+    if os.path.exists(path):
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                previous = json.load(f)
+        except Exception as e:
+            log_event(f"Could not read previous build report {path}: {e}")
+    if previous is not None and previous.get('format') == REPORT_FORMAT:
+        report['comparison'] = compare(previous, report)
+
+    try:
+        cache_store.write_text_atomic(path, json.dumps(report, ensure_ascii=False, indent=2))
+        log_event(f"Wrote build report {path}")
+    except Exception as e:
+        log_event(f"Could not write build report {path}: {e}")
+    return report
+
+
+def summary(report):
+    """A few lines for build.log / stdout: calls per type and the change since the previous run."""
+    parts = [f"{kind} {stats['count']} (p90 {stats['latency_ms']['p90']} ms)" for kind, stats in report['calls'].items()]
+    lines = [f"Drive API: {report['total_calls']} calls in {report['round_trips']} round trips"
+             + (": " + ", ".join(parts) if parts else "")]
+    listings = report['cache'].get('folder_listings', {})
+    lessons = report['cache'].get('lesson_objects', {})
+    lines.append(f"Cache hit ratio: folder listings {listings.get('hit_ratio')}, lesson objects {lessons.get('hit_ratio')}")
+    comparison = report.get('comparison')
+    if comparison:
+        wall = comparison['wall_seconds']
+        calls = comparison['total_calls']
+        lines.append(f"Previous run ({comparison['previous_finished_at']}): wall {wall['previous']}s -> {wall['current']}s "
+                     f"({wall['change_pct']}%), calls {calls['previous']} -> {calls['current']}")
+    return lines
@@ -0,0 +1,343 @@
+"""
+Quota-aware scheduler for Drive API calls.
+
+DriveScheduler wraps a Drive service (files(), changes(), new_batch_http_request) and runs every
+request through:
+    - a token bucket (rate calls per second, bursts up to burst), shared by all crawl threads;
+      when callers wait, the one with the best priority() goes first,
+    - retries with jittered exponential backoff on rate-limit and transient errors (403
+      userRateLimitExceeded/rateLimitExceeded, 429, 5xx, dropped connections), honouring Retry-After,
+    - an optional per-run call budget: once spent, every call raises DriveBudgetExceeded.
+A batch costs one token and one budget unit per sub-request; failed sub-requests are retried
+as a new batch.
+Crawl worker processes (generate_data(processes=N)) each run their own DriveScheduler on one
+SharedQuota: the bucket's tokens, the calls spent and the exhausted flag live in shared memory,
+so the rate limit and budget hold for the whole run.
+
+generate_data crawls classes in category priority order ('current' first). A class whose crawl
+fails with one of DRIVE_ERRORS keeps its last good JSON file.
+"""
+import json
+import time
+import heapq
+import random
+import itertools
+import threading
+import contextlib
+import contextvars
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+import drive_metrics
+from logger import log_event
+
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+RATE_LIMIT_REASONS = ('userRateLimitExceeded', 'rateLimitExceeded')
+
+# Lower is more urgent; set per class by generate_data
+_PRIORITY = contextvars.ContextVar('drive_scheduler_priority', default=0)
+
+
+class DriveBudgetExceeded(Exception):
+    """The per-run Drive call budget is spent."""
+
+
+# Errors that mean Drive could not be reached or refused the call; readers must not swallow them
+DRIVE_ERRORS = (HttpError, DriveBudgetExceeded, ConnectionError, TimeoutError, httplib2.HttpLib2Error)
+
+
+@contextlib.contextmanager
+def priority(value):
+    """Give Drive calls made inside the block this priority (lower waits less for the rate limiter)."""
+    token = _PRIORITY.set(value)
+    try:
+        yield
+    finally:
+        _PRIORITY.reset(token)
+
+
+def _error_reason(error):
+    """The 'reason' of a Drive HttpError (e.g. userRateLimitExceeded), or ''."""
+    try:
+        content = error.content.decode('utf-8') if isinstance(error.content, bytes) else error.content
+        return json.loads(content)['error']['errors'][0]['reason']
+    except Exception:
+        return ''
+
+
+def is_retryable(error):
+    """Whether a failed call is worth retrying: rate limits, server errors and dropped connections."""
+    if isinstance(error, HttpError):
+        status = int(getattr(error.resp, 'status', 0))
+        return status in RETRYABLE_STATUSES or (status == 403 and _error_reason(error) in RATE_LIMIT_REASONS)
+    return isinstance(error, (ConnectionError, TimeoutError, httplib2.HttpLib2Error))
+
+
+def is_quota_error(error):
+    """Rate limited (after all retries) or out of budget: the crawl cannot go on."""
+    return isinstance(error, DriveBudgetExceeded) or is_retryable(error)
+
+
+def _retry_after(error):
+    try:
+        return float(error.resp.get('retry-after'))
+    except (AttributeError, TypeError, ValueError):
+        return 0.0
+
+
+class SharedQuota:
+    """
+    Token bucket state, calls spent and exhausted flag in shared memory for crawl worker processes.
+    Create it from a multiprocessing context and pass it to the workers at start (initargs).
+    """
+
+    def __init__(self, context, burst):
+        self.lock = context.Lock()
+        self.tokens = context.Value('d', float(max(1, burst)), lock=False)
+        # Wall clock: unlike time.monotonic() it is comparable between processes
+        self.updated = context.Value('d', time.time(), lock=False)
+        self.calls = context.Value('q', 0, lock=False)
+        self.exhausted = context.Value('b', 0, lock=False)
+
+
+class TokenBucket:
+    """Thread-safe token bucket; rate 0 (or None) means unlimited. With shared, the tokens are shared by processes."""
+
+    def __init__(self, rate, burst, shared=None):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.shared = shared
+        self._cond = threading.Condition()
+        self._waiting = []
+        self._order = itertools.count()
+
+    def _take(self, count):
+        """Take count tokens if there are enough; returns 0, or the seconds until there will be."""
+        if self.shared is None:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= count:
+                self.tokens -= count
+                return 0.0
+            return (count - self.tokens) / self.rate
+        shared = self.shared
+        with shared.lock:
+            now = time.time()
+            tokens = min(self.burst, shared.tokens.value + max(0.0, now - shared.updated.value) * self.rate)
+            shared.updated.value = now
+            if tokens >= count:
+                shared.tokens.value = tokens - count
+                return 0.0
+            shared.tokens.value = tokens
+            return (count - tokens) / self.rate
+
+    def acquire(self, count=1, priority=0):
+        """Take count tokens, blocking until they are available. Returns the seconds waited."""
+        if not self.rate:
+            return 0.0
+        count = min(count, self.burst)
+        entry = (priority, next(self._order))
+        start = time.monotonic()
+        with self._cond:
+            heapq.heappush(self._waiting, entry)
+            try:
+                while True:
+                    if self._waiting[0] == entry:
+                        wait = self._take(count)
+                        if not wait:
+                            return time.monotonic() - start
+                        self._cond.wait(wait)
+                    else:
+                        # Someone more urgent (or earlier) is first in line
+                        self._cond.wait()
+            finally:
+                self._waiting.remove(entry)
+                heapq.heapify(self._waiting)
+                self._cond.notify_all()
+
+
+class DriveScheduler:
+    """
+    Drive service proxy applying the rate limit, retries and budget to every call.
+    Safe to share between crawl threads; with shared (a SharedQuota), the rate limit, calls
+    and budget are those of every process using it.
+    """
+
+    def __init__(self, service, rate=0, burst=1, max_retries=5, budget=None,
+                 backoff_base=1.0, backoff_cap=32.0, sleep=time.sleep, seed=None, shared=None):
+        self.service = service
+        self.bucket = TokenBucket(rate, burst, shared)
+        self.shared = shared
+        self.max_retries = max_retries
+        self.budget = budget
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.sleep = sleep
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._calls = 0
+        self.retries = 0
+        self.throttled_seconds = 0.0
+        self.backoff_seconds = 0.0
+        self._exhausted = False
+
+    @property
+    def calls(self):
+        return self.shared.calls.value if self.shared is not None else self._calls
+
+    @property
+    def exhausted(self):
+        """Set once the budget is spent or a call gave up on a rate limit."""
+        return bool(self.shared.exhausted.value) if self.shared is not None else self._exhausted
+
+    def _set_exhausted(self):
+        if self.shared is not None:
+            self.shared.exhausted.value = 1
+        self._exhausted = True
+
+    def files(self):
+        return _ScheduledResource(self, self.service.files())
+
+    def changes(self):
+        return _ScheduledResource(self, self.service.changes())
+
+    def new_batch_http_request(self, callback=None):
+        return _ScheduledBatch(self, callback)
+
+    def _spend(self, count):
+        with self._lock, (self.shared.lock if self.shared is not None else contextlib.nullcontext()):
+            calls = self.calls
+            if self.budget is not None and calls + count > self.budget:
+                self._set_exhausted()
+                raise DriveBudgetExceeded(f"Drive call budget of {self.budget} calls is spent")
+            if self.shared is not None:
+                self.shared.calls.value = calls + count
+            else:
+                self._calls = calls + count
+        waited = self.bucket.acquire(count, _PRIORITY.get())
+        if waited:
+            with self._lock:
+                self.throttled_seconds += waited
+
+    def backoff(self, attempt, error=None):
+        """Sleep before retry number attempt (0-based): full jitter, at least Retry-After."""
+        delay = self._random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+        if error is not None:
+            delay = max(delay, _retry_after(error))
+        with self._lock:
+            self.retries += 1
+            self.backoff_seconds += delay
+        self.sleep(delay)
+
+    def _give_up(self, error):
+        if is_quota_error(error):
+            with self._lock:
+                self._set_exhausted()
+        log_event(f"Drive call failed after {self.max_retries} retries: {error}")
+
+    def run(self, call, count=1):
+        """Call call() (one Drive round trip of count calls) under the rate limit, budget and retries."""
+        attempt = 0
+        while True:
+            self._spend(count)
+            try:
+                return call()
+            except Exception as e:
+                if not is_retryable(e):
+                    raise
+                if attempt >= self.max_retries:
+                    self._give_up(e)
+                    raise
+                self.backoff(attempt, e)
+                attempt += 1
+
+    def merge_stats(self, stats):
+        """Add the retries and waits of a crawl worker process's scheduler (its stats()) to this one."""
+        with self._lock:
+            self.retries += stats['retries']
+            self.throttled_seconds += stats['throttled_seconds']
+            self.backoff_seconds += stats['backoff_seconds']
+
+    def stats(self):
+        """Counters for build_report.json."""
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'retries': self.retries,
+                'budget': self.budget,
+                'exhausted': self.exhausted,
+                'throttled_seconds': round(self.throttled_seconds, 3),
+                'backoff_seconds': round(self.backoff_seconds, 3),
+            }
+
+
+class _ScheduledRequest:
+    def __init__(self, scheduler, request):
+        self.scheduler = scheduler
+        self.request = request
+
+    def execute(self, *args, **kwargs):
+        return self.scheduler.run(lambda: self.request.execute(*args, **kwargs))
+
+
+class _ScheduledResource:
+    def __init__(self, scheduler, resource):
+        self.scheduler = scheduler
+        self.resource = resource
+
+    def __getattr__(self, method):
+        def build_request(*args, **kwargs):
+            return _ScheduledRequest(self.scheduler, getattr(self.resource, method)(*args, **kwargs))
+        return build_request
+
+
+class _ScheduledBatch:
+    """Batch request whose rate-limited or transiently failed sub-requests are sent again."""
+
+    def __init__(self, scheduler, callback):
+        self.scheduler = scheduler
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        request_id = request_id if request_id is not None else str(len(self.requests) + 1)
+        self.requests.append((request, callback or self.callback, request_id))
+
+    def execute(self):
+        scheduler = self.scheduler
+        pending = list(self.requests)
+        attempt = 0
+        while pending:
+            results = {}
+
+            def collect(request_id, response, exception):
+                results[request_id] = (response, exception)
+
+            def send():
+                # A fresh batch per try: a batch object is not sent twice
+                results.clear()
+                batch = scheduler.service.new_batch_http_request(callback=collect)
+                for request, _, request_id in pending:
+                    batch.add(request.request, callback=collect, request_id=request_id)
+                batch.execute()
+            scheduler.run(send, count=len(pending))
+
+            retry = []
+            for entry in pending:
+                request, callback, request_id = entry
+                response, exception = results.get(request_id, (None, None))
+                if exception is not None and is_retryable(exception):
+                    if attempt < scheduler.max_retries:
+                        retry.append(entry)
+                        drive_metrics.record_retry(getattr(request.request, 'kind', 'batch'))
+                        continue
+                    scheduler._give_up(exception)
+                callback(request_id, response, exception)
+            if retry:
+                scheduler.backoff(attempt)
+                attempt += 1
+            pending = retry
@@ -1,6 +1,7 @@
 import os
 import json
 import re
+import hashlib
 import jsonschema  # <-- Added for JSON validation
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
@@ -9,7 +10,20 @@ from google.auth.transport.requests import Request
 import pickle
 from natsort import natsorted
 import shutil
-from logger import log_event
+import time
+import threading
+import itertools
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from logger import log_event, log_to_queue, start_log_listener
+import drive_batch
+import drive_metrics
+import drive_scheduler
+import cache_store
+import cache_migrations
+import cache_gc
+import cache_lock
+import run_memo
 from datetime import datetime
 import pytz
 import markdown
@@ -34,8 +48,61 @@ LESSON_SCHEMA = None
 CACHE_DIR = os.path.join('cache', 'folder_listings')
 # Cached full lesson objects (when folder unchanged: skip README, lesson.json, crawl_lesson_content)
 LESSON_OBJ_CACHE_DIR = os.path.join('cache', 'lesson_objects')
+# Merkle node cache: crawl output of each class root, topic and content folder (see get_cached_node)
+NODE_CACHE_DIR = os.path.join('cache', 'nodes')
+# Downloaded README/lesson.json/assignments text and rendered result, keyed by md5Checksum (see get_cached_blob)
+BLOB_CACHE_DIR = os.path.join('cache', 'blobs')
 # Changes API: saved startPageToken for next run (cleared when clearing all cache)
 CHANGES_STATE_PATH = os.path.join('cache', 'changes_state.json')
+# Where listings and lesson objects are stored (see cache_store.py):
+# 'files' = one JSON file per folder in the two directories above, 'sqlite' = single database file.
+CACHE_BACKEND = 'files'
+SQLITE_CACHE_PATH = os.path.join('cache', 'cache.sqlite3')
+# 'files' backend: child -> parent index over the cached listings, used by drive_changes.compute_affected_folder_ids
+PARENT_INDEX_PATH = os.path.join('cache', 'parent_index.json')
+# Opened on first use by get_cache_store()
+CACHE_STORE = None
+# Garbage collection of cache entries no class root reaches, and changes_api/ compaction (see cache_gc.py):
+# at the end of generate_data, at most every CACHE_GC_INTERVAL_HOURS (0 = every run) or when the class roots changed
+CACHE_GC_INTERVAL_HOURS = 24
+# Size cap for the cache entries left after the sweep (None = no cap); the cheapest to rebuild are evicted first
+CACHE_MAX_BYTES = 512 * 1024 * 1024
+# Time and class roots of the last garbage collection
+GC_STATE_PATH = os.path.join('cache', 'gc_state.json')
+
+# Drive batch requests (set by generate_data when batching is enabled, see drive_batch.py)
+DRIVE_BATCHER = None
+# Drive request scheduler (see drive_scheduler.py): sustained calls per second (0 = unlimited), burst size,
+# retries per call on rate limits/transient errors (first backoff up to DRIVE_BACKOFF_BASE seconds, doubling),
+# and the call budget per run (None = unlimited)
+DRIVE_RATE_LIMIT = 100
+DRIVE_RATE_BURST = 100
+DRIVE_MAX_RETRIES = 5
+DRIVE_BACKOFF_BASE = 1.0
+DRIVE_CALL_BUDGET = None
+# Listings fetched ahead of time by prefetch_folder_listings, consumed by list_folder_contents
+_PREFETCHED_LISTINGS = {}
+_PREFETCH_LOCK = threading.Lock()
+# modifiedTime of child folders as reported by listings fetched fresh this run.
+# A cached child listing with a different modified_time is stale (validated without the Changes API),
+# and a refetch can skip the separate files().get for its modifiedTime.
+_REPORTED_MODIFIED_TIMES = {}
+# Whole-Drive parent->children index (set by generate_data in snapshot mode, see load_drive_snapshot)
+DRIVE_SNAPSHOT = None
+# In-run memos (see run_memo.py), cleared by generate_data: folder listings by resolved folder id, and
+# crawled content subtrees by (folder id, listing hash). Sizes are entry counts.
+LISTING_MEMO_SIZE = 4096
+CONTENT_MEMO_SIZE = 2048
+LISTING_MEMO = run_memo.RunMemo(LISTING_MEMO_SIZE)
+CONTENT_MEMO = run_memo.RunMemo(CONTENT_MEMO_SIZE)
+# Node cache counters for the build log (reset by generate_data); one lock for all cache counters
+NODE_CACHE_STATS = {'spliced': 0, 'rebuilt': 0}
+_CACHE_STATS_LOCK = threading.Lock()
+# Blob cache (set by generate_data: off when use_cache is False) and its counters
+BLOB_CACHE_ENABLED = True
+BLOB_CACHE_STATS = {'hits': 0, 'misses': 0}
+# Settings, Drive client and shared quota of a crawl worker process (generate_data(processes=N))
+_WORKER = None
 
 # Assignments filename (can be changed easily)
 ASSIGNMENTS_FILENAME = 'assignments.md'
@@ -75,6 +142,9 @@ SITE_CATEGORIES = [
     {'id': 'past', 'title': 'כיתות עבר'},
     {'id': 'other', 'title': 'אחר'}
 ]
+# Classes are crawled in this category order; under Drive quota pressure the classes first in the list
+# finish fresh and the others keep their last generated JSON
+CLASS_CATEGORY_PRIORITY = ['current', 'past', 'bagruyot', 'other']
 
 class_info = [
     {
@@ -178,8 +248,8 @@ class_info = [
     }
 ]
 
-def get_drive_service():
-    """Authenticate and return a Google Drive service client. if changing credentials, delete token.pickle"""
+def get_drive_credentials():
+    """Load (or create via OAuth flow) the Drive credentials. if changing credentials, delete token.pickle"""
     creds = None
     if os.path.exists(TOKEN_PATH):
         with open(TOKEN_PATH, 'rb') as token:
@@ -192,7 +262,42 @@ def get_drive_service():
             creds = flow.run_local_server(port=0)
         with open(TOKEN_PATH, 'wb') as token:
             pickle.dump(creds, token)
-    return build('drive', 'v3', credentials=creds)
+    return creds
+
+def get_drive_service():
+    """Authenticate and return a Google Drive service client. if changing credentials, delete token.pickle"""
+    return build('drive', 'v3', credentials=get_drive_credentials())
+
+
+class ThreadLocalDriveService:
+    """
+    Drive service proxy that builds a separate service client for every thread.
+    googleapiclient service objects share one httplib2 connection and are not
+    thread-safe, so each crawl worker thread gets its own client from factory().
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._local = threading.local()
+
+    def __getattr__(self, name):
+        service = getattr(self._local, 'service', None)
+        if service is None:
+            service = self._factory()
+            self._local.service = service
+        return getattr(service, name)
+
+
+def _map_ordered(executor, fn, items):
+    """
+    Apply fn to every item and return the results in input order.
+    Runs sequentially when executor is None, otherwise fans out over the pool;
+    either way the result order (and so the generated JSON) is identical.
+    """
+    if executor is None:
+        return [fn(item) for item in items]
+    futures = [drive_metrics.submit(executor, fn, item) for item in items]
+    return [future.result() for future in futures]
 
 def create_base64_credentials():
     """Create base64-encoded credentials file for GitHub Actions if it doesn't exist."""
@@ -223,6 +328,65 @@ def extract_folder_id(url):
     match = re.search(r'/folders/([a-zA-Z0-9_-]+)', url)
     return match.group(1) if match else url
 
+def _find_file_item(folder_items, name):
+    """Return the listing item of the (non-folder) file called name, or None."""
+    for item in folder_items:
+        if item.get('name') == name and item.get('mimeType') != 'application/vnd.google-apps.folder':
+            return item
+    return None
+
+
+def _blob_key(kind, item):
+    """
+    Content key of a small text file: its md5Checksum, else its id and version.
+    None when the listing has neither (e.g. a shortcut), so the file is always downloaded.
+    """
+    if item.get('md5Checksum'):
+        return f"{kind}-md5-{item['md5Checksum']}"
+    if item.get('version'):
+        return f"{kind}-{item['id']}-v{item['version']}"
+    return None
+
+
+def _lesson_json_blob_kind(schema):
+    """Blob kind of lesson.json: the cached result was validated against the schema, so the schema is part of the key."""
+    schema_digest = hashlib.sha1(json.dumps(schema, sort_keys=True).encode('utf-8')).hexdigest()[:8]
+    return f"lesson_json-{schema_digest}"
+
+
+def _blob_kinds(schema):
+    """File name -> blob kind of the files whose rendered result is cached by content (see get_cached_blob)."""
+    return {'README.md': 'readme', 'lesson.json': _lesson_json_blob_kind(schema), ASSIGNMENTS_FILENAME: 'assignments'}
+
+
+def get_cached_blob(kind, item):
+    """
+    Return the cached rendered result for a README/lesson.json/assignments file whose content
+    is unchanged (same md5Checksum or version), or None when it must be downloaded.
+    """
+    key = _blob_key(kind, item) if BLOB_CACHE_ENABLED else None
+    blob = None
+    if key is not None:
+        try:
+            blob = get_cache_store().get_blob(key)
+        except Exception as e:
+            log_event(f"Blob cache read error for {key}: {str(e)}")
+    with _CACHE_STATS_LOCK:
+        BLOB_CACHE_STATS['hits' if blob is not None else 'misses'] += 1
+    return blob['result'] if blob is not None else None
+
+
+def save_blob_cache(kind, item, raw_text, result):
+    """Cache the downloaded text of a file and its rendered result under the file's content key."""
+    key = _blob_key(kind, item) if BLOB_CACHE_ENABLED else None
+    if key is None:
+        return
+    try:
+        get_cache_store().put_blob(key, {'raw': raw_text, 'result': result, 'cached_at': datetime.now().isoformat()})
+    except Exception as e:
+        log_event(f"Blob cache write error for {key}: {str(e)}")
+
+
 def read_readme_file(service, folder_id, folder_items):
     """
     Read README.md file from a Google Drive folder and return its HTML content.
@@ -233,29 +397,33 @@ def read_readme_file(service, folder_id, folder_items):
         folder_items: List of items already fetched from folder listing.
     """
     try:
-        readme_file_id = None
-        
         # Check folder_items for README.md
-        for item in folder_items:
-            if item.get('name') == 'README.md' and item.get('mimeType') != 'application/vnd.google-apps.folder':
-                readme_file_id = item.get('id')
-                break
+        readme_item = _find_file_item(folder_items, 'README.md')
         
         # If not found, return empty string (file doesn't exist)
-        if not readme_file_id:
+        if not readme_item:
             return ""
         
+        # Unchanged since it was last rendered: no download
+        cached_html = get_cached_blob('readme', readme_item)
+        if cached_html is not None:
+            return cached_html
+        
         # Download the file content
-        file_content = service.files().get_media(fileId=readme_file_id).execute()
+        file_content = service.files().get_media(fileId=readme_item['id']).execute()
         
         # Decode the content (assuming UTF-8 encoding)
         markdown_text = file_content.decode('utf-8')
         
         # Convert markdown to HTML with better options for Hebrew text
         html_content = markdown.markdown(markdown_text, extensions=['extra', 'codehilite'])
+        save_blob_cache('readme', readme_item, markdown_text, html_content)
         
         return html_content
         
+    except drive_scheduler.DRIVE_ERRORS:
+        # Drive refused or dropped the call: fail the class crawl instead of caching an empty description
+        raise
     except Exception as e:
         log_event(f"Error reading README.md from folder {folder_id}: {str(e)}")
         return ""
@@ -272,19 +440,19 @@ def read_lesson_json(service, folder_id, folder_items):
     """
     global LESSON_SCHEMA # <-- Ensure we have access to the global schema
     try:
-        lesson_json_id = None
-        
         # Check folder_items for lesson.json
-        for item in folder_items:
-            if item.get('name') == 'lesson.json' and item.get('mimeType') != 'application/vnd.google-apps.folder':
-                lesson_json_id = item.get('id')
-                break
+        lesson_json_item = _find_file_item(folder_items, 'lesson.json')
         
         # If not found, return empty dict (file doesn't exist)
-        if not lesson_json_id:
+        if not lesson_json_item:
             return {}
         
-        file_content = service.files().get_media(fileId=lesson_json_id).execute()
+        blob_kind = _lesson_json_blob_kind(LESSON_SCHEMA)
+        cached_json = get_cached_blob(blob_kind, lesson_json_item)
+        if cached_json is not None:
+            return cached_json
+        
+        file_content = service.files().get_media(fileId=lesson_json_item['id']).execute()
         json_text = file_content.decode('utf-8')
         parsed_json = json.loads(json_text)
         
@@ -295,10 +463,13 @@ def read_lesson_json(service, folder_id, folder_items):
             except jsonschema.ValidationError as e:
                 print(f"Schema validation error in lesson.json (folder {folder_id}): {e.message}")
                 log_event(f"Schema validation error in lesson.json (folder {folder_id}): {e.message}")
-                return {} # Return empty dict if validation fails, ignoring the invalid data
+                return {} # Return empty dict if validation fails, ignoring the invalid data (not cached: reported every run)
         # ------------------------------
+        save_blob_cache(blob_kind, lesson_json_item, json_text, parsed_json)
         
         return parsed_json
+    except drive_scheduler.DRIVE_ERRORS:
+        raise
     except Exception as e:
         log_event(f"Error reading lesson.json from folder {folder_id}: {str(e)}")
         return {}
@@ -350,17 +521,18 @@ def read_assignments_file(service, folder_id, folder_items):
         folder_items: List of items already fetched from folder listing.
     """
     try:
-        assignments_file_id = None
-        
         # Check folder_items for assignments.md
-        for item in folder_items:
-            if item.get('name') == ASSIGNMENTS_FILENAME and item.get('mimeType') != 'application/vnd.google-apps.folder':
-                assignments_file_id = item.get('id')
-                break
+        assignments_item = _find_file_item(folder_items, ASSIGNMENTS_FILENAME)
         
         # If not found, return empty strings (file doesn't exist)
-        if not assignments_file_id:
+        if not assignments_item:
             return "", ""
+        assignments_file_id = assignments_item['id']
+        
+        # Unchanged since it was last rendered: no download
+        cached_html = get_cached_blob('assignments', assignments_item)
+        if cached_html is not None:
+            return cached_html, assignments_file_id
         
         # Download the file content
         file_content = service.files().get_media(fileId=assignments_file_id).execute()
@@ -399,9 +571,12 @@ def read_assignments_file(service, folder_id, folder_items):
             last_index = close_idx + 1
             search_start = close_idx + 1
         truncated_html = html_content[:last_index]
+        save_blob_cache('assignments', assignments_item, file_content.decode('utf-8'), truncated_html)
         
         return truncated_html, assignments_file_id
         
+    except drive_scheduler.DRIVE_ERRORS:
+        raise
     except Exception as e:
         log_event(f"Error reading {ASSIGNMENTS_FILENAME} from folder {folder_id}: {str(e)}")
         return "", ""
@@ -443,11 +618,138 @@ def display_name_from_filename(filename: str) -> str:
     return _remove_configured_extensions(filename)
 
 
-def _folder_cache_path(folder_id):
-    """Return cache file path for a folder (safe for any folder_id including nested subfolders)."""
-    # Folder IDs are alphanumeric with - and _; sanitize for filesystem
-    safe_id = re.sub(r'[^\w\-]', '_', folder_id)
-    return os.path.join(CACHE_DIR, f"{safe_id}.json")
+def get_cache_store():
+    """Return the cache store for CACHE_BACKEND, opening it on first use."""
+    global CACHE_STORE
+    if CACHE_STORE is None:
+        CACHE_STORE = cache_store.open_cache_store(
+            CACHE_BACKEND, CACHE_DIR, LESSON_OBJ_CACHE_DIR, SQLITE_CACHE_PATH, PARENT_INDEX_PATH, NODE_CACHE_DIR,
+            BLOB_CACHE_DIR
+        )
+    return CACHE_STORE
+
+
+def set_cache_backend(backend):
+    """Switch the cache backend ('files' or 'sqlite'); the store is reopened on next use."""
+    global CACHE_BACKEND, CACHE_STORE
+    if backend not in cache_store.BACKENDS:
+        raise ValueError(f"Unknown cache backend {backend!r}, expected one of {cache_store.BACKENDS}")
+    if CACHE_STORE is not None and backend != CACHE_BACKEND:
+        CACHE_STORE.close()
+        CACHE_STORE = None
+    CACHE_BACKEND = backend
+
+
+def load_changes_state():
+    """
+    Return the saved changes state ({"startPageToken", "pendingFolderIds"?, "crawledRoots"?}) upgraded to the current
+    format, or None when there is none or it cannot be upgraded (the run then crawls without it).
+    """
+    if not os.path.exists(CHANGES_STATE_PATH):
+        return None
+    try:
+        with open(CHANGES_STATE_PATH, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+    except Exception as e:
+        log_event(f"Could not load changes state: {e}; removing it")
+        cache_migrations.count_invalidated('changes_state')
+        current = None
+    else:
+        current = cache_migrations.upgrade('changes_state', state)
+        if current is None:
+            log_event(f"Changes state of format {cache_migrations.entry_format(state)} cannot be upgraded; removing it")
+    if current is None:
+        # Gone, so this run saves a fresh start token for the next one
+        os.remove(CHANGES_STATE_PATH)
+    elif current is not state:
+        save_changes_state(current)
+    return current
+
+
+def save_changes_state(state):
+    """Write the changes state (marked with its format) for the next run."""
+    cache_store.write_text_atomic(CHANGES_STATE_PATH, json.dumps(cache_migrations.stamp('changes_state', state), indent=2))
+
+
+def keep_dropped_listings_pending(store):
+    """
+    Add the folders whose cached listing was dropped (unreadable or not upgradable, see
+    cache_store.take_dropped_listings) and every folder above them to the changes state's
+    pendingFolderIds: the Changes API will not report them, and the cached nodes above them
+    would hide their changes, so the next run fetches them again and crawls their classes.
+    """
+    dropped = store.take_dropped_listings()
+    state = load_changes_state() if dropped else None
+    if not state:
+        # Without a changes state the next run crawls every class from its root anyway
+        return
+    import drive_changes
+    pending = drive_changes.with_ancestors(dropped, store)
+    save_changes_state(dict(state, pendingFolderIds=sorted(pending | set(state.get('pendingFolderIds', [])))))
+    log_event(f"{len(dropped)} cached listings were dropped; keeping them and the folders above them "
+              f"({len(pending)} folder IDs) for the next run")
+
+
+def migrate_cache(cache_backend=None):
+    """Upgrade every cache entry and the changes state to the current formats now, instead of on first read."""
+    if cache_backend:
+        set_cache_backend(cache_backend)
+    cache_migrations.reset_stats()
+    store = get_cache_store()
+    checked = store.migrate_entries()
+    store.flush()
+    load_changes_state()
+    keep_dropped_listings_pending(store)
+    msg = cache_migrations.summary() or 'Cache format migrations: every entry is current'
+    msg += f' ({checked} cache entries checked)'
+    log_event(msg)
+    print(msg)
+    return cache_migrations.stats()
+
+
+def collect_cache_garbage(classes=None, force=False):
+    """
+    Remove the cache entries of folders no class root reaches and the blobs no cached file refers to,
+    cap the cache at CACHE_MAX_BYTES (see cache_gc.py) and compact changes_api/ (drive_changes.compact_changes).
+    Without force, runs only when the last collection is CACHE_GC_INTERVAL_HOURS old or was made for
+    other class roots. Only the given classes (default class_info) are roots: entries of any other class are removed.
+    Returns the collection stats, or None when skipped.
+    """
+    import drive_changes
+    classes = class_info if classes is None else classes
+    root_ids = sorted({extract_folder_id(cls['google_drive_url']) for cls in classes})
+    state = {}
+    if os.path.exists(GC_STATE_PATH):
+        try:
+            with open(GC_STATE_PATH, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except Exception as e:
+            log_event(f"Could not load cache GC state: {e}")
+    if not force and state.get('roots') == root_ids and time.time() - state.get('collected_at', 0) < CACHE_GC_INTERVAL_HOURS * 3600:
+        return None
+    schema = LESSON_SCHEMA
+    if schema is None:
+        with open(SCHEMA_PATH, 'r', encoding='utf-8') as f:
+            schema = json.load(f)
+    blob_kinds = _blob_kinds(schema)
+
+    def blob_keys(item):
+        kind = blob_kinds.get(item.get('name'))
+        key = _blob_key(kind, item) if kind else None
+        return [key] if key else []
+
+    store = get_cache_store()
+    # Listings dropped earlier in the run were fetched again by the crawl
+    store.take_dropped_listings()
+    stats = cache_gc.collect(store, root_ids, blob_keys, CACHE_MAX_BYTES)
+    # A listing dropped while marking takes the folders below it out of the cache (swept)
+    keep_dropped_listings_pending(store)
+    stats['changes_files_journaled'] = drive_changes.compact_changes()
+    if stats['changes_files_journaled']:
+        log_event(f"Moved {stats['changes_files_journaled']} old changes files into the changes_api journal")
+    cache_store.write_text_atomic(GC_STATE_PATH, json.dumps({'collected_at': time.time(), 'roots': root_ids}, indent=2))
+    print(cache_gc.summary(stats))
+    return stats
 
 
 def clear_folder_listing_cache(folder_id=None):
@@ -455,124 +757,295 @@ def clear_folder_listing_cache(folder_id=None):
     Clear folder listing cache (and lesson object cache when clearing all).
     If folder_id is given, clear only that folder's cache; otherwise clear all.
     """
-    os.makedirs(CACHE_DIR, exist_ok=True)
+    store = get_cache_store()
     if folder_id:
-        path = _folder_cache_path(folder_id)
-        if os.path.exists(path):
-            os.remove(path)
+        if store.delete_listing(folder_id):
             log_event(f"Cleared cache for folder {folder_id}")
-        lesson_path = _lesson_cache_path(folder_id)
-        if os.path.exists(lesson_path):
-            os.remove(lesson_path)
+        store.delete_lesson(folder_id)
+        store.delete_nodes(folder_id)
     else:
-        for name in os.listdir(CACHE_DIR):
-            if name.endswith('.json'):
-                os.remove(os.path.join(CACHE_DIR, name))
+        store.clear_listings()
         log_event("Cleared all folder listing cache")
-        if os.path.isdir(LESSON_OBJ_CACHE_DIR):
-            for name in os.listdir(LESSON_OBJ_CACHE_DIR):
-                if name.endswith('.json'):
-                    os.remove(os.path.join(LESSON_OBJ_CACHE_DIR, name))
-            log_event("Cleared all lesson object cache")
+        store.clear_lessons()
+        log_event("Cleared all lesson object cache")
+        store.clear_nodes()
+        log_event("Cleared all node cache")
+        store.clear_blobs()
+        log_event("Cleared all blob cache")
         if os.path.exists(CHANGES_STATE_PATH):
             os.remove(CHANGES_STATE_PATH)
             log_event("Cleared changes state (startPageToken)")
 
 
-def _lesson_cache_path(folder_id):
-    """Return cache file path for a lesson object (keyed by lesson folder_id)."""
-    safe_id = re.sub(r'[^\w\-]', '_', folder_id)
-    return os.path.join(LESSON_OBJ_CACHE_DIR, f"{safe_id}.json")
-
-
-def get_cached_lesson_obj(lesson_folder_id, folder_modified_time):
+def get_cached_lesson_entry(lesson_folder_id):
     """
-    Return cached lesson object if it exists and matches folder modified_time.
-    Lesson object has keys: name, desc, content, lesson_json (id is set by caller).
+    Return the cached entry of a lesson folder, or None: {"modified_time", "lesson_obj", "manifest"}.
+    Lesson object has keys: name, desc, content, lesson_json, node_hash (id is set by caller).
     """
-    path = _lesson_cache_path(lesson_folder_id)
-    if not os.path.exists(path):
-        return None
     try:
-        with open(path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        if data.get('modified_time') != folder_modified_time:
-            return None
-        #log_event(f"Lesson object cache hit for folder {lesson_folder_id}")
-        return data.get('lesson_obj')
+        return get_cache_store().get_lesson(lesson_folder_id)
     except Exception as e:
         log_event(f"Lesson cache read error for {lesson_folder_id}: {str(e)}")
         return None
 
 
-def save_lesson_obj_cache(lesson_folder_id, folder_modified_time, lesson_obj):
-    """Save lesson object to cache (stores name, desc, content, lesson_json; id set by caller)."""
-    os.makedirs(LESSON_OBJ_CACHE_DIR, exist_ok=True)
-    path = _lesson_cache_path(lesson_folder_id)
+def save_lesson_obj_cache(lesson_folder_id, folder_modified_time, lesson_obj, node_hash=None, manifest=None):
+    """
+    Save lesson object to cache (stores name, desc, content, lesson_json; id set by caller).
+    node_hash: Merkle hash of the lesson folder, kept so a cache hit can still report it to its topic.
+    manifest: signatures of the folders it was built from (see _lesson_manifest), for revalidation.
+    """
     # Store without 'id' so it's stable; caller sets id when using
     cache_obj = {
         'name': lesson_obj['name'],
         'desc': lesson_obj['desc'],
         'content': lesson_obj['content'],
         'lesson_json': lesson_obj['lesson_json'],
+        'node_hash': node_hash,
     }
     data = {
         'modified_time': folder_modified_time,
         'cached_at': datetime.now().isoformat(),
         'lesson_obj': cache_obj,
     }
+    if manifest is not None:
+        data['manifest'] = manifest
     try:
-        with open(path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
+        get_cache_store().put_lesson(lesson_folder_id, data)
         #log_event(f"Cached lesson object for folder {lesson_folder_id}")
     except Exception as e:
         log_event(f"Lesson cache write error for {lesson_folder_id}: {str(e)}")
 
 
-def list_folder_contents(service, folder_id, use_cache=True, invalidated_ids=None):
+def _folder_signature(items):
     """
-    List all files and folders in a Google Drive folder.
-    When use_cache is True and folder_id is not in invalidated_ids, returns cached
-    listing if present (no API calls). Otherwise fetches from API and updates cache.
-    Invalidated folders are those known to have changed (from Drive Changes API).
+    [id, version, md5Checksum, name] of every item of a folder listing, in listing order. Shortcuts
+    have no version of their own in the listing (see _resolve_shortcuts), so the name is kept too.
+    """
+    return [[item['id'], item.get('version'), item.get('md5Checksum'), item['name']] for item in items]
 
-    Returns:
-        (items, cache_info): items is list of file/folder dicts; cache_info is
-        {"modified_time": str|None, "from_cache": bool}.
+
+def _known_listing(folder_id):
+    """Items of folder_id listed this run or cached, without API calls; None when neither has it."""
+    memoized = LISTING_MEMO.peek(folder_id, valid=_memo_fresh(folder_id))
+    if memoized is not None:
+        return memoized[0]
+    cache_data = _read_folder_cache(folder_id)
+    return cache_data.get('items') if cache_data else None
+
+
+def _lesson_manifest(lesson_folder_id, items):
     """
-    os.makedirs(CACHE_DIR, exist_ok=True)
-    cache_file = _folder_cache_path(folder_id)
-    cache_info = {"modified_time": None, "from_cache": False}
-    invalidated_ids = invalidated_ids or set()
+    {folder id: _folder_signature} of a lesson folder and every folder below it, read from the
+    listings the lesson was just built from. Drive bumps a file's version on every change (content,
+    rename, move) but not reliably its folders' modifiedTime, so these are what revalidation compares.
+    None when a listing is not available (the lesson is then rebuilt next time it looks changed).
+    """
+    manifest = {lesson_folder_id: _folder_signature(items)}
+    pending = [items]
+    while pending:
+        for item in pending.pop():
+            if item['mimeType'] != 'application/vnd.google-apps.folder' or item['id'] in manifest:
+                continue
+            child_items = _known_listing(item['id'])
+            if child_items is None:
+                return None
+            manifest[item['id']] = _folder_signature(child_items)
+            pending.append(child_items)
+    return manifest
 
-    # Use cache only when enabled, folder not invalidated, and cache file exists
-    if use_cache and folder_id not in invalidated_ids and os.path.exists(cache_file):
-        try:
-            with open(cache_file, 'r', encoding='utf-8') as f:
-                cache_data = json.load(f)
-            cache_info["modified_time"] = cache_data.get('modified_time')
-            cache_info["from_cache"] = True
-            return cache_data.get('items', []), cache_info
-        except HttpError as e:
-            if e.resp.status == 404:
-                if os.path.exists(cache_file):
-                    os.remove(cache_file)
-                raise
-            log_event(f"Cache check failed for {folder_id}: {e}, fetching fresh")
-        except Exception as e:
-            log_event(f"Cache read error for {folder_id}: {str(e)}, fetching fresh")
 
-    # Fetch full listing from API
+def _revalidate_lesson(service, lesson_folder_id, items, manifest, use_cache, invalidated_ids):
+    """
+    Compare a cached lesson's manifest with the current listings of its folders (level by level,
+    in batches; folders not invalidated come from the cache). Returns (changed, unchanged): the
+    folders whose signature differs (new folders included), and the folders with no change at or
+    below them, whose cached nodes can be spliced in even if their listing was fetched again.
+    """
+    listings = {lesson_folder_id: items}
+    parents = {}
+    level = [lesson_folder_id]
+    while level:
+        next_level = []
+        for folder_id in level:
+            for item in listings[folder_id]:
+                if item['mimeType'] != 'application/vnd.google-apps.folder':
+                    continue
+                parents.setdefault(item['id'], set()).add(folder_id)
+                if item['id'] not in listings and item['id'] not in next_level:
+                    next_level.append(item['id'])
+        prefetch_folder_listings(service, next_level, use_cache=use_cache, invalidated_ids=invalidated_ids)
+        for folder_id in next_level:
+            listings[folder_id], _ = list_folder_contents(service, folder_id, use_cache=use_cache, invalidated_ids=invalidated_ids)
+        level = next_level
+    changed = {folder_id for folder_id, folder_items in listings.items()
+               if _folder_signature(folder_items) != manifest.get(folder_id)}
+    # A change below a folder changes the folder's output too
+    dirty = set(changed)
+    pending = list(changed)
+    while pending:
+        for parent_id in parents.get(pending.pop(), ()):
+            if parent_id not in dirty:
+                dirty.add(parent_id)
+                pending.append(parent_id)
+    return changed, set(listings) - dirty
+
+
+def invalidate_lesson_obj(lesson_folder_id):
+    """
+    Make the cached lesson object of a folder fail the modified_time check, so it is revalidated
+    against its manifest before reuse (patch mode: the listings are patched in place and keep
+    their modifiedTime). Entries without a manifest are dropped.
+    """
+    store = get_cache_store()
+    data = get_cached_lesson_entry(lesson_folder_id)
+    if data is None:
+        return
+    if data.get('manifest'):
+        store.put_lesson(lesson_folder_id, dict(data, modified_time=None))
+    else:
+        store.delete_lesson(lesson_folder_id)
+
+
+def _listing_hash(items):
+    """Digest of a folder listing (every field of every item, so file edits change it too)."""
+    encoded = json.dumps(items, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(encoded.encode('utf-8')).hexdigest()
+
+
+def _node_hash(listing_hash, child_hashes):
+    """Merkle hash of a folder node: its own listing plus its child folder nodes, in order."""
+    digest = hashlib.sha1(listing_hash.encode('ascii'))
+    for child_hash in child_hashes:
+        digest.update(b'/' + (child_hash or '').encode('ascii'))
+    return digest.hexdigest()
+
+
+def _node_variant(ancestors):
+    """
+    Content folders are cached per ancestor path: the same (shared) folder crawled under
+    another lesson can skip different cycle shortcuts. Class roots, topics and lesson roots use ''.
+    """
+    if not ancestors:
+        return ''
+    return hashlib.sha1('\n'.join(sorted(ancestors)).encode('utf-8')).hexdigest()[:16]
+
+
+def _count_node(kind):
+    with _CACHE_STATS_LOCK:
+        NODE_CACHE_STATS[kind] += 1
+
+
+def _memo_fits(ancestors, variant):
+    """
+    Validator for CONTENT_MEMO entries of a folder crawled below ancestors. A subtree depends on its
+    ancestors only through the cycle shortcuts it skips: it can be reused when the folders it links
+    to ('refs') include the same ancestors as where it was built. Spliced nodes have no refs and
+    only fit their own variant.
+    """
+    def fits(entry):
+        if entry['refs'] is None:
+            return entry['variant'] == variant
+        return entry['refs'] & ancestors == entry['cut']
+    return fits
+
+
+def get_cached_node(folder_id, variant, listing_hash):
+    """
+    Return the cached node {"hash", "listing_hash", "output"} of a folder if it was built from
+    the same listing, else None.
+    Only called for folders whose listing came from the cache: a change anywhere below a folder
+    invalidates the folder itself (Changes API bubbling, or patch mode dropping its node), so
+    the node can be reused without reading any descendant.
+    """
+    try:
+        node = get_cache_store().get_node(folder_id, variant)
+    except Exception as e:
+        log_event(f"Node cache read error for {folder_id}: {str(e)}")
+        return None
+    if node is None or node.get('listing_hash') != listing_hash:
+        return None
+    _count_node('spliced')
+    return node
+
+
+def save_node_cache(folder_id, variant, listing_hash, child_hashes, output):
+    """Cache a rebuilt folder node and return its Merkle hash."""
+    _count_node('rebuilt')
+    node_hash = _node_hash(listing_hash, child_hashes)
+    _put_node(folder_id, variant, listing_hash, node_hash, output)
+    return node_hash
+
+
+def _put_node(folder_id, variant, listing_hash, node_hash, output):
+    data = {
+        'hash': node_hash,
+        'listing_hash': listing_hash,
+        'cached_at': datetime.now().isoformat(),
+        'output': output,
+    }
+    try:
+        get_cache_store().put_node(folder_id, variant, data)
+    except Exception as e:
+        log_event(f"Node cache write error for {folder_id}: {str(e)}")
+
+
+# Fields requested for every child in a folder listing
+# modifiedTime/md5Checksum/version/size describe each child, so a child folder's cache can be
+# validated from its parent's listing and unchanged files can be recognised without extra calls.
+LISTING_FILE_FIELDS = "id, name, mimeType, modifiedTime, md5Checksum, version, size, shortcutDetails"  # <-- Added shortcutDetails here
+# Per-item metadata that belongs to the listed file itself (dropped for shortcuts, see _resolve_shortcuts)
+ITEM_METADATA_FIELDS = ('modifiedTime', 'md5Checksum', 'version', 'size')
+LISTING_FIELDS = f"nextPageToken, files({LISTING_FILE_FIELDS})"
+# Whole-Drive snapshot (cold starts): one paged files().list over the account
+SNAPSHOT_FIELDS = f"nextPageToken, files({LISTING_FILE_FIELDS}, parents)"
+# Level-order (BFS) crawl: how many parent folders are OR-combined into one files().list query.
+# Keeps the query string well under the Drive URL length limit.
+MULTI_PARENT_QUERY_SIZE = 40
+# Keys of a listed file, in LISTING_FILE_FIELDS order (used to turn a Changes API file into a listing item)
+LISTING_FILE_KEYS = tuple(key.strip() for key in LISTING_FILE_FIELDS.split(','))
+
+
+def _folder_listing_request(service, folder_id, page_token=None):
+    """Build (without executing) the files().list request for a folder's children."""
     query = f"'{folder_id}' in parents and trashed = false"
-    results = service.files().list(
+    return service.files().list(
         q=query,
-        fields="files(id, name, mimeType, shortcutDetails)", # <-- Added shortcutDetails here
-        pageSize=1000
-    ).execute()
-    files = results.get('files', [])
+        fields=LISTING_FIELDS,
+        pageSize=1000,
+        pageToken=page_token
+    )
+
 
+def _list_all_pages(request_for_page, first_response=None):
+    """
+    Collect 'files' from a paginated files().list call, following nextPageToken.
+    request_for_page(page_token) builds the request for a page; first_response is an
+    already received first page (e.g. from a batch), if any.
+    """
+    files = []
+    response = first_response
+    if response is None:
+        response = request_for_page(None).execute()
+    while True:
+        files.extend(response.get('files', []))
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            return files
+        response = request_for_page(page_token).execute()
+
+
+def _folder_meta_request(service, folder_id):
+    """Build (without executing) the files().get request for a folder's modifiedTime."""
+    return service.files().get(
+        fileId=folder_id,
+        fields="modifiedTime"
+    )
+
+
+def _resolve_shortcuts(files):
+    """Resolve shortcuts to their targets and clean Windows shortcut extensions (in place)."""
     # --- SHORTCUT INTERCEPTOR BLOCK ---
-    # Resolve shortcuts to their targets and clean Windows shortcut extensions
     for f in files:
         if f.get('mimeType') == 'application/vnd.google-apps.shortcut':
             details = f.get('shortcutDetails')
@@ -584,6 +1057,10 @@ def list_folder_contents(service, folder_id, use_cache=True, invalidated_ids=Non
                 f['id'] = details.get('targetId', f['id'])
                 f['mimeType'] = details.get('targetMimeType', f['mimeType'])
                 # Notice we DO NOT change f['name']. It stays as the shortcut's name!
+
+                # modifiedTime/version/... are the shortcut's own, not the target's
+                for key in ITEM_METADATA_FIELDS:
+                    f.pop(key, None)
                 
             # Remove the .lnk extension (using strip() to handle weird Drive sync spaces)
             name_stripped = f.get('name', '').strip()
@@ -593,25 +1070,26 @@ def list_folder_contents(service, folder_id, use_cache=True, invalidated_ids=Non
             # Clean up the payload so the cache remains standard
             f.pop('shortcutDetails', None)
     # ----------------------------------------------
+    return files
 
-    # Get folder's modifiedTime for cache
-    try:
-        folder_meta = service.files().get(
-            fileId=folder_id,
-            fields="modifiedTime"
-        ).execute()
-        modified_time = folder_meta.get('modifiedTime')
-    except Exception as e:
-        log_event(f"Could not get modifiedTime for {folder_id}: {e}")
-        modified_time = None
 
-    cache_info["modified_time"] = modified_time
-
-    sorted_items = sorted(
+def _sorted_listing_items(files):
+    """Listing order: lesson number first (so 13.5 sorts after 13), then name."""
+    return sorted(
         files,
         key=lambda x: (extract_lesson_number(x['name']), x['name'])
     )
 
+
+def _store_folder_listing(folder_id, files, modified_time):
+    """Resolve shortcuts, sort and write a freshly fetched listing to the cache. Returns sorted items."""
+    _resolve_shortcuts(files)
+    # Fresh listing: remember what it says about each child folder (see _REPORTED_MODIFIED_TIMES)
+    for f in files:
+        if f.get('mimeType') == 'application/vnd.google-apps.folder' and f.get('modifiedTime'):
+            _REPORTED_MODIFIED_TIMES[f['id']] = f['modifiedTime']
+    sorted_items = _sorted_listing_items(files)
+
     cache_data = {
         "folder_id": folder_id,
         "modified_time": modified_time,
@@ -619,12 +1097,383 @@ def list_folder_contents(service, folder_id, use_cache=True, invalidated_ids=Non
         "items": sorted_items,
     }
     try:
-        with open(cache_file, 'w', encoding='utf-8') as f:
-            json.dump(cache_data, f, ensure_ascii=False, indent=2)
+        get_cache_store().put_listing(folder_id, cache_data)
         log_event(f"Cached listing for folder {folder_id}")
     except Exception as e:
         log_event(f"Cache write error for {folder_id}: {str(e)}")
 
+    return sorted_items
+
+
+def _listing_item(f):
+    """Copy of a file dict from a multi-folder query, shaped like a per-folder listing item."""
+    item = dict(f)
+    item.pop('parents', None)
+    return item
+
+
+def load_drive_snapshot(service):
+    """
+    Page once through every non-trashed file the account can see (pageSize 1000) and
+    index it by parent, so list_folder_contents can serve cold-start listings from memory.
+
+    Returns:
+        {'children': {parent_id: [file dicts]}, 'modified_times': {file_id: modifiedTime}}
+    """
+    files = _list_all_pages(lambda page_token: service.files().list(
+        q="trashed = false",
+        fields=SNAPSHOT_FIELDS,
+        pageSize=1000,
+        pageToken=page_token
+    ))
+    children = {}
+    modified_times = {}
+    for f in files:
+        modified_times[f['id']] = f.get('modifiedTime')
+        for parent_id in f.get('parents', []):
+            children.setdefault(parent_id, []).append(f)
+    log_event(f"Drive snapshot: {len(files)} files in {len(children)} folders")
+    return {'children': children, 'modified_times': modified_times}
+
+
+def _snapshot_listing(folder_id):
+    """Return (files, modified_time) for folder_id from DRIVE_SNAPSHOT, or None if not available."""
+    if DRIVE_SNAPSHOT is None or folder_id not in DRIVE_SNAPSHOT['modified_times']:
+        return None
+    files = [_listing_item(f) for f in DRIVE_SNAPSHOT['children'].get(folder_id, [])]
+    return files, DRIVE_SNAPSHOT['modified_times'][folder_id]
+
+
+def _read_folder_cache(folder_id):
+    """Return the cached listing data for folder_id, or None if missing or unreadable."""
+    try:
+        return get_cache_store().get_listing(folder_id)
+    except Exception as e:
+        log_event(f"Cache read error for {folder_id}: {str(e)}, fetching fresh")
+        return None
+
+
+def _is_stale(folder_id, cached_modified_time):
+    """True when a fresh parent listing reported a different modifiedTime than the cached one."""
+    reported = _REPORTED_MODIFIED_TIMES.get(folder_id)
+    return reported is not None and reported != cached_modified_time
+
+
+def _memo_fresh(folder_id):
+    """Validator for LISTING_MEMO entries: drop a listing a fresh parent listing reported changed since."""
+    return lambda entry: not _is_stale(folder_id, entry[1]['modified_time'])
+
+
+def _needs_fetch(folder_id, use_cache, invalidated_ids):
+    """True when list_folder_contents would have to call the API for folder_id."""
+    if LISTING_MEMO.peek(folder_id, valid=_memo_fresh(folder_id)) is not None:
+        return False
+    if use_cache and folder_id not in invalidated_ids and get_cache_store().has_listing(folder_id):
+        if folder_id not in _REPORTED_MODIFIED_TIMES:
+            return False
+        cache_data = _read_folder_cache(folder_id)
+        if cache_data is not None and not _is_stale(folder_id, cache_data.get('modified_time')):
+            return False
+    if DRIVE_SNAPSHOT is not None and folder_id in DRIVE_SNAPSHOT['modified_times']:
+        return False
+    with _PREFETCH_LOCK:
+        return folder_id not in _PREFETCHED_LISTINGS
+
+
+def prefetch_folder_listings(service, folder_ids, use_cache=True, invalidated_ids=None):
+    """
+    Fetch the listings (and modifiedTime) of all folders in folder_ids that would miss
+    the cache, coalesced into Drive batch requests. Results are written to the cache and
+    handed to the next list_folder_contents call for each folder.
+    No-op unless batching is enabled (DRIVE_BATCHER set by generate_data).
+    """
+    if DRIVE_BATCHER is None:
+        return
+    invalidated_ids = invalidated_ids or set()
+    missing = [
+        folder_id for folder_id in dict.fromkeys(folder_ids)
+        if _needs_fetch(folder_id, use_cache, invalidated_ids)
+    ]
+    if not missing:
+        return
+
+    requests = []
+    for folder_id in missing:
+        requests.append((f"list:{folder_id}", _folder_listing_request(service, folder_id)))
+        if folder_id not in _REPORTED_MODIFIED_TIMES:
+            requests.append((f"meta:{folder_id}", _folder_meta_request(service, folder_id)))
+    results = DRIVE_BATCHER.execute(requests)
+
+    for folder_id in missing:
+        listing, error = results.get(f"list:{folder_id}", (None, None))
+        if listing is None:
+            # list_folder_contents will fetch this folder on its own
+            log_event(f"Batched listing failed for {folder_id}: {error}")
+            continue
+        if folder_id in _REPORTED_MODIFIED_TIMES:
+            modified_time = _REPORTED_MODIFIED_TIMES[folder_id]
+        else:
+            meta, error = results.get(f"meta:{folder_id}", (None, None))
+            if error is not None and drive_scheduler.is_quota_error(error):
+                raise error
+            if meta is None:
+                log_event(f"Could not get modifiedTime for {folder_id}: {error}")
+            modified_time = (meta or {}).get('modifiedTime')
+        files = _list_all_pages(
+            lambda page_token, folder_id=folder_id: _folder_listing_request(service, folder_id, page_token),
+            first_response=listing
+        )
+        items = _store_folder_listing(folder_id, files, modified_time)
+        with _PREFETCH_LOCK:
+            _PREFETCHED_LISTINGS[folder_id] = (items, modified_time)
+
+
+def fetch_listings_by_parents(service, folder_ids):
+    """
+    List the children of many folders with OR-combined parent queries
+    ("'a' in parents or 'b' in parents ..."), MULTI_PARENT_QUERY_SIZE folders per query,
+    following nextPageToken. Results are split back per folder using each file's parents.
+
+    Returns:
+        {folder_id: [file dicts]}; file dicts also carry 'parents' and 'modifiedTime'.
+    """
+    listings = {folder_id: [] for folder_id in folder_ids}
+    fields = f"nextPageToken, files({LISTING_FILE_FIELDS}, parents)"
+    for start in range(0, len(folder_ids), MULTI_PARENT_QUERY_SIZE):
+        chunk = folder_ids[start:start + MULTI_PARENT_QUERY_SIZE]
+        parents_query = ' or '.join(f"'{folder_id}' in parents" for folder_id in chunk)
+        query = f"({parents_query}) and trashed = false"
+        files = _list_all_pages(lambda page_token: service.files().list(
+            q=query,
+            fields=fields,
+            pageSize=1000,
+            pageToken=page_token
+        ))
+        for f in files:
+            for parent_id in f.get('parents', []):
+                if parent_id in listings:
+                    # Copy per parent: shortcut resolution edits items in place
+                    listings[parent_id].append(dict(f))
+    return listings
+
+
+def _fetch_modified_times(service, folder_ids):
+    """Return {folder_id: modifiedTime or None}, batched when DRIVE_BATCHER is set."""
+    requests = [(folder_id, _folder_meta_request(service, folder_id)) for folder_id in folder_ids]
+    if DRIVE_BATCHER is not None:
+        results = DRIVE_BATCHER.execute(requests)
+    else:
+        results = {}
+        for key, request in requests:
+            try:
+                results[key] = (request.execute(), None)
+            except Exception as e:
+                results[key] = (None, e)
+    modified_times = {}
+    for folder_id in folder_ids:
+        meta, error = results[folder_id]
+        if error is not None and drive_scheduler.is_quota_error(error):
+            raise error
+        if meta is None:
+            log_event(f"Could not get modifiedTime for {folder_id}: {error}")
+        modified_times[folder_id] = (meta or {}).get('modifiedTime')
+    return modified_times
+
+
+def prefetch_class_tree(service, root_id, use_cache=True, invalidated_ids=None):
+    """
+    Level-order (BFS) crawl of a class folder tree. At each depth, all folders that would
+    miss the cache are listed together with fetch_listings_by_parents, written to their
+    per-folder cache files and handed to list_folder_contents (see prefetch_folder_listings).
+    A folder's modifiedTime is taken from its parent's listing (_REPORTED_MODIFIED_TIMES),
+    so only the root and shortcut targets need a files().get.
+    Cached folders that are not invalidated are not expanded: Changes API invalidations
+    bubble up to the class root, so nothing below them changed (anything missing from the
+    cache is still fetched on demand by list_folder_contents).
+
+    Returns:
+        (folders_listed, list_queries)
+    """
+    invalidated_ids = invalidated_ids or set()
+    seen = {root_id}
+    frontier = [root_id]
+    folders_listed = 0
+    list_queries = 0
+    depth = 0
+    while frontier:
+        to_fetch = [folder_id for folder_id in frontier if _needs_fetch(folder_id, use_cache, invalidated_ids)]
+        if not to_fetch:
+            break
+        with drive_metrics.scope(level=drive_metrics.LEVELS[min(depth + 1, len(drive_metrics.LEVELS) - 1)]):
+            listings = fetch_listings_by_parents(service, to_fetch)
+            modified_times = _fetch_modified_times(
+                service, [folder_id for folder_id in to_fetch if folder_id not in _REPORTED_MODIFIED_TIMES]
+            )
+        folders_listed += len(to_fetch)
+        list_queries += -(-len(to_fetch) // MULTI_PARENT_QUERY_SIZE)
+        depth += 1
+
+        next_frontier = []
+        for folder_id in to_fetch:
+            # Keep cached items identical to a per-folder listing
+            files = [_listing_item(f) for f in listings[folder_id]]
+            modified_time = _REPORTED_MODIFIED_TIMES.get(folder_id, modified_times.get(folder_id))
+            items = _store_folder_listing(folder_id, files, modified_time)
+            with _PREFETCH_LOCK:
+                _PREFETCHED_LISTINGS[folder_id] = (items, modified_time)
+            for item in items:
+                if item['mimeType'] == 'application/vnd.google-apps.folder' and item['id'] not in seen:
+                    seen.add(item['id'])
+                    next_frontier.append(item['id'])
+        frontier = next_frontier
+    return folders_listed, list_queries
+
+
+def _is_listing_entry_for(item, file_id):
+    """True if the cached listing item is file_id itself (a shortcut's own id, or a plain file/folder)."""
+    if item.get('shortcutId'):
+        return item['shortcutId'] == file_id
+    return item.get('id') == file_id
+
+
+def apply_changes_to_cache(changes_list):
+    """
+    Patch mode: apply Changes API events to the cached folder listings in place,
+    instead of invalidating the folders and listing them again.
+    Adds, renames, edits, moves, trashes and removals are applied to every cached listing
+    that lists the file now (via the cache's child -> parent index) or should list it
+    (the event's parents). Shortcuts are resolved as in a fresh listing.
+    Events that do not carry enough data to place the file (no file resource, no parents,
+    a shortcut without shortcutDetails) are not patched: the folders concerned are returned
+    to be listed again.
+
+    Returns:
+        set of folder ids whose listing must be refetched.
+    """
+    store = get_cache_store()
+    refetch_ids = set()
+    patched = set()
+    for change in changes_list:
+        file_id = change.get('fileId')
+        if not file_id:
+            continue
+        file_obj = change.get('file') or {}
+        current_parents = store.parents_of(file_id)
+        if change.get('removed') or file_obj.get('trashed'):
+            new_item, new_parents = None, set()
+        else:
+            if 'parents' not in file_obj or 'name' not in file_obj or 'mimeType' not in file_obj:
+                refetch_ids.update(current_parents)
+                continue
+            new_item = {key: file_obj[key] for key in file_obj if key in LISTING_FILE_KEYS}
+            _resolve_shortcuts([new_item])
+            new_parents = set(file_obj['parents'])
+            if new_item['mimeType'] == 'application/vnd.google-apps.shortcut':
+                # Target unknown without shortcutDetails
+                refetch_ids.update(current_parents | new_parents)
+                continue
+
+        for folder_id in current_parents | new_parents:
+            cache_data = _read_folder_cache(folder_id)
+            if cache_data is None:
+                # Not cached: listed fresh if the crawl reaches it
+                continue
+            items = [item for item in cache_data.get('items') or [] if not _is_listing_entry_for(item, file_id)]
+            if folder_id in new_parents:
+                items.append(dict(new_item))
+            items = _sorted_listing_items(items)
+            if items != cache_data.get('items'):
+                cache_data['items'] = items
+                cache_data['cached_at'] = datetime.now().isoformat()
+                store.put_listing(folder_id, cache_data)
+                patched.add(folder_id)
+
+        # A changed folder's own cached listing takes its new modifiedTime (keeps parent-reported validation consistent)
+        if (new_item is not None and new_item['mimeType'] == 'application/vnd.google-apps.folder'
+                and not new_item.get('shortcutId') and new_item.get('modifiedTime')):
+            cache_data = _read_folder_cache(file_id)
+            if cache_data is not None and cache_data.get('modified_time') != new_item['modifiedTime']:
+                cache_data['modified_time'] = new_item['modifiedTime']
+                store.put_listing(file_id, cache_data)
+                patched.add(file_id)
+
+    log_event(f"Patched {len(patched)} cached listings from {len(changes_list)} changes; "
+              f"{len(refetch_ids)} folders need a refetch")
+    return refetch_ids
+
+
+def list_folder_contents(service, folder_id, use_cache=True, invalidated_ids=None):
+    """
+    List all files and folders in a Google Drive folder.
+    When use_cache is True and folder_id is not in invalidated_ids, returns cached
+    listing if present (no API calls). Otherwise fetches from API and updates cache.
+    Invalidated folders are those known to have changed (from Drive Changes API).
+    Listings already fetched by prefetch_folder_listings are returned without API calls.
+    A folder listed earlier in the run (a shortcut target linked from several places) is
+    returned from LISTING_MEMO as it was first listed.
+
+    Returns:
+        (items, cache_info): items is list of file/folder dicts; cache_info is
+        {"modified_time": str|None, "from_cache": bool}.
+    """
+    items, cache_info = _list_folder_contents(service, folder_id, use_cache, invalidated_ids)
+    LISTING_MEMO.put(folder_id, (items, cache_info))
+    return items, dict(cache_info)
+
+
+def _list_folder_contents(service, folder_id, use_cache, invalidated_ids):
+    cache_info = {"modified_time": None, "from_cache": False}
+    invalidated_ids = invalidated_ids or set()
+
+    # Fresh listing fetched ahead of time in a batch
+    with _PREFETCH_LOCK:
+        prefetched = _PREFETCHED_LISTINGS.pop(folder_id, None)
+    if prefetched is not None:
+        drive_metrics.count_cache('folder_listings', 'prefetched')
+        items, cache_info["modified_time"] = prefetched
+        return items, cache_info
+
+    memoized = LISTING_MEMO.get(folder_id, valid=_memo_fresh(folder_id))
+    if memoized is not None:
+        drive_metrics.count_cache('folder_listings', 'memo')
+        return memoized
+
+    # Use cache only when enabled, folder not invalidated, and cache file exists.
+    # A fresh parent listing that reports a different modifiedTime also makes it stale.
+    if use_cache and folder_id not in invalidated_ids and get_cache_store().has_listing(folder_id):
+        cache_data = _read_folder_cache(folder_id)
+        if cache_data is not None:
+            if not _is_stale(folder_id, cache_data.get('modified_time')):
+                cache_info["modified_time"] = cache_data.get('modified_time')
+                cache_info["from_cache"] = True
+                drive_metrics.count_cache('folder_listings', 'cache')
+                return cache_data.get('items', []), cache_info
+            log_event(f"Cached listing for {folder_id} is older than its parent reports, fetching fresh")
+
+    snapshot_listing = _snapshot_listing(folder_id)
+    if snapshot_listing is not None:
+        # Cold start: served from the whole-Drive snapshot, no API calls
+        drive_metrics.count_cache('folder_listings', 'snapshot')
+        files, modified_time = snapshot_listing
+    else:
+        drive_metrics.count_cache('folder_listings', 'fetched')
+        # Fetch full listing from API (all pages, folders over 1000 items are not truncated)
+        files = _list_all_pages(lambda page_token: _folder_listing_request(service, folder_id, page_token))
+
+        # Get folder's modifiedTime for cache (already known when the parent listing was fresh)
+        modified_time = _REPORTED_MODIFIED_TIMES.get(folder_id)
+        if modified_time is None:
+            try:
+                folder_meta = _folder_meta_request(service, folder_id).execute()
+                modified_time = folder_meta.get('modifiedTime')
+            except Exception as e:
+                if drive_scheduler.is_quota_error(e):
+                    raise
+                log_event(f"Could not get modifiedTime for {folder_id}: {e}")
+                modified_time = None
+
+    cache_info["modified_time"] = modified_time
+    sorted_items = _store_folder_listing(folder_id, files, modified_time)
     return sorted_items, cache_info
 
 
@@ -636,40 +1485,8 @@ def list_folder_contents(service, folder_id, use_cache=True, invalidated_ids=Non
 #    files = results.get('files', [])
 #    return natsorted(files, key=lambda x: x['name'])
 
-def crawl_lesson_content(service, folder_id, use_cache=True, invalidated_ids=None):
-    """Recursively crawl the contents of a lesson folder."""
-    invalidated_ids = invalidated_ids or set()
-    items, _ = list_folder_contents(service, folder_id, use_cache=use_cache, invalidated_ids=invalidated_ids)
-    content = []
-    
-    for item in items:
-        if item['mimeType'] == 'application/vnd.google-apps.folder':
-            content.append({
-                'type': 'folder',
-                'name': item['name'],
-                'content': crawl_lesson_content(service, item['id'], use_cache=use_cache, invalidated_ids=invalidated_ids),
-                'file_extension': ''  # Account for folders to prevent KeyErrors
-            })
-        else:
-            # Check if the file should be ignored
-            filename = item['name'].lower()
-            if filename in [ignored.lower() for ignored in IGNORED_FILENAMES]:
-                continue  # Skip this file
-
-            # Extract base name and extension to power the cleanup feature
-            base_name, ext = os.path.splitext(item['name'])
-            ext = ext.lower()
-
-            # Use configurable extension removal for display name; keep original name for download
-            name = display_name_from_filename(item['name'])
-            content.append({
-                'type': 'file',
-                'name': name,
-                'url': f'https://drive.google.com/file/d/{item["id"]}/view',
-                'base_name': base_name,
-                'file_extension': ext
-            })
-            
+def _drop_duplicate_docs(content):
+    """Remove Word documents that have a PDF with the same base name in the same folder level."""
     # --- Duplicate Cleanup Feature ---
     # 1. Find all base names of PDF files in the current folder level
     pdf_bases = {
@@ -698,64 +1515,313 @@ def crawl_lesson_content(service, folder_id, use_cache=True, invalidated_ids=Non
             
     return filtered_content
 
-def crawl_class(service, class_name, folder_id, banner_url, url_name, category, class_id, invalidated_ids=None, use_cache=True):
-    """Crawl all topics and lessons for a class."""
+def crawl_lesson_content(service, folder_id, use_cache=True, invalidated_ids=None, items=None):
+    """
+    Crawl the contents of a lesson folder, level by level with an explicit frontier
+    (no recursion). All subfolders at the same depth are prefetched together.
+    items: the folder's own listing, when the caller already has it.
+    """
+    content, _ = _crawl_content_tree(service, folder_id, use_cache=use_cache, invalidated_ids=invalidated_ids, items=items)
+    return content
+
+
+def _crawl_content_tree(service, folder_id, use_cache=True, invalidated_ids=None, items=None, items_from_cache=False,
+                        unchanged_ids=()):
+    """
+    crawl_lesson_content with the node cache: a folder whose listing came from the cache and
+    has a cached node for the same listing is spliced in whole, without visiting its subfolders.
+    Rebuilt folders are cached bottom-up once the whole tree is crawled. Subtrees built or spliced
+    earlier in the run are taken from CONTENT_MEMO whatever the listing's source.
+    items_from_cache: whether items (the root listing) was served from the cache.
+    unchanged_ids: folders known to have no change at or below them (see _revalidate_lesson); their
+    cached nodes are spliced in even when their listing was fetched again.
+    Returns (content, Merkle hash of the root folder).
+    """
     invalidated_ids = invalidated_ids or set()
-    # Get root folder contents once
-    root_folder_items, _ = list_folder_contents(service, folder_id, use_cache=use_cache, invalidated_ids=invalidated_ids)
-    
-    # Read assignments.md file first, using root folder items to avoid redundant query
-    assignments_content, assignments_file_id = read_assignments_file(service, folder_id, root_folder_items)
-    
-    topics = []
-    topic_folders = [f for f in root_folder_items if f['mimeType'] == 'application/vnd.google-apps.folder']
-    for topic_index, topic in enumerate(topic_folders, 1):
-        topic_obj = {
-            'name': topic['name'],
-            'id': topic['name'].replace(' ', '-').replace('.', '').replace('/', '-').lower(),
-            'lessons': []
-        }
-        # Get topic folder contents once
-        topic_folder_items, _ = list_folder_contents(service, topic['id'], use_cache=use_cache, invalidated_ids=invalidated_ids)
-        lesson_folders = [f for f in topic_folder_items if f['mimeType'] == 'application/vnd.google-apps.folder']
-        for lesson_index, lesson in enumerate(lesson_folders, 1):
-            # Get lesson folder contents once
-            lesson_folder_items, lesson_cache_info = list_folder_contents(service, lesson['id'], use_cache=use_cache, invalidated_ids=invalidated_ids)
-            
-            # If folder unchanged, try to use cached full lesson object (skip README, lesson.json, crawl)
-            if lesson_cache_info.get("from_cache") and lesson_cache_info.get("modified_time"):
-                cached_lesson = get_cached_lesson_obj(lesson['id'], lesson_cache_info["modified_time"])
-                if cached_lesson is not None:
-                    lesson_obj = {
-                        'name': cached_lesson['name'],
-                        'desc': cached_lesson['desc'],
-                        'id': f"{topic_index}-{lesson_index}",
-                        'content': cached_lesson['content'],
-                        'lesson_json': cached_lesson['lesson_json'],
-                    }
-                    topic_obj['lessons'].append(lesson_obj)
+    root = {'holder': {'content': []}, 'children': [], 'hash': None}
+    rebuilt = []
+    # Frontier entries: (folder_id, node whose holder 'content' gets filled, ancestor folder ids)
+    frontier = [(folder_id, root, frozenset())]
+    while frontier:
+        # Fetch all folders of this level that miss the cache in one batch
+        prefetch_folder_listings(
+            service,
+            [entry_folder_id for entry_folder_id, _, _ in frontier if not (entry_folder_id == folder_id and items is not None)],
+            use_cache=use_cache, invalidated_ids=invalidated_ids
+        )
+        next_frontier = []
+        for current_id, node, ancestors in frontier:
+            if current_id == folder_id and items is not None:
+                current_items, from_cache = items, items_from_cache
+            else:
+                current_items, cache_info = list_folder_contents(service, current_id, use_cache=use_cache, invalidated_ids=invalidated_ids)
+                from_cache = cache_info.get('from_cache')
+            node['id'] = current_id
+            node['variant'] = _node_variant(ancestors)
+            node['listing_hash'] = _listing_hash(current_items)
+            memo_key = (current_id, node['listing_hash'])
+            memoized = CONTENT_MEMO.get(memo_key, valid=_memo_fits(ancestors, node['variant']))
+            if memoized is not None:
+                # Subtree already built this run (a folder shortcut into several lessons)
+                node['holder']['content'], node['hash'], node['refs'] = memoized['content'], memoized['hash'], memoized['refs']
+                if use_cache and memoized['variant'] != node['variant']:
+                    _put_node(current_id, node['variant'], node['listing_hash'], node['hash'], node['holder']['content'])
+                continue
+            if use_cache and (from_cache or current_id in unchanged_ids):
+                cached_node = get_cached_node(current_id, node['variant'], node['listing_hash'])
+                if cached_node is not None:
+                    node['holder']['content'] = cached_node['output']
+                    node['hash'] = cached_node['hash']
+                    node['refs'] = None
+                    CONTENT_MEMO.put(memo_key, {'content': node['holder']['content'], 'hash': node['hash'],
+                                                'variant': node['variant'], 'refs': None, 'cut': None})
                     continue
-            
-            # Build lesson object (folder changed or no cache)
-            lesson_description = read_readme_file(service, lesson['id'], lesson_folder_items)
-            lesson_meta = read_lesson_json(service, lesson['id'], lesson_folder_items)
-            if 'due_date' in lesson_meta:
-                display = _format_due_date(lesson_meta.get('due_date', ''))
-                if display:
-                    lesson_meta['due_date_display'] = display
-            
+            rebuilt.append(node)
+            node['ancestors'] = ancestors
+            path = ancestors | {current_id}
+            node['refs'] = set()
+            content = []
+            for item in current_items:
+                if item['mimeType'] == 'application/vnd.google-apps.folder':
+                    node['refs'].add(item['id'])
+                    if item['id'] in path:
+                        # Shortcut back to an enclosing folder; following it would never end
+                        log_event(f"Skipping folder cycle through {item['id']} in {current_id}")
+                        continue
+                    folder_entry = {
+                        'type': 'folder',
+                        'name': item['name'],
+                        'content': [],  # filled when the next level is crawled
+                        'file_extension': ''  # Account for folders to prevent KeyErrors
+                    }
+                    content.append(folder_entry)
+                    child = {'holder': folder_entry, 'children': [], 'hash': None}
+                    node['children'].append(child)
+                    next_frontier.append((item['id'], child, path))
+                else:
+                    # Check if the file should be ignored
+                    filename = item['name'].lower()
+                    if filename in [ignored.lower() for ignored in IGNORED_FILENAMES]:
+                        continue  # Skip this file
+
+                    # Extract base name and extension to power the cleanup feature
+                    base_name, ext = os.path.splitext(item['name'])
+                    ext = ext.lower()
+
+                    # Use configurable extension removal for display name; keep original name for download
+                    name = display_name_from_filename(item['name'])
+                    content.append({
+                        'type': 'file',
+                        'name': name,
+                        'url': f'https://drive.google.com/file/d/{item["id"]}/view',
+                        'base_name': base_name,
+                        'file_extension': ext
+                    })
+            node['holder']['content'] = _drop_duplicate_docs(content)
+        frontier = next_frontier
+
+    # Deepest folders first, so every child's hash is known before its parent's
+    for node in reversed(rebuilt):
+        child_hashes = [child['hash'] for child in node['children']]
+        if use_cache:
+            node['hash'] = save_node_cache(node['id'], node['variant'], node['listing_hash'], child_hashes, node['holder']['content'])
+        else:
+            node['hash'] = _node_hash(node['listing_hash'], child_hashes)
+        refs = node['refs']
+        for child in node['children']:
+            refs = None if refs is None or child['refs'] is None else refs | child['refs']
+        node['refs'] = refs
+        CONTENT_MEMO.put((node['id'], node['listing_hash']), {
+            'content': node['holder']['content'], 'hash': node['hash'], 'variant': node['variant'],
+            'refs': refs, 'cut': None if refs is None else refs & node['ancestors'],
+        })
+    return root['holder']['content'], root['hash']
+
+def build_lesson(service, lesson, lesson_id, use_cache=True, invalidated_ids=None):
+    """
+    Build the lesson object for one lesson folder (README, lesson.json and content).
+    Reuses the cached lesson object when the lesson folder is unchanged. When it looks changed
+    (listing fetched again, or another modifiedTime), the cached object is revalidated against its
+    manifest first: it is reused if no file or folder in the lesson changed, otherwise README and
+    lesson.json are only read again if the lesson folder itself changed, and only the content
+    folders at or above a change are rebuilt.
+    Returns (lesson object, Merkle hash of the lesson folder node).
+    """
+    invalidated_ids = invalidated_ids or set()
+    # Get lesson folder contents once
+    lesson_folder_items, lesson_cache_info = list_folder_contents(service, lesson['id'], use_cache=use_cache, invalidated_ids=invalidated_ids)
+    modified_time = lesson_cache_info.get("modified_time")
+    cached = get_cached_lesson_entry(lesson['id']) if use_cache else None
+    cached_lesson = cached.get('lesson_obj') if cached is not None else None
+
+    # If folder unchanged, use cached full lesson object (skip README, lesson.json, crawl)
+    if cached_lesson is not None and lesson_cache_info.get("from_cache") and modified_time \
+            and cached.get('modified_time') == modified_time:
+        drive_metrics.count_cache('lesson_objects', 'hits')
+        lesson_hash = cached_lesson.get('node_hash') or _node_hash(_listing_hash(lesson_folder_items), [])
+        return {
+            'name': cached_lesson['name'],
+            'desc': cached_lesson['desc'],
+            'id': lesson_id,
+            'content': cached_lesson['content'],
+            'lesson_json': cached_lesson['lesson_json'],
+        }, lesson_hash
+
+    unchanged = set()
+    reuse_meta = False
+    if cached_lesson is not None and cached.get('manifest'):
+        changed, unchanged = _revalidate_lesson(
+            service, lesson['id'], lesson_folder_items, cached['manifest'], use_cache, invalidated_ids
+        )
+        if not changed:
+            drive_metrics.count_cache('lesson_objects', 'revalidated')
             lesson_obj = {
                 'name': lesson['name'],
-                'desc': lesson_description,
-                'id': f"{topic_index}-{lesson_index}",
-                'content': crawl_lesson_content(service, lesson['id'], use_cache=use_cache, invalidated_ids=invalidated_ids),
-                'lesson_json': lesson_meta
+                'desc': cached_lesson['desc'],
+                'id': lesson_id,
+                'content': cached_lesson['content'],
+                'lesson_json': cached_lesson['lesson_json'],
             }
-            topic_obj['lessons'].append(lesson_obj)
-            # Cache for next run when folder is unchanged
-            if lesson_cache_info.get("modified_time"):
-                save_lesson_obj_cache(lesson['id'], lesson_cache_info["modified_time"], lesson_obj)
-        topics.append(topic_obj)
+            lesson_hash = cached_lesson.get('node_hash') or _node_hash(_listing_hash(lesson_folder_items), [])
+            if modified_time:
+                save_lesson_obj_cache(lesson['id'], modified_time, lesson_obj, node_hash=lesson_hash, manifest=cached['manifest'])
+            return lesson_obj, lesson_hash
+        drive_metrics.count_cache('lesson_objects', 'partial')
+        reuse_meta = lesson['id'] not in changed
+    elif use_cache:
+        drive_metrics.count_cache('lesson_objects', 'misses')
+
+    # Build lesson object (folder changed or no cache)
+    if reuse_meta:
+        lesson_description, lesson_meta = cached_lesson['desc'], cached_lesson['lesson_json']
+    else:
+        lesson_description = read_readme_file(service, lesson['id'], lesson_folder_items)
+        lesson_meta = read_lesson_json(service, lesson['id'], lesson_folder_items)
+        if 'due_date' in lesson_meta:
+            display = _format_due_date(lesson_meta.get('due_date', ''))
+            if display:
+                lesson_meta['due_date_display'] = display
+
+    with drive_metrics.scope(level='content'):
+        content, lesson_hash = _crawl_content_tree(
+            service, lesson['id'], use_cache=use_cache, invalidated_ids=invalidated_ids,
+            items=lesson_folder_items, items_from_cache=lesson_cache_info.get("from_cache"), unchanged_ids=unchanged
+        )
+    lesson_obj = {
+        'name': lesson['name'],
+        'desc': lesson_description,
+        'id': lesson_id,
+        'content': content,
+        'lesson_json': lesson_meta
+    }
+    # Cache for next run when folder is unchanged
+    if modified_time:
+        manifest = _lesson_manifest(lesson['id'], lesson_folder_items) if use_cache else None
+        save_lesson_obj_cache(lesson['id'], modified_time, lesson_obj, node_hash=lesson_hash, manifest=manifest)
+    return lesson_obj, lesson_hash
+
+def _crawl_topics(service, folder_id, root_folder_items, root_listing_hash, use_cache, invalidated_ids, executor):
+    """
+    Build the topics of a class from its root listing and cache the class node.
+    Topics whose listing came from the cache and match their cached node are spliced in
+    (lesson ids renumbered for the topic's position); only the other topics' lessons are built.
+    """
+    topic_folders = [f for f in root_folder_items if f['mimeType'] == 'application/vnd.google-apps.folder']
+    with drive_metrics.scope(level='topic'):
+        prefetch_folder_listings(service, [t['id'] for t in topic_folders], use_cache=use_cache, invalidated_ids=invalidated_ids)
+        # Get topic folder contents once
+        topic_listings = _map_ordered(
+            executor,
+            lambda topic: list_folder_contents(service, topic['id'], use_cache=use_cache, invalidated_ids=invalidated_ids),
+            topic_folders
+        )
+
+    # Flatten the lessons of all rebuilt topics so the pool stays busy across topic boundaries.
+    # Nested content folders are crawled inside each lesson's task (no nested submits,
+    # so a bounded pool can never deadlock waiting on itself).
+    topic_nodes = []
+    lesson_jobs = []
+    for topic_index, (topic, (topic_folder_items, topic_cache_info)) in enumerate(zip(topic_folders, topic_listings), 1):
+        listing_hash = _listing_hash(topic_folder_items)
+        cached_topic = None
+        if use_cache and topic_cache_info.get('from_cache'):
+            cached_topic = get_cached_node(topic['id'], '', listing_hash)
+        topic_nodes.append((listing_hash, cached_topic))
+        if cached_topic is not None:
+            continue
+        lesson_folders = [f for f in topic_folder_items if f['mimeType'] == 'application/vnd.google-apps.folder']
+        for lesson_index, lesson in enumerate(lesson_folders, 1):
+            lesson_jobs.append((topic_index, lesson, f"{topic_index}-{lesson_index}"))
+    with drive_metrics.scope(level='lesson'):
+        prefetch_folder_listings(service, [job[1]['id'] for job in lesson_jobs], use_cache=use_cache, invalidated_ids=invalidated_ids)
+        lesson_results = _map_ordered(
+            executor,
+            lambda job: build_lesson(service, job[1], job[2], use_cache=use_cache, invalidated_ids=invalidated_ids),
+            lesson_jobs
+        )
+
+    topics = []
+    topic_hashes = []
+    for topic_index, (topic, (listing_hash, cached_topic)) in enumerate(zip(topic_folders, topic_nodes), 1):
+        if cached_topic is not None:
+            lessons = cached_topic['output']['lessons']
+            # Lesson ids are positional ("topic-lesson"), the topic may have moved
+            for lesson_index, lesson_obj in enumerate(lessons, 1):
+                lesson_obj['id'] = f"{topic_index}-{lesson_index}"
+            topic_hash = cached_topic['hash']
+        else:
+            results = [result for job, result in zip(lesson_jobs, lesson_results) if job[0] == topic_index]
+            lessons = [lesson_obj for lesson_obj, _ in results]
+            lesson_hashes = [lesson_hash for _, lesson_hash in results]
+            if use_cache:
+                topic_hash = save_node_cache(topic['id'], '', listing_hash, lesson_hashes, {'lessons': lessons})
+            else:
+                topic_hash = _node_hash(listing_hash, lesson_hashes)
+        topics.append({
+            'name': topic['name'],
+            'id': topic['name'].replace(' ', '-').replace('.', '').replace('/', '-').lower(),
+            'lessons': lessons
+        })
+        topic_hashes.append(topic_hash)
+    if use_cache:
+        save_node_cache(folder_id, '', root_listing_hash, topic_hashes, topics)
+    return topics
+
+def crawl_class(service, class_name, folder_id, banner_url, url_name, category, class_id, invalidated_ids=None, use_cache=True, executor=None, bfs=False):
+    """
+    Crawl all topics and lessons for a class.
+    When executor (a thread pool) is given, topic listings and whole lessons are
+    built concurrently; results are collected in folder order, so the output is
+    identical to the sequential crawl.
+    When bfs is True, the folder tree is first listed level by level with
+    multi-parent queries (prefetch_class_tree); the crawl then reads those listings.
+    An unchanged class, topic or content folder is taken from the node cache without
+    visiting the folders below it (see get_cached_node).
+    """
+    invalidated_ids = invalidated_ids or set()
+    if bfs:
+        folders_listed, list_queries = prefetch_class_tree(service, folder_id, use_cache=use_cache, invalidated_ids=invalidated_ids)
+        log_event(f'BFS crawl of {url_name}: listed {folders_listed} folders in {list_queries} queries')
+    # Get root folder contents once
+    root_folder_items, root_cache_info = list_folder_contents(service, folder_id, use_cache=use_cache, invalidated_ids=invalidated_ids)
+    
+    # Read assignments.md file first, using root folder items to avoid redundant query
+    if executor is None:
+        assignments_content, assignments_file_id = read_assignments_file(service, folder_id, root_folder_items)
+    else:
+        assignments_future = drive_metrics.submit(executor, read_assignments_file, service, folder_id, root_folder_items)
+    
+    root_listing_hash = _listing_hash(root_folder_items)
+    cached_class = None
+    if use_cache and root_cache_info.get('from_cache'):
+        cached_class = get_cached_node(folder_id, '', root_listing_hash)
+    if cached_class is not None:
+        # Nothing changed anywhere in the class tree
+        topics = cached_class['output']
+    else:
+        topics = _crawl_topics(service, folder_id, root_folder_items, root_listing_hash, use_cache, invalidated_ids, executor)
+    if executor is not None:
+        assignments_content, assignments_file_id = assignments_future.result()
     tags = [t['name'] for t in topics]
     return {
         'id': class_id,  # Use the hardcoded id from class_info
@@ -770,16 +1836,233 @@ def crawl_class(service, class_name, folder_id, banner_url, url_name, category,
         'category': category
     }
 
-def generate_data(use_cache=True):
+def _class_priority(cls):
+    """Crawl order of a class entry: its category's index in CLASS_CATEGORY_PRIORITY."""
+    category = cls.get('category', 'past')
+    if category in CLASS_CATEGORY_PRIORITY:
+        return CLASS_CATEGORY_PRIORITY.index(category)
+    return len(CLASS_CATEGORY_PRIORITY)
+
+
+def _read_text(path):
+    """Content of a text file, or None when it cannot be read."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _class_json_current(cls, out_path):
+    """Whether out_path exists and was written for this class_info entry as it is now."""
+    text = _read_text(out_path)
+    if text is None:
+        return False
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return False
+    expected = {'id': cls['id'], 'name': cls['name'], 'url_name': cls['url_name'],
+                'banner_url': cls.get('banner_url', ''), 'category': cls.get('category', 'past')}
+    return all(data.get(key) == value for key, value in expected.items())
+
+
+def _keep_last_class_json(url_name, out_path, reason):
+    """Report a class that could not be crawled; its JSON file from the last good run is left as is."""
+    if os.path.exists(out_path):
+        msg = f'Could not crawl {url_name} ({reason}); keeping last good {out_path}'
+    else:
+        msg = f'Could not crawl {url_name} ({reason}); no previous {out_path} to fall back to'
+    log_event(msg)
+    print(msg)
+
+
+def _crawl_one_class(service, cls, invalidated_ids, use_cache, executor, bfs):
+    """crawl_class for a class_info entry, its Drive calls attributed to the class and prioritized by its category."""
+    log_event(f"Crawling url_name: {cls['url_name']} (folder_url: {cls['google_drive_url']})")
+    with drive_metrics.scope(cls['url_name'], 'class'), drive_scheduler.priority(_class_priority(cls)):
+        return crawl_class(
+            service, cls['name'], extract_folder_id(cls['google_drive_url']), cls.get('banner_url', ''),
+            cls['url_name'], cls.get('category', 'past'), cls['id'],
+            invalidated_ids=invalidated_ids, use_cache=use_cache, executor=executor, bfs=bfs
+        )
+
+
+def _crawl_classes_serially(service, classes, invalidated_ids, use_cache, executor, bfs):
+    """Yield (cls, class_json or None, error) for each class, crawled in this process one after the other."""
+    for cls in classes:
+        if service.exhausted and _class_priority(cls) > 0:
+            yield cls, None, 'Drive quota exhausted'
+            continue
+        try:
+            class_json = _crawl_one_class(service, cls, invalidated_ids, use_cache, executor, bfs)
+        except drive_scheduler.DRIVE_ERRORS as e:
+            yield cls, None, e
+            continue
+        yield cls, class_json, None
+
+
+def _init_class_worker(settings, quota, log_queue):
+    """Set up a crawl worker process: log to the main process, journal parent index updates, build the Drive client."""
+    global _WORKER, LESSON_SCHEMA, DRIVE_SNAPSHOT, BLOB_CACHE_ENABLED
+    log_to_queue(log_queue)
+    LESSON_SCHEMA = settings['schema']
+    DRIVE_SNAPSHOT = settings['snapshot']
+    BLOB_CACHE_ENABLED = settings['use_cache']
+    set_cache_backend(settings['cache_backend'])
+    get_cache_store().defer_index_updates()
+    service = settings['service']
+    if service is None:
+        creds = settings['credentials']
+        if settings['workers'] > 1:
+            service = ThreadLocalDriveService(lambda: build('drive', 'v3', credentials=creds))
+        else:
+            service = build('drive', 'v3', credentials=creds)
+    executor = ThreadPoolExecutor(max_workers=settings['workers']) if settings['workers'] > 1 else None
+    _WORKER = dict(settings, service=service, quota=quota, executor=executor)
+
+
+def _crawl_class_in_worker(cls):
+    """
+    Crawl one class in a crawl worker process. Returns its JSON (written by the main process)
+    or the error, with this crawl's Drive call, cache and scheduler counters and parent index updates.
+    """
+    global DRIVE_BATCHER
+    worker = _WORKER
+    drive_metrics.reset()
+    cache_migrations.reset_stats()
+    NODE_CACHE_STATS.update(spliced=0, rebuilt=0)
+    BLOB_CACHE_STATS.update(hits=0, misses=0)
+    # The memos themselves live on across the classes this worker crawls
+    LISTING_MEMO.reset_stats()
+    CONTENT_MEMO.reset_stats()
+    scheduler = drive_scheduler.DriveScheduler(
+        drive_metrics.InstrumentedDriveService(worker['service']), shared=worker['quota'], **worker['scheduler']
+    )
+    DRIVE_BATCHER = drive_batch.DriveBatcher(scheduler) if worker['batch'] else None
+    _, class_json, error = next(_crawl_classes_serially(
+        scheduler, [cls], worker['invalidated_ids'], worker['use_cache'], worker['executor'], worker['bfs']
+    ))
+    return {
+        'class_json': class_json,
+        'error': None if error is None else str(error),
+        'metrics': drive_metrics.METRICS.state(),
+        'node_stats': dict(NODE_CACHE_STATS),
+        'blob_stats': dict(BLOB_CACHE_STATS),
+        'migrations': cache_migrations.stats(),
+        'memo': {'listings': LISTING_MEMO.stats(), 'content': CONTENT_MEMO.stats()},
+        'scheduler': scheduler.stats(),
+        'batcher': (DRIVE_BATCHER.requests_sent, DRIVE_BATCHER.round_trips) if DRIVE_BATCHER is not None else None,
+        'index_journal': get_cache_store().take_index_journal(),
+    }
+
+
+def _merge_worker_result(scheduler, result):
+    """Add a crawl worker's counters (see _crawl_class_in_worker) to this run and apply its parent index updates."""
+    drive_metrics.METRICS.merge(result['metrics'])
+    with _CACHE_STATS_LOCK:
+        for stats, worker_stats in ((NODE_CACHE_STATS, result['node_stats']), (BLOB_CACHE_STATS, result['blob_stats'])):
+            for name, count in worker_stats.items():
+                stats[name] += count
+    cache_migrations.merge_stats(result['migrations'])
+    LISTING_MEMO.merge_stats(result['memo']['listings'])
+    CONTENT_MEMO.merge_stats(result['memo']['content'])
+    scheduler.merge_stats(result['scheduler'])
+    if result['batcher'] is not None and DRIVE_BATCHER is not None:
+        DRIVE_BATCHER.requests_sent += result['batcher'][0]
+        DRIVE_BATCHER.round_trips += result['batcher'][1]
+    get_cache_store().apply_index_journal(result['index_journal'])
+
+
+def _crawl_classes_in_processes(scheduler, classes, processes, context, settings):
+    """
+    Yield (cls, class_json or None, error) for each class, crawled by a pool of worker processes.
+    Classes are handed out and yielded in the given (priority) order; with a call budget, the classes of
+    one priority are finished before the next are started, so lower priorities cannot spend the budget
+    of the current classes. Each worker's log records go to this process's log, and its counters and
+    parent index updates are merged into this run's.
+    """
+    log_queue = context.Queue()
+    listener = start_log_listener(log_queue)
+    # Workers write listings; load the index first so their dirty marker does not force a rebuild
+    get_cache_store().load_index()
+    try:
+        with ProcessPoolExecutor(max_workers=processes, mp_context=context, initializer=_init_class_worker,
+                                 initargs=(settings, scheduler.shared, log_queue)) as pool:
+            if scheduler.budget is None:
+                groups = [classes]
+            else:
+                groups = [list(group) for _, group in itertools.groupby(classes, key=_class_priority)]
+            for group in groups:
+                futures = [pool.submit(_crawl_class_in_worker, cls) for cls in group]
+                for cls, future in zip(group, futures):
+                    result = future.result()
+                    _merge_worker_result(scheduler, result)
+                    yield cls, result['class_json'], result['error']
+    finally:
+        listener.stop()
+
+
+def generate_data(use_cache=True, workers=1, batch=False, bfs=False, snapshot=False, cache_backend=None, patch_changes=False,
+                  service=None, classes=None, rate_limit=None, call_budget=None, processes=1, force_classes=None):
     """Generate all class JSON files from Google Drive.
 
     Args:
         use_cache: When True, uses folder/lesson cache and Drive Changes API to
                    invalidate only affected folders. When False, does a full
                    fetch without reading or writing cache/state.
+                   README/lesson.json/assignments whose md5Checksum (or version) is
+                   unchanged are not downloaded again (blob cache, hits/misses printed at the end).
+        workers: Number of crawl threads. 1 (default) crawls sequentially; N > 1
+                 fans out folder listings and README/lesson.json/assignments
+                 downloads over N threads, with output identical to workers=1.
+        batch: When True, folder listings and modifiedTime lookups that miss the
+               cache are coalesced into Drive batch requests (up to 100 per round trip).
+        bfs: When True, each class tree is listed level by level, combining up to
+             MULTI_PARENT_QUERY_SIZE folders into one files().list query.
+        snapshot: When True and there is no saved changes state (cold start) or
+                  cache is disabled, the whole Drive is listed once up front and
+                  folder listings are served from that in-memory index.
+        cache_backend: 'files' or 'sqlite' to override CACHE_BACKEND (see cache_store.py).
+        patch_changes: When True, Drive changes are applied to the cached listings in place
+                       (see apply_changes_to_cache) and only folders the events cannot describe
+                       are listed again; lesson objects above every change are still rebuilt.
+        service: Drive service to crawl with instead of the authorized client (e.g. a
+                 drive_fake.FakeDriveService); it is shared by all worker threads, and each
+                 worker process gets a copy (so it must be picklable).
+        classes: Class entries to crawl instead of class_info.
+        rate_limit: Drive calls per second (0 = unlimited) instead of DRIVE_RATE_LIMIT.
+        call_budget: Maximum Drive calls for the run instead of DRIVE_CALL_BUDGET.
+                     Classes are crawled in CLASS_CATEGORY_PRIORITY order; a class that cannot be
+                     crawled (rate limited after all retries, budget spent, Drive errors) keeps its
+                     last good JSON and the changes token is not advanced, so the next run retries it.
+        processes: Number of worker processes crawling classes in parallel (each with `workers`
+                   threads). 1 (default) crawls the classes in this process. The workers share the
+                   Drive credentials, the rate limit and call budget (drive_scheduler.SharedQuota) and
+                   the cache; the JSON files, build.log and build_report.json are written here, the
+                   files identical to processes=1.
+        force_classes: url_names of classes to crawl even when regenerate=False or nothing changed.
+
+    When the Changes API reports what changed since the last run, a class with no change below
+    its folder keeps its JSON file without being crawled; with no change at all the run only
+    makes the changes.list call. A JSON file is only rewritten when its content changed.
+
+    Holds cache_lock for the whole run: a second build sharing cache/ waits for this one.
+
+    Returns:
+        The url_names of the classes whose JSON file was written ([] when nothing changed).
     """
+    with cache_lock.cache_lock():
+        return _generate_data(use_cache, workers, batch, bfs, snapshot, cache_backend, patch_changes, service,
+                              classes, rate_limit, call_budget, processes, force_classes)
+
+
+def _generate_data(use_cache, workers, batch, bfs, snapshot, cache_backend, patch_changes, service, classes,
+                   rate_limit, call_budget, processes, force_classes):
     log_event('Main process started')
     print('Main process started!')
+    if cache_backend:
+        set_cache_backend(cache_backend)
     
     # --- New Schema Loading Snippet, loading once for performance, at the start of the program ---
     global LESSON_SCHEMA
@@ -800,21 +2083,69 @@ def generate_data(use_cache=True):
     # Create data directory if it doesn't exist
     os.makedirs(DATA_DIR, exist_ok=True)
 
-    service = get_drive_service()
+    classes = class_info if classes is None else classes
+    force_classes = set(force_classes or ())
+    unknown = force_classes - {cls['url_name'] for cls in classes}
+    if unknown:
+        raise ValueError(f"Unknown classes {sorted(unknown)}: expected url_name values from class_info")
+    executor = None
+    if workers > 1:
+        executor = ThreadPoolExecutor(max_workers=workers)
+        log_event(f'Concurrent crawl enabled with {workers} workers')
+    creds = None
+    injected_service = service
+    if service is not None:
+        log_event(f'Using injected Drive service {type(service).__name__}')
+    else:
+        creds = get_drive_credentials()
+        if workers > 1:
+            service = ThreadLocalDriveService(lambda: build('drive', 'v3', credentials=creds))
+        else:
+            service = build('drive', 'v3', credentials=creds)
+    # Every Drive call is counted by type, class and level for build_report.json, then rate limited,
+    # retried and charged to the budget by the scheduler
+    drive_metrics.reset()
+    cache_migrations.reset_stats()
+    scheduler_settings = {
+        'rate': DRIVE_RATE_LIMIT if rate_limit is None else rate_limit, 'burst': DRIVE_RATE_BURST,
+        'max_retries': DRIVE_MAX_RETRIES, 'backoff_base': DRIVE_BACKOFF_BASE,
+        'budget': DRIVE_CALL_BUDGET if call_budget is None else call_budget,
+    }
+    process_context = None
+    shared_quota = None
+    if processes > 1:
+        # spawn: forked workers would inherit this process's threads, locks and open cache store
+        process_context = multiprocessing.get_context('spawn')
+        shared_quota = drive_scheduler.SharedQuota(process_context, DRIVE_RATE_BURST)
+        log_event(f'Crawling classes in {processes} worker processes')
+    scheduler = drive_scheduler.DriveScheduler(drive_metrics.InstrumentedDriveService(service), shared=shared_quota,
+                                               **scheduler_settings)
+    service = scheduler
+
+    global DRIVE_BATCHER
+    _PREFETCHED_LISTINGS.clear()
+    _REPORTED_MODIFIED_TIMES.clear()
+    LISTING_MEMO.clear()
+    CONTENT_MEMO.clear()
+    NODE_CACHE_STATS.update(spliced=0, rebuilt=0)
+    global BLOB_CACHE_ENABLED
+    BLOB_CACHE_ENABLED = use_cache
+    BLOB_CACHE_STATS.update(hits=0, misses=0)
+    DRIVE_BATCHER = drive_batch.DriveBatcher(service) if batch else None
 
     # Resolve affected folder IDs and start token via Changes API when using cache
     affected_folder_ids = set()
     new_start_page_token = None
+    # Every folder with a change below it, when the Changes API said what changed since the last run
+    changed_folder_ids = None
+    # Roots of the classes whose last crawl completed, so their whole tree is in the cache
+    crawled_roots = set()
     if use_cache:
         import drive_changes
-        saved_token = None
-        if os.path.exists(CHANGES_STATE_PATH):
-            try:
-                with open(CHANGES_STATE_PATH, 'r', encoding='utf-8') as f:
-                    state = json.load(f)
-                saved_token = state.get('startPageToken')
-            except Exception as e:
-                log_event(f"Could not load changes state: {e}")
+        state = load_changes_state() or {}
+        saved_token = state.get('startPageToken')
+        pending_folder_ids = set(state.get('pendingFolderIds', []))
+        crawled_roots = set(state.get('crawledRoots', []))
         if saved_token:
             try:
                 changes_list, new_start_page_token = drive_changes.fetch_changes(service, saved_token)
@@ -822,58 +2153,177 @@ def generate_data(use_cache=True):
                 log_event(f"Persisted {len(changes_list)} changes to {changes_path}")
                 data = drive_changes.load_changes(changes_path)
                 affected_folder_ids = drive_changes.compute_affected_folder_ids(
-                    data['changes'], CACHE_DIR
-                )
+                    data['changes'], get_cache_store()
+                ) | pending_folder_ids
+                changed_folder_ids = set(affected_folder_ids)
+                if patch_changes:
+                    refetch_ids = apply_changes_to_cache(data['changes'])
+                    # Listings are current now, but lessons and folders above a change must be rebuilt
+                    # (README/lesson.json/content may differ): drop their nodes, and make their cached
+                    # lesson objects go through revalidation against the patched listings
+                    for changed_id in affected_folder_ids:
+                        invalidate_lesson_obj(changed_id)
+                        get_cache_store().delete_nodes(changed_id)
+                    log_event(f"Affected folder IDs (lesson objects revalidated): {len(affected_folder_ids)}")
+                    affected_folder_ids = refetch_ids
                 if affected_folder_ids:
                     log_event(f"Affected folder IDs (will refetch): {len(affected_folder_ids)}")
             except Exception as e:
-                log_event(f"Changes API error: {e}; clearing changes state so next run does full crawl")
-                if os.path.exists(CHANGES_STATE_PATH):
-                    os.remove(CHANGES_STATE_PATH)
+                if drive_scheduler.is_quota_error(e):
+                    # The token is still good: keep it so the next run reads these changes
+                    log_event(f"Changes API unavailable: {e}; crawling from cache, changes state kept")
+                else:
+                    log_event(f"Changes API error: {e}; clearing changes state so next run does full crawl")
+                    if os.path.exists(CHANGES_STATE_PATH):
+                        os.remove(CHANGES_STATE_PATH)
                 affected_folder_ids = set()
+                changed_folder_ids = None
                 new_start_page_token = None
         else:
             # No previous token: full crawl this run; get token at end for next run
             new_start_page_token = None  # will fetch at end
+            # Without the Changes API, refetch the class roots and let each fresh listing
+            # validate its child folders' cached listings by modifiedTime (see _REPORTED_MODIFIED_TIMES)
+            affected_folder_ids = {extract_folder_id(cls['google_drive_url']) for cls in classes}
+        dropped = get_cache_store().take_dropped_listings()
+        if dropped:
+            # No change reports them: fetch them again, and rebuild (not splice) every folder above them
+            dropped = drive_changes.with_ancestors(dropped, get_cache_store())
+            log_event(f"Cached listings dropped while reading the changes: refetching {len(dropped)} folder IDs")
+            affected_folder_ids = affected_folder_ids | dropped
+            if changed_folder_ids is not None:
+                changed_folder_ids |= dropped
     else:
         log_event('Cache disabled (use_cache=False)')
 
-    # Use hardcoded ids from class_info
-    for cls in class_info:
-        class_name = cls['name']
-        class_id = cls['id']  # Use hardcoded id
+    global DRIVE_SNAPSHOT
+    DRIVE_SNAPSHOT = None
+    if snapshot and (not use_cache or not os.path.exists(CHANGES_STATE_PATH)):
+        if use_cache:
+            # Take the start token before the snapshot so edits made while crawling show up next run
+            try:
+                new_start_page_token = service.changes().getStartPageToken().execute().get('startPageToken')
+            except Exception as e:
+                log_event(f"Could not get start page token before snapshot: {e}")
+        try:
+            DRIVE_SNAPSHOT = load_drive_snapshot(service)
+        except drive_scheduler.DRIVE_ERRORS as e:
+            log_event(f"Drive snapshot failed: {e}; listing folders one by one")
+
+    # Use hardcoded ids from class_info; the most important categories first
+    to_crawl = []
+    up_to_date = []
+    # Roots of regenerate=False classes with changes below them (their changes are kept for a later run)
+    held_roots = []
+    for cls in sorted(classes, key=_class_priority):
         url_name = cls['url_name']  # Keep hardcoded url_name
-        folder_url = cls['google_drive_url']
-        banner_url = cls.get('banner_url', '')
-        category = cls.get('category', 'past')
         regenerate = cls.get('regenerate', True)  # Default to True for backward compatibility
+        root_id = extract_folder_id(cls['google_drive_url'])
+        forced = url_name in force_classes
 
         # Check if we should regenerate this class
-        if not regenerate:
+        if not regenerate and not forced:
             log_event(f'Skipping {url_name} - regenerate=False, keeping existing JSON file')
             print(f'Skipping {url_name} - regenerate=False, keeping existing JSON file')
+            if changed_folder_ids is not None and root_id in changed_folder_ids:
+                held_roots.append(root_id)
+            continue
+        # Changes bubble up to the class root (compute_affected_folder_ids): no root, nothing changed in the class.
+        # That holds only when the cached listings (the parent index) cover the whole class: a class whose last
+        # crawl did not complete, or whose root listing is gone, is crawled.
+        if (changed_folder_ids is not None and not forced and root_id not in changed_folder_ids
+                and root_id in crawled_roots and get_cache_store().get_listing(root_id) is not None
+                and _class_json_current(cls, os.path.join(DATA_DIR, f'class-{url_name}.json'))):
+            log_event(f'Skipping {url_name} - no Drive changes in its folder, keeping existing JSON file')
+            up_to_date.append(url_name)
             continue
+        to_crawl.append(cls)
+    if changed_folder_ids is not None and not to_crawl:
+        msg = f'No changes: all {len(up_to_date)} classes are up to date'
+        log_event(msg)
+        print(msg)
+    elif up_to_date:
+        print(f'{len(up_to_date)} classes without Drive changes kept their JSON files')
+
+    if processes > 1 and len(to_crawl) > 1:
+        crawled = _crawl_classes_in_processes(scheduler, to_crawl, min(processes, len(to_crawl)), process_context, {
+            'schema': LESSON_SCHEMA, 'snapshot': DRIVE_SNAPSHOT, 'use_cache': use_cache, 'workers': workers,
+            'batch': batch, 'bfs': bfs, 'cache_backend': CACHE_BACKEND, 'invalidated_ids': affected_folder_ids,
+            'service': injected_service, 'credentials': creds, 'scheduler': scheduler_settings,
+        })
+    else:
+        crawled = _crawl_classes_serially(service, to_crawl, affected_folder_ids, use_cache, executor, bfs)
 
-        folder_id = extract_folder_id(folder_url)
-        log_event(f'Crawling url_name: {url_name} (folder_url: {folder_url})')
-        class_json = crawl_class(
-            service, class_name, folder_id, banner_url, url_name, category, class_id,
-            invalidated_ids=affected_folder_ids, use_cache=use_cache
-        )
+    failed_classes = []
+    written = []
+    for cls, class_json, error in crawled:
+        url_name = cls['url_name']
+        root_id = extract_folder_id(cls['google_drive_url'])
         # Use url_name for output filename
         out_path = os.path.join(DATA_DIR, f'class-{url_name}.json')
-        with open(out_path, 'w', encoding='utf-8') as f:
-            json.dump(class_json, f, ensure_ascii=False, indent=2)
+        if class_json is None:
+            failed_classes.append(url_name)
+            crawled_roots.discard(root_id)
+            _keep_last_class_json(url_name, out_path, error)
+            continue
+        crawled_roots.add(root_id)
+        text = json.dumps(class_json, ensure_ascii=False, indent=2)
+        if _read_text(out_path) == text:
+            log_event(f'Unchanged {out_path}')
+            continue
+        # The site build may be reading data/ meanwhile
+        cache_store.write_text_atomic(out_path, text)
+        written.append(url_name)
         log_event(f'Wrote {out_path}')
         print(f'Wrote {out_path}')
-    log_event('All classes processed. JSON generation complete.')
+    if executor is not None:
+        executor.shutdown()
+    if DRIVE_BATCHER is not None:
+        log_event(DRIVE_BATCHER.summary())
+        print(DRIVE_BATCHER.summary())
+    get_cache_store().flush()
+    if use_cache:
+        log_event(f"Node cache: {NODE_CACHE_STATS['spliced']} folders spliced, {NODE_CACHE_STATS['rebuilt']} rebuilt")
+        blob_summary = (f"Blob cache (README/lesson.json/assignments): {BLOB_CACHE_STATS['hits']} hits, "
+                        f"{BLOB_CACHE_STATS['misses']} misses (downloaded)")
+        log_event(blob_summary)
+        print(blob_summary)
+    memo_stats = {'listings': LISTING_MEMO.stats(), 'content': CONTENT_MEMO.stats()}
+    memo_summary = 'Run memo: ' + '; '.join(
+        f"{name} {stats['hits']} hits, {stats['misses']} misses, {stats['evictions']} evictions"
+        for name, stats in memo_stats.items())
+    log_event(memo_summary)
+    print(memo_summary)
+    migration_summary = cache_migrations.summary()
+    if migration_summary:
+        log_event(migration_summary)
+        print(migration_summary)
+    if failed_classes:
+        # Not a success, whatever build_site prints next: say which classes kept an old file
+        outcome = (f"{len(to_crawl) - len(failed_classes)} of {len(to_crawl)} classes crawled; "
+                   f"kept last good JSON for {', '.join(failed_classes)}")
+    else:
+        outcome = 'All classes processed. JSON generation complete.'
+    log_event(outcome)
 
     # Save new start page token for next run when using cache
-    if use_cache and new_start_page_token:
-        os.makedirs(os.path.dirname(CHANGES_STATE_PATH), exist_ok=True)
+    crawled_roots &= {extract_folder_id(cls['google_drive_url']) for cls in classes}
+    if failed_classes:
+        # Changes seen this run were not applied to the failed classes: read them again next run
+        log_event(f"Not advancing the changes token: {len(failed_classes)} classes failed ({', '.join(failed_classes)})")
+        if use_cache and os.path.exists(CHANGES_STATE_PATH):
+            try:
+                save_changes_state(dict(state, crawledRoots=sorted(crawled_roots)))
+            except Exception as e:
+                log_event(f"Could not save changes state: {e}")
+    elif use_cache and new_start_page_token:
+        state = {'startPageToken': new_start_page_token, 'crawledRoots': sorted(crawled_roots)}
+        if held_roots:
+            # Not crawled this run: keep the changed folders below them until they are
+            state['pendingFolderIds'] = sorted(drive_changes.folder_ids_under(changed_folder_ids, held_roots, get_cache_store()))
+            log_event(f"Keeping {len(state['pendingFolderIds'])} changed folder IDs of regenerate=False classes for a later run")
         try:
-            with open(CHANGES_STATE_PATH, 'w', encoding='utf-8') as f:
-                json.dump({'startPageToken': new_start_page_token}, f, indent=2)
+            save_changes_state(state)
             log_event('Saved changes state for next run')
         except Exception as e:
             log_event(f"Could not save changes state: {e}")
@@ -884,12 +2334,11 @@ def generate_data(use_cache=True):
             start_token_resp = service.changes().getStartPageToken().execute()
             token = start_token_resp.get('startPageToken')
             if token:
-                os.makedirs(os.path.dirname(CHANGES_STATE_PATH), exist_ok=True)
-                with open(CHANGES_STATE_PATH, 'w', encoding='utf-8') as f:
-                    json.dump({'startPageToken': token}, f, indent=2)
+                save_changes_state({'startPageToken': token, 'crawledRoots': sorted(crawled_roots)})
                 log_event('Saved initial changes state for next run')
         except Exception as e:
             log_event(f"Could not save initial changes state: {e}")
+    gc_stats = collect_cache_garbage(classes) if use_cache else None
 
     # Record the end time
     end_time = datetime.now()
@@ -897,7 +2346,24 @@ def generate_data(use_cache=True):
     total_time = end_time - start_time
     print(f"Total time taken: {total_time.total_seconds()} seconds to run.")
     print(f'Total time taken: {total_time}')
-    print('All classes processed. JSON generation complete.')
+
+    if use_cache:
+        drive_metrics.METRICS.set_cache('nodes', NODE_CACHE_STATS)
+        drive_metrics.METRICS.set_cache('blobs', BLOB_CACHE_STATS)
+    drive_metrics.METRICS.set_cache('listing_memo', {'hits': memo_stats['listings']['hits'], 'misses': memo_stats['listings']['misses']})
+    drive_metrics.METRICS.set_cache('content_memo', {'hits': memo_stats['content']['hits'], 'misses': memo_stats['content']['misses']})
+    report = drive_metrics.write_report(total_time.total_seconds(), {
+        'use_cache': use_cache, 'workers': workers, 'batch': batch, 'bfs': bfs, 'snapshot': snapshot,
+        'cache_backend': CACHE_BACKEND, 'patch_changes': patch_changes, 'classes': len(classes), 'processes': processes,
+        'force_classes': sorted(force_classes),
+    }, {'scheduler': scheduler.stats(), 'failed_classes': failed_classes, 'written_classes': written,
+        'up_to_date_classes': up_to_date, 'cache_migrations': cache_migrations.stats(), 'cache_gc': gc_stats,
+        'memo': memo_stats})
+    for line in drive_metrics.summary(report):
+        log_event(line)
+        print(line)
+    print(outcome)
+    return written
 
 
 def main():
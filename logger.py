@@ -1,4 +1,5 @@
 import logging
+import logging.handlers
 from datetime import datetime
 import pytz
 
@@ -12,4 +13,19 @@ def log_event(msg):
     now = datetime.now(ISRAEL_TZ).strftime('%Y-%m-%d %H:%M:%S')
 
     
-    logging.info(f'[{now} IST] {msg}') 
\ No newline at end of file
+    logging.info(f'[{now} IST] {msg}') 
+
+
+def start_log_listener(queue):
+    """Write the records crawl worker processes put on queue (see log_to_queue) to this process's log. Call .stop() when done."""
+    listener = logging.handlers.QueueListener(queue, *logging.getLogger().handlers)
+    listener.start()
+    return listener
+
+def log_to_queue(queue):
+    """In a crawl worker process: send log records to the main process instead of opening build.log again."""
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+        handler.close()
+    root.addHandler(logging.handlers.QueueHandler(queue))
@@ -0,0 +1,73 @@
+"""
+Bounded in-process memo for results computed during one crawl run.
+
+drive_to_class_json keeps two: LISTING_MEMO (folder listings by resolved folder id) and
+CONTENT_MEMO (crawled content subtrees by folder id and listing hash).
+A folder linked into several classes and lessons through shortcuts is then listed and built
+once per run (per crawl worker process with processes > 1); later visits reuse the result
+without an API call or a cache file read. Both are cleared at the start of every run.
+"""
+import threading
+from collections import OrderedDict
+
+
+class RunMemo:
+    """Thread-safe LRU map with hit, miss and eviction counters. maxsize 0 disables it."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, valid=None):
+        """The value stored for key, or None. An entry failing valid(value) is dropped (a miss)."""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None and (valid is None or valid(value)):
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+            if value is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def peek(self, key, valid=None):
+        """What get(key, valid) would return, without counting, reordering or dropping anything."""
+        with self._lock:
+            value = self._entries.get(key)
+            return value if value is not None and (valid is None or valid(value)) else None
+
+    def put(self, key, value):
+        if not self.maxsize:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Drop every entry and reset the counters (start of a run)."""
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = self.evictions = 0
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'size': len(self._entries)}
+
+    def merge_stats(self, stats):
+        """Add the counters of a crawl worker process's memo (its stats())."""
+        with self._lock:
+            self.hits += stats['hits']
+            self.misses += stats['misses']
+            self.evictions += stats['evictions']
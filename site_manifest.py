@@ -0,0 +1,168 @@
+"""
+Input-hash manifest of the generated site, for incremental builds (build_site.py).
+
+Every output under the site directory (pages, calendars, copied assets) is recorded in
+MANIFEST_PATH with a hash of the inputs it was made from and a hash of its bytes. A build then:
+    - skips an output whose input hash is unchanged and which is still on disk as written
+      (up_to_date), without rendering it;
+    - writes a rendered output only when its bytes differ from the file on disk (write);
+    - copies an asset only when its content differs from the copy (copy);
+    - removes every file under the site directory that it did not produce (remove_stale).
+File hashes are remembered with the file's size and mtime, so an unchanged file is only stat'ed.
+A build with no changes writes nothing but the manifest.
+"""
+import os
+import json
+import shutil
+import hashlib
+from logger import log_event
+import cache_store
+
+MANIFEST_PATH = os.path.join('cache', 'site_manifest.json')
+# Bump when the manifest layout changes; a manifest of another format means a full render
+MANIFEST_FORMAT = 1
+
+
+def hash_inputs(*parts):
+    """Digest of JSON-serializable build inputs."""
+    encoded = json.dumps(parts, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+
+def _file_key(path):
+    return os.path.normpath(path).replace(os.sep, '/')
+
+
+class SiteManifest:
+    """Outputs and file hashes of the last build, and those of the current one."""
+
+    def __init__(self, dist_dir, path=MANIFEST_PATH, full=False):
+        self.dist_dir = dist_dir
+        self.path = path
+        previous = {} if full else self._load()
+        self._previous_outputs = previous.get('outputs', {})
+        self._previous_files = previous.get('files', {})
+        self._previous_derived = previous.get('derived', {})
+        # name (relative to dist_dir, '/'-separated) -> {"inputs": input hash, "sha": sha256 of the bytes}
+        self.outputs = {}
+        # path -> [size, mtime_ns, sha256] of every source and output looked at
+        self.files = {}
+        # key -> {"sha": hash of the content it was computed from, "value": value} (see derived)
+        self.derived_values = {}
+        self.stats = {'rendered': 0, 'written': 0, 'unchanged': 0, 'copied': 0, 'removed': 0}
+
+    def _load(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            if os.path.exists(self.path):
+                log_event(f"Ignoring unreadable site manifest {self.path}: {e}")
+            return {}
+        if not isinstance(data, dict) or data.get('format') != MANIFEST_FORMAT:
+            log_event(f"Ignoring site manifest {self.path} of another format")
+            return {}
+        return data
+
+    def file_hash(self, path):
+        """sha256 of a file (None if it does not exist), read only when its size or mtime changed."""
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        key = _file_key(path)
+        known = self.files.get(key) or self._previous_files.get(key)
+        if known and known[0] == st.st_size and known[1] == st.st_mtime_ns:
+            sha = known[2]
+        else:
+            with open(path, 'rb') as f:
+                sha = hashlib.sha256(f.read()).hexdigest()
+        self.files[key] = [st.st_size, st.st_mtime_ns, sha]
+        return sha
+
+    def _remember(self, path, sha):
+        st = os.stat(path)
+        self.files[_file_key(path)] = [st.st_size, st.st_mtime_ns, sha]
+
+    def derived(self, key, sha, make):
+        """A value computed from content with hash sha: kept from the last build if sha is unchanged, else make()."""
+        known = self._previous_derived.get(key)
+        value = known['value'] if known and known['sha'] == sha else make()
+        self.derived_values[key] = {'sha': sha, 'value': value}
+        return value
+
+    def output_path(self, name):
+        return os.path.join(self.dist_dir, *name.split('/'))
+
+    def up_to_date(self, name, input_hash):
+        """True when name was made from input_hash last time and is still on disk as written (it is kept)."""
+        known = self._previous_outputs.get(name)
+        if known is None or known['inputs'] != input_hash:
+            return False
+        if self.file_hash(self.output_path(name)) != known['sha']:
+            return False
+        self.outputs[name] = known
+        self.stats['unchanged'] += 1
+        return True
+
+    def write(self, name, data, input_hash):
+        """Record name as made from input_hash; data (bytes) is written only when the file on disk differs."""
+        path = self.output_path(name)
+        sha = hashlib.sha256(data).hexdigest()
+        self.stats['rendered'] += 1
+        if self.file_hash(path) != sha:
+            cache_store.write_bytes_atomic(path, data)
+            self._remember(path, sha)
+            self.stats['written'] += 1
+        self.outputs[name] = {'inputs': input_hash, 'sha': sha}
+
+    def copy(self, source, name):
+        """Copy source to name unless the copy already has the same content."""
+        path = self.output_path(name)
+        sha = self.file_hash(source)
+        if self.file_hash(path) == sha:
+            self.stats['unchanged'] += 1
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            shutil.copy2(source, path)
+            self._remember(path, sha)
+            self.stats['copied'] += 1
+        self.outputs[name] = {'inputs': sha, 'sha': sha}
+
+    def copy_tree(self, source_dir, name):
+        """copy() every file under source_dir to the same place under name."""
+        for root, dirs, files in os.walk(source_dir):
+            dirs.sort()
+            relative = os.path.relpath(root, source_dir)
+            for filename in sorted(files):
+                target = filename if relative == '.' else os.path.join(relative, filename)
+                self.copy(os.path.join(root, filename), f"{name}/{_file_key(target)}")
+
+    def remove_stale(self):
+        """Delete the files under dist_dir this build did not produce, and directories left empty."""
+        produced = {_file_key(self.output_path(name)) for name in self.outputs}
+        for root, _, files in os.walk(self.dist_dir, topdown=False):
+            for filename in files:
+                path = os.path.join(root, filename)
+                if _file_key(path) not in produced:
+                    os.remove(path)
+                    self.files.pop(_file_key(path), None)
+                    self.stats['removed'] += 1
+                    log_event(f"Removed stale {path}")
+            if os.path.normpath(root) != os.path.normpath(self.dist_dir) and not os.listdir(root):
+                os.rmdir(root)
+
+    def save(self):
+        data = {
+            'format': MANIFEST_FORMAT,
+            'outputs': self.outputs,
+            'files': self.files,
+            'derived': self.derived_values,
+        }
+        cache_store.write_text_atomic(self.path, json.dumps(data, ensure_ascii=False, sort_keys=True, indent=1))
+
+    def summary_line(self):
+        """One line for build.log."""
+        stats = self.stats
+        return (f"Site: {stats['rendered']} outputs rendered ({stats['written']} changed and written), "
+                f"{stats['copied']} assets copied, {stats['unchanged']} unchanged, {stats['removed']} stale removed")
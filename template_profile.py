@@ -0,0 +1,82 @@
+"""
+Render time per block and macro of the site templates (build_site.py --template-timing).
+
+Class page renders run under cProfile. Jinja compiles every template into Python functions whose
+code carries the template's file name: root (the template body), block_<name> for each block and
+macro for each macro. The report maps the functions cProfile recorded back to the template line
+they were compiled from, and lists them by cumulative time (the function and everything it calls:
+nested blocks and macros, filters, escaping) as a share of all profiled render time, with their
+own time (excluding calls) next to it. cProfile slows rendering down, so only the shares compare
+with a build without --template-timing.
+"""
+import re
+import time
+import cProfile
+import pstats
+import contextlib
+from logger import log_event
+
+_MACRO_RE = re.compile(r'macro\s+(\w+)')
+
+
+class TemplateProfile:
+    """Profile of the renders run inside measure()."""
+
+    def __init__(self):
+        self._profiler = cProfile.Profile()
+        self.renders = 0
+        self.seconds = 0.0
+
+    @contextlib.contextmanager
+    def measure(self):
+        start = time.perf_counter()
+        self._profiler.enable()
+        try:
+            yield
+        finally:
+            self._profiler.disable()
+            self.seconds += time.perf_counter() - start
+            self.renders += 1
+
+    def rows(self, env, names, source_loader):
+        """
+        [{'template', 'line', 'label', 'cumulative', 'own'}] for the template functions of the templates
+        names (env loads them, source_loader gives their source), slowest first.
+        """
+        templates = {}
+        for name in names:
+            template = env.get_template(name)
+            templates[template.filename] = (name, template)
+        rows = []
+        for (filename, lineno, function), (_, _, own, cumulative, _) in pstats.Stats(self._profiler).stats.items():
+            if filename not in templates:
+                continue
+            name, template = templates[filename]
+            line = template.get_corresponding_lineno(lineno)
+            if function == 'root':
+                label = 'template body'
+            elif function.startswith('block_'):
+                label = f"block {function[len('block_'):]}"
+            elif function == 'macro':
+                source_lines = source_loader.get_source(env, name)[0].splitlines()
+                match = _MACRO_RE.search(source_lines[line - 1]) if 0 < line <= len(source_lines) else None
+                label = f"macro {match.group(1)}" if match else 'macro'
+            else:
+                continue
+            rows.append({'template': name, 'line': line, 'label': label, 'cumulative': cumulative, 'own': own})
+        rows.sort(key=lambda row: -row['cumulative'])
+        return rows
+
+    def report(self, env, names, source_loader):
+        """Lines for build.log: one per block and macro, slowest first."""
+        total = sum(stats[2] for stats in pstats.Stats(self._profiler).stats.values()) or 1.0
+        lines = [f"Template timing: {self.renders} class page renders in {self.seconds:.3f}s (profiled)"]
+        for row in self.rows(env, names, source_loader):
+            lines.append(f"  {row['label']:<28} {row['template'] + ':' + str(row['line']):<16} "
+                         f"{row['cumulative'] / total:6.1%} cumulative {row['cumulative']:.3f}s, own {row['own']:.3f}s")
+        return lines
+
+    def log_report(self, env, names, source_loader):
+        for line in self.report(env, names, source_loader):
+            log_event(line)
+            print(line)
@@ -0,0 +1,32 @@
+import os
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import drive_to_class_json as dtj  # noqa: E402
+
+
+@pytest.fixture
+def crawl_dir(tmp_path_factory, monkeypatch):
+    """
+    Returns enter(name): make a fresh working directory (cache/, data/, changes_api/) and chdir into it.
+    The cache store keeps relative paths, so it is closed whenever the directory changes.
+    """
+    monkeypatch.setattr(dtj, 'SCHEMA_PATH', os.path.join(REPO_DIR, dtj.SCHEMA_PATH))
+
+    def close_store():
+        if dtj.CACHE_STORE is not None:
+            dtj.CACHE_STORE.close()
+            dtj.CACHE_STORE = None
+
+    def enter(name):
+        close_store()
+        path = tmp_path_factory.mktemp(name)
+        monkeypatch.chdir(path)
+        return path
+
+    yield enter
+    close_store()
@@ -0,0 +1,128 @@
+"""
+A cached crawl writes the same class JSON as an uncached one after Drive edits, also when
+cache entries were lost in between (evicted by the cache size cap, cache_gc.py, or
+invalidated by a format change, cache_migrations.py) or the cache never held a class.
+"""
+import contextlib
+import io
+import os
+
+import pytest
+
+import cache_migrations
+import drive_fake
+import drive_to_class_json as dtj
+
+
+def _ids(service):
+    """name -> [file ids], class 1 first."""
+    ids = {}
+    for record in sorted(service.files_by_id.values(), key=lambda f: f['id']):
+        ids.setdefault(record['name'], []).append(record['id'])
+    return ids
+
+
+def _edits(service):
+    """One edit per run, in classes 1 and 2 and in the folder both link to."""
+    ids = _ids(service)
+    return [
+        lambda: service.edit(ids['shared worksheet.pdf'][0], name='shared worksheet v2.pdf'),
+        lambda: service.edit(ids['README.md'][0], content='# שיעור\n\nנערך'.encode('utf-8')),
+        lambda: service.edit(ids['README.md'][-1], content='# שיעור\n\nנערך בכיתה 2'.encode('utf-8')),
+        lambda: service.edit(ids['דף עבודה 1.pdf'][-1], name='דף עבודה מעודכן.pdf'),
+        lambda: service.trash(ids['הקלטה.mp4'][-1]),
+        lambda: service.remove(ids['lesson.json'][-1]),
+        lambda: service.edit(ids['פתרון 1.pdf'][-1], parents=[ids['פתרונות 1'][0]]),
+        lambda: service.add({'id': 'f900001', 'name': 'חדש.pdf', 'mimeType': 'application/pdf',
+                             'parents': [ids['shared'][0]]}),
+    ]
+
+
+def _crawl(service, classes, use_cache):
+    with contextlib.redirect_stdout(io.StringIO()):
+        dtj.generate_data(use_cache=use_cache, service=service, classes=classes)
+    return {f: open(os.path.join(dtj.DATA_DIR, f), 'rb').read() for f in sorted(os.listdir(dtj.DATA_DIR))}
+
+
+def _fake_drive():
+    files, roots = drive_fake.synthetic_tree(lessons=8, classes=2, lessons_per_topic=2, subfolders=1, seed=5)
+    service = drive_fake.FakeDriveService(files)
+    return service, drive_fake.fake_class_info(roots, current=2)
+
+
+def _check_edits_reach_the_output(crawl_dir, service, classes, between_runs=lambda: None, edits=None):
+    """
+    After each edit (default _edits) and between_runs(), crawl with the cache of the current
+    directory and compare with an uncached crawl.
+    """
+    cached_dir = os.getcwd()
+    for step, edit in enumerate(_edits(service) if edits is None else edits):
+        between_runs()
+        edit()
+        crawl_dir(f'uncached-{step}')
+        expected = _crawl(service, classes, use_cache=False)
+        os.chdir(cached_dir)
+        dtj.CACHE_STORE = None
+        assert _crawl(service, classes, use_cache=True) == expected, f'edit {step} did not reach the output'
+
+
+def test_edits_after_cache_size_cap_evictions(crawl_dir, monkeypatch):
+    # Small enough to evict on every collection, which runs at the end of every crawl
+    monkeypatch.setattr(dtj, 'CACHE_MAX_BYTES', 20000)
+    monkeypatch.setattr(dtj, 'CACHE_GC_INTERVAL_HOURS', 0)
+    service, classes = _fake_drive()
+    crawl_dir('cached')
+    _crawl(service, classes, use_cache=True)
+    _check_edits_reach_the_output(crawl_dir, service, classes)
+
+
+def test_edits_in_a_class_the_cache_never_crawled(crawl_dir):
+    service, classes = _fake_drive()
+    crawl_dir('uncached')
+    uncached = _crawl(service, classes, use_cache=False)
+    crawl_dir('cached')
+    # class-2.json comes from an uncached build (data/ checked in), and class 2 is held back
+    # (regenerate=False) in the first cached run, so the cache has none of its listings
+    os.makedirs(dtj.DATA_DIR, exist_ok=True)
+    for name, data in uncached.items():
+        with open(os.path.join(dtj.DATA_DIR, name), 'wb') as f:
+            f.write(data)
+    _crawl(service, [dict(cls, regenerate=cls['url_name'] != 'class-2') for cls in classes], use_cache=True)
+    _check_edits_reach_the_output(crawl_dir, service, classes)
+
+
+@pytest.mark.parametrize('migrate', [False, True], ids=['on-read', 'migrate-cache'])
+def test_edits_after_listings_are_invalidated_by_a_format_change(crawl_dir, monkeypatch, migrate):
+    monkeypatch.setattr(dtj, 'CACHE_GC_INTERVAL_HOURS', 0)
+    service, classes = _fake_drive()
+    crawl_dir('cached')
+    _crawl(service, classes, use_cache=True)
+    runs = []
+
+    def bump_listing_format_before_the_second_edit():
+        # A listing format without a migration from the previous one: every cached listing is
+        # dropped when read. The second edit is in class 1 only, class 2 has no Drive changes.
+        runs.append(True)
+        if len(runs) == 2:
+            monkeypatch.setitem(cache_migrations.FORMATS, 'listing', cache_migrations.FORMATS['listing'] + 1)
+            if migrate:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    dtj.migrate_cache()
+    _check_edits_reach_the_output(crawl_dir, service, classes, bump_listing_format_before_the_second_edit)
+
+
+def test_edits_below_a_listing_dropped_by_cache_gc(crawl_dir, monkeypatch):
+    monkeypatch.setattr(dtj, 'CACHE_GC_INTERVAL_HOURS', 0)
+    service, classes = _fake_drive()
+    crawl_dir('cached')
+    _crawl(service, classes, use_cache=True)
+    ids = _ids(service)
+    lesson_json_id = ids['lesson.json'][-1]
+    # A corrupt lesson listing in class 2: a run without changes in class 2 skips it, and the
+    # collection at its end drops the listing and sweeps the folders below it
+    with open(dtj.get_cache_store().listing_path(service.files_by_id[lesson_json_id]['parents'][0]), 'a') as f:
+        f.write('corrupt')
+    _check_edits_reach_the_output(crawl_dir, service, classes, edits=[
+        lambda: service.edit(ids['README.md'][0], content='# שיעור\n\nנערך'.encode('utf-8')),
+        lambda: service.remove(lesson_json_id),
+    ])
@@ -0,0 +1,61 @@
+"""
+generate_data writes the same class JSON files whatever the crawl mode: worker threads,
+batched requests and level-by-level listing only change how Drive is called, not the
+order of topics, lessons and content (see drive_to_class_json._map_ordered).
+"""
+import contextlib
+import io
+import os
+
+import pytest
+
+import drive_fake
+import drive_to_class_json as dtj
+
+MODES = {
+    'workers': {'workers': 8},
+    'batch': {'batch': True},
+    'bfs': {'bfs': True},
+    'workers+batch+bfs': {'workers': 8, 'batch': True, 'bfs': True},
+}
+
+
+def _edit(service):
+    """A few edits between two crawls: README rewrite, PDF rename, lesson folder rename, trashed file."""
+    by_name = {}
+    for record in sorted(service.files_by_id.values(), key=lambda f: f['id']):
+        by_name.setdefault(record['name'], record['id'])
+    service.edit(by_name['README.md'], content='# שיעור\n\nנערך'.encode('utf-8'))
+    service.edit(by_name['דף עבודה 2.pdf'], name='דף עבודה מעודכן.pdf')
+    service.edit(by_name['3 שיעור 3'], name='3 שיעור שלישי')
+    service.trash(by_name['הקלטה.mp4'])
+
+
+def _crawl_outputs(crawl_dir, name, options):
+    """Crawl a fresh fixture Drive cold, then again after _edit; the data/*.json bytes after each crawl."""
+    files, roots = drive_fake.synthetic_tree(lessons=24, classes=2, subfolders=2, seed=7)
+    service = drive_fake.FakeDriveService(files)
+    classes = drive_fake.fake_class_info(roots, current=2)
+    crawl_dir(name)
+    outputs = []
+    for edit in (False, True):
+        if edit:
+            _edit(service)
+        with contextlib.redirect_stdout(io.StringIO()):
+            written = dtj.generate_data(use_cache=True, service=service, classes=classes, **options)
+        assert written, 'no class JSON written'
+        outputs.append({f: open(os.path.join(dtj.DATA_DIR, f), 'rb').read() for f in sorted(os.listdir(dtj.DATA_DIR))})
+    return outputs
+
+
+@pytest.mark.parametrize('mode', sorted(MODES))
+def test_crawl_modes_write_the_same_json_as_the_sequential_crawl(crawl_dir, mode):
+    sequential = _crawl_outputs(crawl_dir, 'sequential', {'workers': 1})
+    other = _crawl_outputs(crawl_dir, mode.replace('+', '-'), MODES[mode])
+    assert sorted(sequential[0]) == ['class-class-1.json', 'class-class-2.json']
+    for before, after in zip(sequential, other):
+        assert before.keys() == after.keys()
+        for name in before:
+            assert after[name] == before[name], f'{name} differs from the sequential crawl ({mode})'
+    # The edits reached the output, so the second comparison is not of two unchanged files
+    assert sequential[0] != sequential[1]
@@ -0,0 +1,115 @@
+"""
+compute_affected_folder_ids (child -> parent index) against the scan algorithm it replaced,
+on recorded fixtures in fixtures/changes/<name>/: folder_listings/ is the listing cache of a
+drive_fake.synthetic_tree crawl, changes_api/ the changes Drive reported for a mix of edits made
+after it (content edit, rename, move, trash, delete, new file, folder rename and, in
+shared_folders, a file in a folder linked from several lessons and a shortcut rename).
+"""
+import os
+
+import pytest
+
+import cache_store
+import drive_changes
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'changes')
+FIXTURES = sorted(os.listdir(FIXTURES_DIR))
+
+
+def compute_affected_folder_ids_by_scan(changes_list, store):
+    """
+    The previous algorithm: re-read every cached listing and rebuild single-valued
+    child -> parent / shortcut -> target maps.
+    """
+    affected = set()
+
+    # Step 1: Gather directly affected folders from API changes
+    for change in changes_list:
+        file_id = change.get('fileId')
+        if not file_id:
+            continue
+        # A renamed lesson folder needs its own id in the affected list too
+        affected.add(file_id)
+        file_obj = change.get('file')
+        if file_obj and file_obj.get('parents'):
+            affected.update(file_obj['parents'])
+
+    # Step 2: Scan the cache for historic parents (deletions, renames, shortcut resolution)
+    child_to_parent = {}
+    shortcut_to_target = {}
+    for data in store.iter_listings():
+        items = data.get('items') or []
+        parent_id = data.get('folder_id')
+        if not parent_id:
+            continue
+        for item in items:
+            i_id = item.get('id')
+            s_id = item.get('shortcutId')
+            if i_id:
+                child_to_parent[i_id] = parent_id
+            if s_id:
+                child_to_parent[s_id] = parent_id
+                shortcut_to_target[s_id] = i_id
+        for change in changes_list:
+            c_id = change.get('fileId')
+            if c_id and any(i.get('id') == c_id or i.get('shortcutId') == c_id for i in items):
+                affected.add(parent_id)
+
+    # Step 2.5: A changed shortcut flags its target
+    affected.update({shortcut_to_target[f_id] for f_id in affected if f_id in shortcut_to_target})
+
+    # Step 3: Bubble up through the single recorded parent
+    ancestors = set()
+    for f_id in affected:
+        curr = f_id
+        for _ in range(50):
+            if curr not in child_to_parent:
+                break
+            p_id = child_to_parent[curr]
+            if p_id in ancestors or p_id in affected:
+                break
+            ancestors.add(p_id)
+            curr = p_id
+    affected.update(ancestors)
+    return affected
+
+
+def _fixture(name):
+    """(listing store, [changes list of each persisted changes file])."""
+    store = cache_store.FileCacheStore(os.path.join(FIXTURES_DIR, name, 'folder_listings'), None)
+    changes_dir = os.path.join(FIXTURES_DIR, name, 'changes_api')
+    changes_lists = [drive_changes.load_changes(os.path.join(changes_dir, f))['changes']
+                     for f in sorted(os.listdir(changes_dir)) if f.startswith(drive_changes.CHANGES_FILENAME_PREFIX)]
+    assert changes_lists
+    return store, changes_lists
+
+
+def _has_multi_parent_child(store):
+    """Whether some item (or shortcut) is listed in more than one cached folder."""
+    parents = {}
+    for data in store.iter_listings():
+        for item in data.get('items') or []:
+            for child_id in (item.get('id'), item.get('shortcutId')):
+                if child_id:
+                    parents.setdefault(child_id, set()).add(data.get('folder_id'))
+    return any(len(ids) > 1 for ids in parents.values())
+
+
+@pytest.mark.parametrize('name', FIXTURES)
+def test_indexed_result_contains_the_scan_result(name):
+    store, changes_lists = _fixture(name)
+    for changes_list in changes_lists:
+        indexed = drive_changes.compute_affected_folder_ids(changes_list, store)
+        scanned = compute_affected_folder_ids_by_scan(changes_list, store)
+        assert scanned <= indexed, f'folders found by the scan are missing: {sorted(scanned - indexed)}'
+        if not _has_multi_parent_child(store):
+            assert indexed == scanned
+
+
+def test_fixtures_cover_both_cases():
+    with_shared = [name for name in FIXTURES if _has_multi_parent_child(_fixture(name)[0])]
+    assert with_shared and len(with_shared) < len(FIXTURES)
+    # With multi-parent children the scan misses folders (it kept one parent per child); the index does not
+    store, changes_lists = _fixture(with_shared[0])
+    assert any(drive_changes.compute_affected_folder_ids(changes, store) > compute_affected_folder_ids_by_scan(changes, store)
+               for changes in changes_lists)
@@ -0,0 +1,43 @@
+"""
+Classes that cannot be crawled (here: the Drive call budget runs out) keep their last good JSON,
+and generate_data reports them instead of a completed run.
+"""
+import contextlib
+import io
+import os
+
+import drive_fake
+import drive_to_class_json as dtj
+
+
+def _crawl(service, classes, **options):
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+        written = dtj.generate_data(service=service, classes=classes, **options)
+    return written, out.getvalue()
+
+
+def _outputs():
+    return {f: open(os.path.join(dtj.DATA_DIR, f), 'rb').read() for f in sorted(os.listdir(dtj.DATA_DIR))}
+
+
+def test_a_run_where_every_class_fails_is_not_reported_as_complete(crawl_dir):
+    files, roots = drive_fake.synthetic_tree(lessons=8, classes=2, lessons_per_topic=2, subfolders=1, seed=5)
+    service = drive_fake.FakeDriveService(files)
+    classes = drive_fake.fake_class_info(roots, current=2)
+    crawl_dir('last-good')
+    written, output = _crawl(service, classes, use_cache=False)
+    assert len(written) == 2 and 'All classes processed. JSON generation complete.' in output
+    last_good = _outputs()
+
+    # A cold crawl (empty cache/) takes a few dozen calls
+    crawl_dir('budget')
+    os.makedirs(dtj.DATA_DIR)
+    for name, data in last_good.items():
+        with open(os.path.join(dtj.DATA_DIR, name), 'wb') as f:
+            f.write(data)
+    written, output = _crawl(service, classes, use_cache=True, call_budget=8)
+    assert written == []
+    assert '0 of 2 classes crawled; kept last good JSON for class-' in output
+    assert 'JSON generation complete' not in output
+    assert _outputs() == last_good